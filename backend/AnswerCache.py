@@ -0,0 +1,142 @@
+import itertools
+import json
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+class CachedAnswer:
+    def __init__(self, query: str, vector, answer: str, docs):
+        self.query = query
+        self.vector = vector
+        self.answer = answer
+        self.docs = docs
+
+
+class AnswerProbe:
+    """Result of a cache lookup, kept by the turn to store its answer later."""
+
+    def __init__(self, corpus: str, scope: str, vector, hit=None):
+        self.corpus = corpus
+        self.scope = scope
+        self.vector = vector
+        self.hit: Optional[CachedAnswer] = hit
+
+
+class AnswerCache:
+    """
+    In-memory semantic cache of generated answers.
+
+    Answers are matched by cosine similarity of the query embedding (above
+    similarity_threshold) among the answers given for the same reading
+    position. Everything is dropped when the fingerprint of the active corpus
+    (corpus_fingerprint(), e.g. FileRegistry.active_fingerprint) changes, i.e.
+    on uploads, toggles and deletions. Bounded to max_entries, least recently
+    used first out.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        corpus_fingerprint: Callable[[], str],
+        similarity_threshold: float = 0.95,
+        max_entries: int = 1000,
+    ):
+        self.embeddings = embeddings
+        self.corpus_fingerprint = corpus_fingerprint
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._corpus = None
+        self._scopes = {}  # scope -> {entry id: CachedAnswer}
+        self._lru = OrderedDict()  # entry id -> scope, least recently used first
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _scope(read_up_to: Optional[list]) -> str:
+        return json.dumps(read_up_to or [], sort_keys=True)
+
+    def _check_corpus(self, corpus: str):
+        if corpus != self._corpus:
+            if self._lru:
+                self.invalidations += 1
+            self._corpus = corpus
+            self._scopes.clear()
+            self._lru.clear()
+
+    def lookup(self, query: str, read_up_to: Optional[list] = None) -> AnswerProbe:
+        """
+        Look for the answer of a similar query. Blocking (embeds the query).
+        The probe's hit is the cached answer, or None on a miss.
+        """
+        corpus = self.corpus_fingerprint()
+        scope = self._scope(read_up_to)
+        vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        probe = AnswerProbe(corpus, scope, vector)
+
+        with self._lock:
+            self._check_corpus(corpus)
+            entries = self._scopes.get(scope)
+            if entries:
+                entry_ids = list(entries)
+                vectors = np.stack([entries[i].vector for i in entry_ids])
+                similarities = vectors @ vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.similarity_threshold:
+                    entry_id = entry_ids[best]
+                    self._lru.move_to_end(entry_id)
+                    probe.hit = entries[entry_id]
+            if probe.hit is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return probe
+
+    def store(self, probe: AnswerProbe, query: str, answer: str, docs):
+        """Cache the answer generated after a miss."""
+        if not answer:
+            return
+        # The corpus changed while the answer was generated: it may be stale
+        if self.corpus_fingerprint() != probe.corpus:
+            return
+        with self._lock:
+            self._check_corpus(probe.corpus)
+            entry_id = next(self._ids)
+            self._scopes.setdefault(probe.scope, {})[entry_id] = CachedAnswer(
+                query, probe.vector, answer, docs
+            )
+            self._lru[entry_id] = probe.scope
+            while len(self._lru) > self.max_entries:
+                oldest, scope = self._lru.popitem(last=False)
+                entries = self._scopes[scope]
+                del entries[oldest]
+                if not entries:
+                    del self._scopes[scope]
+
+    def clear(self):
+        with self._lock:
+            self._scopes.clear()
+            self._lru.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._lru),
+                "max_entries": self.max_entries,
+                "scopes": len(self._scopes),
+                "similarity_threshold": self.similarity_threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,163 @@
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, Optional, Tuple
+
+from langchain_core.embeddings import Embeddings
+
+from Metrics import embedding_batch_seconds, embedding_retries_total
+
+logger = logging.getLogger(__name__)
+
+# Error markers of provider rate limits and transient failures
+RETRYABLE_MARKERS = (
+    "429",
+    "resource_exhausted",
+    "resource exhausted",
+    "quota",
+    "rate limit",
+    "internal error",
+    "unavailable",
+    "deadline",
+    "timeout",
+    "timed out",
+)
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    message = f"{type(error).__name__} {error}".lower()
+    return any(marker in message for marker in RETRYABLE_MARKERS)
+
+
+def is_rate_limit(error: Exception) -> bool:
+    message = str(error).lower()
+    return any(
+        marker in message
+        for marker in ("429", "resource_exhausted", "resource exhausted", "quota")
+    )
+
+
+class TokenBucket:
+    """Thread-safe token bucket limiting the rate of embedding requests."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate  # Tokens added per second
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    def acquire(self, tokens: float = 1.0):
+        """Block until the tokens are available."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self._paused_until and self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = max(
+                    self._paused_until - now, (tokens - self._tokens) / self.rate
+                )
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """Stop handing out tokens for a while (provider asked us to back off)."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class BatchEmbedder:
+    """
+    Embeds chunks for ingestion in batches, with at most max_in_flight requests
+    running at once, a requests-per-second token bucket, and retries with
+    exponential backoff and full jitter. A rate-limit error pauses the bucket
+    so every in-flight job backs off, not only the request that failed.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        batch_size: int = 64,
+        max_in_flight: int = 4,
+        requests_per_second: float = 5.0,
+        max_retries: int = 5,
+        base_delay: float = 1.0,
+        max_delay: float = 30.0,
+    ):
+        self.embeddings = embeddings
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rate_limiter = TokenBucket(requests_per_second)
+        # Shared by all jobs, so max_in_flight is a process-wide bound
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_in_flight, thread_name_prefix="embedder"
+        )
+
+    def _embed_with_retry(self, texts: list) -> list:
+        attempt = 0
+        started = time.monotonic()
+        while True:
+            self.rate_limiter.acquire()
+            try:
+                vectors = self.embeddings.embed_documents(texts)
+                embedding_batch_seconds.observe(time.monotonic() - started)
+                return vectors
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                delay = random.uniform(
+                    0, min(self.max_delay, self.base_delay * 2**attempt)
+                )
+                if is_rate_limit(e):
+                    self.rate_limiter.pause(delay)
+                logger.warning(
+                    "Embedding batch of %d failed (%s), retry %d/%d in %.1fs",
+                    len(texts),
+                    e,
+                    attempt + 1,
+                    self.max_retries,
+                    delay,
+                )
+                embedding_retries_total.inc()
+                time.sleep(delay)
+                attempt += 1
+
+    def embed_batches(
+        self, batches: Iterable[Tuple[object, list]]
+    ) -> Iterator[Tuple[object, list, list]]:
+        """
+        Embed (key, texts) batches concurrently and yield (key, texts, vectors)
+        in input order, so callers can commit each batch as it completes.
+        Stopping the iteration cancels the batches not started yet.
+        """
+        pending = deque()
+        try:
+            for key, texts in batches:
+                pending.append(
+                    (key, texts, self._executor.submit(self._embed_with_retry, texts))
+                )
+                if len(pending) >= self.max_in_flight:
+                    key, texts, future = pending.popleft()
+                    yield key, texts, future.result()
+            while pending:
+                key, texts, future = pending.popleft()
+                yield key, texts, future.result()
+        finally:
+            for _, _, future in pending:
+                future.cancel()
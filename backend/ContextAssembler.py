@@ -0,0 +1,135 @@
+import threading
+from typing import Optional
+
+
+class ContextAssembler:
+    """
+    Builds the context of the generation prompt from the ranked chunks.
+
+    Chunks of the same file that overlap (the text splitter's chunk_overlap)
+    or nearly touch are merged by their char_offset/char_end into one span,
+    so repeated text is sent once; exact duplicates are dropped. Spans are
+    then packed best-ranked first (a span ranks as its best chunk) into
+    token_budget tokens, skipping spans that don't fit. Tokens are estimated
+    as chars_per_token characters each.
+    """
+
+    def __init__(
+        self,
+        token_budget: int = 1500,
+        chars_per_token: float = 4.0,
+        max_gap: int = 2,  # Chars between chunks still considered adjacent
+        separator: str = "\n\n",
+    ):
+        self.token_budget = token_budget
+        self.chars_per_token = chars_per_token
+        self.max_gap = max_gap
+        self.separator = separator
+        self.contexts = 0
+        self.chunks_in = 0
+        self.spans_out = 0
+        self.spans_dropped = 0
+        self.tokens_in = 0
+        self.tokens_out = 0
+        self._lock = threading.Lock()
+
+    def count_tokens(self, text: str) -> int:
+        return int(len(text) / self.chars_per_token + 0.5)
+
+    @staticmethod
+    def _position(doc) -> Optional[tuple]:
+        metadata = doc.metadata or {}
+        file_id = metadata.get("file_id")
+        start, end = metadata.get("char_offset"), metadata.get("char_end")
+        if file_id is None or start is None or end is None:
+            return None
+        return file_id, start, end
+
+    def merge(self, docs) -> list:
+        """
+        Merge the chunks (best ranked first) into spans, returned as
+        (rank, text) in rank order.
+        """
+        spans = []  # [rank, text]
+        by_file = {}  # file_id -> [(start, end, rank, text)]
+        seen_texts = set()
+        for rank, doc in enumerate(docs):
+            position = self._position(doc)
+            if position is None:
+                # Chunks stored before offsets were recorded: only drop copies
+                if doc.page_content not in seen_texts:
+                    seen_texts.add(doc.page_content)
+                    spans.append((rank, doc.page_content))
+                continue
+            file_id, start, end = position
+            by_file.setdefault(file_id, []).append(
+                (start, end, rank, doc.page_content)
+            )
+
+        for pieces in by_file.values():
+            pieces.sort()
+            start, end, rank, text = pieces[0]
+            for piece in pieces[1:]:
+                next_start, next_end, next_rank, next_text = piece
+                if next_start > end + self.max_gap:
+                    spans.append((rank, text))
+                    start, end, rank, text = piece
+                    continue
+                if next_end > end:
+                    if next_start >= end:
+                        # Adjacent: the splitter stripped the whitespace between
+                        text += " " + next_text if next_start > end else next_text
+                    else:
+                        text += next_text[end - next_start :]
+                    end = next_end
+                rank = min(rank, next_rank)
+            spans.append((rank, text))
+
+        spans.sort(key=lambda span: span[0])
+        return spans
+
+    def assemble(self, docs) -> str:
+        spans = self.merge(docs)
+        packed, used, dropped = [], 0, 0
+        separator_tokens = self.count_tokens(self.separator)
+        for _, text in spans:
+            tokens = self.count_tokens(text) + (separator_tokens if packed else 0)
+            if used + tokens > self.token_budget:
+                dropped += 1
+                continue
+            packed.append(text)
+            used += tokens
+        if not packed and spans:
+            # Not even the best span fits: keep its beginning
+            max_chars = int(self.token_budget * self.chars_per_token)
+            packed.append(spans[0][1][:max_chars])
+            dropped -= 1
+        context = self.separator.join(packed)
+
+        with self._lock:
+            self.contexts += 1
+            self.chunks_in += len(docs)
+            self.spans_out += len(packed)
+            self.spans_dropped += dropped
+            self.tokens_in += self.count_tokens(
+                self.separator.join(doc.page_content for doc in docs)
+            )
+            self.tokens_out += self.count_tokens(context)
+        return context
+
+    def stats(self) -> dict:
+        with self._lock:
+            contexts = max(self.contexts, 1)
+            return {
+                "token_budget": self.token_budget,
+                "chars_per_token": self.chars_per_token,
+                "contexts": self.contexts,
+                "avg_chunks_in": self.chunks_in / contexts,
+                "avg_spans_out": self.spans_out / contexts,
+                "spans_dropped": self.spans_dropped,
+                "avg_tokens_in": self.tokens_in / contexts,
+                "avg_tokens_out": self.tokens_out / contexts,
+                "token_reduction": (
+                    1 - self.tokens_out / self.tokens_in if self.tokens_in else 0.0
+                ),
+            }
@@ -1,42 +1,229 @@
+import bisect
+import math
+import multiprocessing
+import os
+import re
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Optional
+
 import fitz
 from fastapi import HTTPException, status
+from langchain_core.documents import Document
 
+from StageTimings import timed
 
-class DocProcessing:
-    def __init__(self, file_path: str, file_content: bytes):
-        self.file_path = file_path
-        self.file_content = file_content
+# PDFs with at least this many pages are extracted by a process pool
+PARALLEL_MIN_PAGES = 200
+MAX_PDF_WORKERS = 8
+MIN_PAGES_PER_RANGE = 16
+
+# Whitespace runs that may change: any run starting with a line break, or a
+# space followed by more whitespace. A single space is only matched when a
+# number follows it (possible "Chapter 3" heading); other single spaces, the
+# bulk of the text, are skipped by the regex engine itself.
+_RUN_PATTERN = re.compile(r"[\r\n][ \r\n]*| (?:[ \r\n]+|(?=\d))")
+_LINE_ENDINGS = re.compile(r"\r\n?")
+_EXCESS_NEWLINES = re.compile(r"\n{3,}")
+_SPACES = re.compile(r" {2,}")
+_HEADING_WORDS = ("Chapter", "CHAPTER", "Section", "SECTION")
+_HEADING_WORD_LENGTH = 7
+_WHITESPACE = " \r\n"
+_SENTENCE_END = ".!?"
+
+_KEYWORD_PATTERN = re.compile(r"\w+")
+
+# Chapter headings in formatted text (the formatter puts them on a new line)
+_CHAPTER_HEADING = re.compile(r"(?<![^\n])(?:Chapter|CHAPTER) (\d+)")
 
-    def text_formatter(self, file_str: str) -> str:
-        # Improve text formatting to preserve natural breaks for better chunking
-        import re
 
-        # First, normalize line endings
-        formatted_text = file_str.replace("\r\n", "\n").replace("\r", "\n")
+@lru_cache(maxsize=4096)
+def _normalize_run(run: str, after_sentence_end: bool, before_uppercase: bool) -> str:
+    """
+    Normalize one maximal run of spaces/line breaks, given whether the char
+    before it ends a sentence and whether the char after it is uppercase:
+    - CR/CRLF line endings become LF, and 3+ line breaks a paragraph break (2)
+    - a single line break becomes a space, unless it ends a sentence or the
+      next line starts with an uppercase letter
+    - repeated spaces collapse into one
+    """
+    run = _EXCESS_NEWLINES.sub("\n\n", _LINE_ENDINGS.sub("\n", run))
+    last = len(run) - 1
+    chars = []
+    for i, char in enumerate(run):
+        if char == "\n":
+            following = run[i + 1] if i < last else None
+            keep = (
+                following == "\n"
+                or (i == 0 and after_sentence_end)
+                or (following is None and before_uppercase)
+            )
+            chars.append("\n" if keep else " ")
+        else:
+            chars.append(char)
+    return _SPACES.sub(" ", "".join(chars))
+
+
+class TextNormalizer:
+    """
+    Single-pass text normalizer for extracted book text. Patterns are compiled
+    once; only whitespace runs that can change are visited, and each distinct
+    run is normalized once (cached). A paragraph break is added before
+    "Chapter N"/"Section N" headings. Output is identical to the original
+    five-pass regex formatter.
+    """
+
+    def normalize(self, text: str) -> str:
+        return self._normalize_span(text, 0, len(text), at_document_start=True).strip()
 
-        # Remove excessive whitespace but preserve paragraph structure
-        # Replace 3+ consecutive newlines with exactly 2 newlines (paragraph breaks)
-        formatted_text = re.sub(r"\n{3,}", "\n\n", formatted_text)
+    def iter_normalize(self, pieces):
+        """
+        Normalize text arriving in pieces (e.g. pages). Joining the output gives
+        exactly normalize("".join(pieces)), while only a small tail is buffered.
+        """
+        context = ""  # Last char already normalized, for the sentence-end rule
+        carry = ""
+        started = False  # Non-whitespace emitted yet (leading strip)
+        pending = ""  # Trailing whitespace held back (trailing strip)
 
-        # Keep double newlines as paragraph separators
-        # For single newlines, replace with space only if they're not at the end of sentences
-        # This preserves natural sentence and paragraph boundaries
-        formatted_text = re.sub(r"(?<![.!?])\n(?![A-Z\n])", " ", formatted_text)
+        def emit(normalized: str) -> str:
+            nonlocal started, pending
+            if not started:
+                normalized = normalized.lstrip()
+                if not normalized:
+                    return ""
+                started = True
+            stripped = normalized.rstrip()
+            if not stripped:
+                pending += normalized
+                return ""
+            output = pending + stripped
+            pending = normalized[len(stripped) :]
+            return output
 
-        # Clean up multiple spaces but keep single spaces
-        formatted_text = re.sub(r" {2,}", " ", formatted_text)
+        for piece in pieces:
+            buffer = context + carry + piece
+            cut = self._safe_cut(buffer, len(context))
+            if cut is None:
+                carry = buffer[len(context) :]
+                continue
+            output = emit(
+                self._normalize_span(
+                    buffer, len(context), cut, at_document_start=not context
+                )
+            )
+            if output:
+                yield output
+            context, carry = buffer[cut - 1], buffer[cut:]
 
-        # Ensure there are paragraph breaks for better chunking
-        # Add paragraph breaks before common chapter/section indicators
-        formatted_text = re.sub(
-            r"(?<!^)(?=Chapter \d+|CHAPTER \d+|Section \d+|SECTION \d+)",
-            "\n\n",
-            formatted_text,
+        buffer = context + carry
+        output = emit(
+            self._normalize_span(
+                buffer, len(context), len(buffer), at_document_start=not context
+            )
         )
+        if output:
+            yield output
 
-        return formatted_text.strip()
+    @staticmethod
+    def _safe_cut(buffer: str, start: int):
+        # Cut at the end of the last whitespace run followed by more text in
+        # the buffer: everything before it has all the context it needs, and
+        # the carried-over tail starts with a whole word
+        i = len(buffer.rstrip(_WHITESPACE)) - 1
+        while i >= start and buffer[i] not in _WHITESPACE:
+            i -= 1
+        return i + 1 if i >= start else None
 
-    def process_doc(self) -> str:
+    def _normalize_span(
+        self, text: str, start: int, cut: int, at_document_start: bool
+    ) -> str:
+        # Normalize text[start:cut]; the text around it is only read as context
+        parts = []
+        position = start
+        for match in _RUN_PATTERN.finditer(text, start):
+            run_start, run_end = match.span()
+            if run_start >= cut:
+                break
+            segment = text[position:run_start]
+            next_char = text[run_end] if run_end < len(text) else ""
+            normalized = _normalize_run(
+                match.group(),
+                run_start > 0 and text[run_start - 1] in _SENTENCE_END,
+                "A" <= next_char <= "Z",
+            )
+            # Paragraph break before headings, except at the document start
+            if (
+                normalized == " "
+                and next_char.isdecimal()
+                and segment.endswith(_HEADING_WORDS)
+                and not (at_document_start and run_start == _HEADING_WORD_LENGTH)
+            ):
+                segment = (
+                    segment[:-_HEADING_WORD_LENGTH]
+                    + "\n\n"
+                    + segment[-_HEADING_WORD_LENGTH:]
+                )
+            parts.append(segment)
+            parts.append(normalized)
+            position = run_end
+        parts.append(text[position:cut])
+        return "".join(parts)
+
+
+text_normalizer = TextNormalizer()
+
+
+def keyword_tokens(text: str) -> set:
+    """Lowercased word tokens of a text, for keyword-overlap ranking."""
+    return set(_KEYWORD_PATTERN.findall(text.lower()))
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char == "_"
+
+
+def keyword_matches(text: str, tokens: set) -> int:
+    """
+    How many of the tokens (from keyword_tokens) are words of the text. Found
+    with str.find plus a word-boundary check, without tokenizing the text.
+    """
+    text = text.lower()
+    matches = 0
+    for token in tokens:
+        position = text.find(token)
+        while position >= 0:
+            end = position + len(token)
+            if (position == 0 or not _is_word_char(text[position - 1])) and (
+                end == len(text) or not _is_word_char(text[end])
+            ):
+                matches += 1
+                break
+            position = text.find(token, position + 1)
+    return matches
+
+
+def keyword_counts(text: str) -> Counter:
+    """Lowercased word tokens of a text with their counts, for BM25."""
+    return Counter(_KEYWORD_PATTERN.findall(text.lower()))
+
+
+class DocProcessing:
+    def __init__(self, file_path: str, file_content: bytes):
+        self.file_path = file_path
+        self.file_content = file_content
+
+    def text_formatter(self, file_str: str) -> str:
+        # Improve text formatting to preserve natural breaks for better chunking
+        return text_normalizer.normalize(file_str)
+
+    def iter_pages(self, on_page=None, max_workers=None):
+        """
+        Yield the raw text of the file page by page (a .txt file is one page).
+        Large PDFs are extracted by a process pool, split into page ranges.
+        on_page(pages_parsed, pages_total) is called as pages are extracted.
+        """
         if self.file_path.endswith(".txt"):
             try:
                 file_str = self.file_content.decode("utf-8")
@@ -45,23 +232,204 @@ class DocProcessing:
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail="Could not decode file contents as UTF-8",
                 )
+            if on_page:
+                on_page(1, 1)
+            yield file_str
         elif self.file_path.endswith(".pdf"):
             try:
                 doc = fitz.open(stream=self.file_content, filetype="pdf")
-                file_str = ""
-                for page in doc:
-                    file_str += page.get_text()
-                doc.close()
             except Exception as e:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail=f"Could not process PDF file: {str(e)}",
                 )
+            try:
+                pages_total = doc.page_count
+                workers = max_workers or min(os.cpu_count() or 1, MAX_PDF_WORKERS)
+                if workers > 1 and pages_total >= PARALLEL_MIN_PAGES:
+                    page_texts = self._iter_pages_parallel(pages_total, workers)
+                else:
+                    page_texts = (page.get_text() for page in doc)
+
+                for page_number, page_text in enumerate(page_texts, start=1):
+                    if on_page:
+                        on_page(page_number, pages_total)
+                    yield page_text
+            except Exception as e:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Could not process PDF file: {str(e)}",
+                )
+            finally:
+                doc.close()
         else:
             raise HTTPException(
                 status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
                 detail="Unsupported file type",
             )
+
+    def _iter_pages_parallel(self, pages_total: int, workers: int):
+        # Several ranges per worker to balance uneven pages
+        range_size = max(
+            MIN_PAGES_PER_RANGE, math.ceil(pages_total / (workers * 4))
+        )
+        page_ranges = [
+            (start, min(start + range_size, pages_total))
+            for start in range(0, pages_total, range_size)
+        ]
+        # Spawn (not fork): we may be running inside a threaded server
+        executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_page_worker,
+            initargs=(self.file_content,),
+        )
+        try:
+            for page_texts in executor.map(_extract_page_range, page_ranges):
+                yield from page_texts
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _iter_formatted(self, on_page=None, max_workers=None):
+        """
+        Format page by page, never the whole document at once. Yields
+        (page_number, text), page_number being the page read when the text was
+        produced: the text starts on that page, give or take the last word of
+        the previous one.
+        """
+        page_number = 0
+
+        def pages():
+            nonlocal page_number
+            for page_number, page_text in enumerate(
+                self.iter_pages(on_page, max_workers), start=1
+            ):
+                yield page_text
+
+        for text in text_normalizer.iter_normalize(pages()):
+            yield page_number, text
+
+    def iter_chunks(
+        self,
+        text_splitter,
+        on_page=None,
+        max_workers=None,
+        window: int = 16_000,
+        timings: Optional[dict] = None,
+    ):
+        """
+        Stream the file as chunks without building the full document string.
+        Formatted text goes through a rolling buffer of about `window` chars;
+        the buffer is split and every chunk but the last is emitted (the last
+        one may continue in the next pages).
+
+        Yields Documents with the chunk's reading position as metadata:
+        char_offset/char_end in the formatted text, the pages (page, page_end)
+        and chapters (chapter, chapter_end) it spans. Chapters are numbered by
+        their "Chapter N" headings, counting only the next chapter in sequence
+        so cross-references don't move the position; 0 is the text before the
+        first chapter.
+
+        The time spent splitting and building chunks (not parsing pages) is
+        added to timings["chunk"], in ms, when a dict is given.
+        """
+        timings = timings if timings is not None else {}
+        buffer = ""
+        buffer_offset = 0  # Offset of the buffer start in the formatted text
+        emitted = 0
+        page_starts, page_numbers = [], []
+        chapter_starts, chapter_numbers = [0], [0]
+        scanned = 0  # Formatted text scanned for chapter headings
+
+        def scan_chapters(final: bool):
+            nonlocal scanned
+            for match in _CHAPTER_HEADING.finditer(
+                buffer, max(scanned - buffer_offset, 0)
+            ):
+                # A heading number at the end of the buffer may continue
+                if not final and match.end() == len(buffer):
+                    break
+                # Repeated matches in the rescanned tail are out of sequence
+                if int(match.group(1)) == chapter_numbers[-1] + 1:
+                    chapter_starts.append(buffer_offset + match.start())
+                    chapter_numbers.append(chapter_numbers[-1] + 1)
+            # Rescan the tail next time, a heading may be split across texts
+            scanned = buffer_offset + max(len(buffer) - 16, 0)
+
+        def position_at(starts, numbers, offset):
+            return numbers[max(bisect.bisect_right(starts, offset) - 1, 0)]
+
+        def chunk_documents(chunks, upto):
+            nonlocal emitted
+            cursor = 0
+            for chunk in chunks[:upto]:
+                with timed(timings, "chunk"):
+                    position = buffer.find(chunk, cursor)
+                    if position < 0:
+                        position = cursor
+                    cursor = position + 1
+                    emitted += 1
+                    char_offset = buffer_offset + position
+                    char_end = char_offset + len(chunk)
+                    last_char = max(char_end - 1, char_offset)
+                    document = Document(
+                        page_content=chunk,
+                        metadata={
+                            "char_offset": char_offset,
+                            "char_end": char_end,
+                            "page": position_at(page_starts, page_numbers, char_offset),
+                            "page_end": position_at(
+                                page_starts, page_numbers, last_char
+                            ),
+                            "chapter": position_at(
+                                chapter_starts, chapter_numbers, char_offset
+                            ),
+                            "chapter_end": position_at(
+                                chapter_starts, chapter_numbers, last_char
+                            ),
+                        },
+                    )
+                yield document
+
+        for page_number, text in self._iter_formatted(on_page, max_workers):
+            if not page_numbers or page_number != page_numbers[-1]:
+                page_starts.append(buffer_offset + len(buffer))
+                page_numbers.append(page_number)
+            buffer += text
+            if len(buffer) < window:
+                continue
+
+            with timed(timings, "chunk"):
+                scan_chapters(final=False)
+                chunks = text_splitter.split_text(buffer)
+            if len(chunks) < 2:
+                continue
+            yield from chunk_documents(chunks, -1)
+
+            # Keep the last chunk in the buffer, it may continue in the next pages
+            last_position = buffer.rfind(chunks[-1])
+            if last_position > 0:
+                buffer_offset += last_position
+                buffer = buffer[last_position:]
+
+        if buffer:
+            with timed(timings, "chunk"):
+                scan_chapters(final=True)
+                chunks = text_splitter.split_text(buffer)
+            yield from chunk_documents(chunks, len(chunks))
+
+        if emitted == 0:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="File is empty",
+            )
+
+    def process_doc(self, on_page=None) -> str:
+        """
+        Extract and format the text of the file. on_page(pages_parsed, pages_total)
+        is called as pages are extracted, to report progress.
+        """
+        file_str = "".join(self.iter_pages(on_page))
         final_file_str = self.text_formatter(file_str)
 
         if len(final_file_str) < 1:
@@ -71,3 +439,17 @@ class DocProcessing:
             )
 
         return final_file_str
+
+
+# Process pool workers for large PDFs: each one opens the document once
+_worker_doc = None
+
+
+def _init_page_worker(file_content: bytes):
+    global _worker_doc
+    _worker_doc = fitz.open(stream=file_content, filetype="pdf")
+
+
+def _extract_page_range(page_range):
+    start, end = page_range
+    return [_worker_doc[page_number].get_text() for page_number in range(start, end)]
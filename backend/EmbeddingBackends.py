@@ -0,0 +1,195 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# Backend used when EMBEDDING_BACKEND is not set, and its model
+DEFAULT_BACKEND = "google"
+DEFAULT_GOOGLE_MODEL = "models/embedding-001"
+
+
+class OnnxEncoder:
+    """
+    Sentence embedding model (e.g. an all-MiniLM-L6-v2 export) run on CPU with
+    ONNX Runtime. model_dir holds the model (model.onnx, or model_file) and its
+    tokenizer.json. Token embeddings are mean-pooled and L2-normalized.
+    """
+
+    def __init__(
+        self,
+        model_dir: str,
+        model_file: str = "model.onnx",
+        max_length: int = 256,
+        threads: int = 0,  # 0 lets ONNX Runtime use all cores
+    ):
+        # Optional dependencies, only needed for the local backend
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        self.tokenizer = Tokenizer.from_file(
+            os.path.join(model_dir, "tokenizer.json")
+        )
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_dir, model_file),
+            sess_options=options,
+            providers=["CPUExecutionProvider"],
+        )
+        self._input_names = {
+            model_input.name for model_input in self.session.get_inputs()
+        }
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        attention_mask = np.array([e.attention_mask for e in encodings], np.int64)
+        inputs = {
+            "input_ids": np.array([e.ids for e in encodings], np.int64),
+            "attention_mask": attention_mask,
+            "token_type_ids": np.array([e.type_ids for e in encodings], np.int64),
+        }
+        output = self.session.run(
+            None,
+            {
+                name: value
+                for name, value in inputs.items()
+                if name in self._input_names
+            },
+        )[0]
+        if output.ndim == 3:
+            # Token embeddings: average over the real (unpadded) tokens
+            mask = attention_mask[:, :, None].astype(output.dtype)
+            output = (output * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        norms = np.linalg.norm(output, axis=1, keepdims=True)
+        return output / np.maximum(norms, 1e-12)
+
+
+# Model of each worker process of OnnxEmbeddings, loaded once per process
+_worker_encoder: Optional[OnnxEncoder] = None
+
+
+def _init_worker(model_dir: str, model_file: str, max_length: int, threads: int):
+    global _worker_encoder
+    _worker_encoder = OnnxEncoder(model_dir, model_file, max_length, threads)
+
+
+def _encode_in_batches(encoder: OnnxEncoder, texts: List[str], batch_size: int):
+    return np.concatenate(
+        [
+            encoder.encode(texts[start : start + batch_size])
+            for start in range(0, len(texts), batch_size)
+        ]
+    )
+
+
+def _worker_encode(texts: List[str], batch_size: int) -> np.ndarray:
+    return _encode_in_batches(_worker_encoder, texts, batch_size)
+
+
+class OnnxEmbeddings(Embeddings):
+    """
+    Local CPU embeddings (OnnxEncoder), so ingestion and search work offline.
+
+    Documents are encoded in batches of batch_size. With processes > 1, large
+    calls are split into contiguous shards encoded by a pool of worker
+    processes, each holding its own copy of the model; queries are always
+    encoded in-process.
+    """
+
+    def __init__(
+        self,
+        model_dir: str,
+        model_file: str = "model.onnx",
+        batch_size: int = 32,
+        processes: int = 1,
+        max_length: int = 256,
+    ):
+        self.model_dir = model_dir
+        self.model_file = model_file
+        self.batch_size = batch_size
+        self.processes = processes
+        self.max_length = max_length
+        self.encoder = OnnxEncoder(model_dir, model_file, max_length)
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # Each worker gets an equal share of the cores
+            threads = max(1, (os.cpu_count() or 1) // self.processes)
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.processes,
+                # Spawned, not forked: the parent holds threads and a session
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.model_dir, self.model_file, self.max_length, threads),
+            )
+        return self._pool
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        if self.processes <= 1 or len(texts) <= self.batch_size:
+            vectors = _encode_in_batches(self.encoder, texts, self.batch_size)
+        else:
+            shard_size = -(-len(texts) // self.processes)
+            shards = [
+                texts[start : start + shard_size]
+                for start in range(0, len(texts), shard_size)
+            ]
+            vectors = np.concatenate(
+                list(
+                    self._get_pool().map(
+                        _worker_encode, shards, [self.batch_size] * len(shards)
+                    )
+                )
+            )
+        return vectors.tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.encoder.encode([text])[0].tolist()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+
+def embedding_backend() -> str:
+    return os.getenv("EMBEDDING_BACKEND", DEFAULT_BACKEND).lower()
+
+
+def load_embeddings():
+    """
+    Embedding backend selected by the environment, and its model name (used to
+    key cached vectors):
+
+    - EMBEDDING_BACKEND=google (default): Gemini embeddings, EMBEDDING_MODEL
+      defaults to models/embedding-001.
+    - EMBEDDING_BACKEND=onnx: local CPU model, EMBEDDING_MODEL is the model
+      directory. EMBEDDING_PROCESSES worker processes encode large batches.
+    """
+    backend = embedding_backend()
+    if backend == "google":
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+        model_name = os.getenv("EMBEDDING_MODEL", DEFAULT_GOOGLE_MODEL)
+        return GoogleGenerativeAIEmbeddings(model=model_name), model_name
+    if backend == "onnx":
+        model_dir = os.getenv("EMBEDDING_MODEL")
+        if not model_dir:
+            raise ValueError("EMBEDDING_BACKEND=onnx needs EMBEDDING_MODEL (model dir)")
+        embeddings = OnnxEmbeddings(
+            model_dir,
+            model_file=os.getenv("EMBEDDING_MODEL_FILE", "model.onnx"),
+            batch_size=int(os.getenv("EMBEDDING_BATCH_SIZE", "32")),
+            processes=int(os.getenv("EMBEDDING_PROCESSES", "1")),
+        )
+        # Keyed by the model directory name, e.g. onnx/all-MiniLM-L6-v2
+        return embeddings, f"onnx/{os.path.basename(os.path.normpath(model_dir))}"
+    raise ValueError(f"Unknown EMBEDDING_BACKEND: {backend}")
@@ -0,0 +1,149 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from array import array
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Content-addressed, persistent cache in front of an embedding model.
+
+    Vectors are stored in SQLite keyed by hash(model name, kind, text), so the
+    same chunk is only embedded once across uploads, duplicate editions and
+    re-chunking. The cache is bounded to max_entries, evicting the least
+    recently used vectors.
+    """
+
+    # Max variables per SQLite statement (older builds limit it to 999)
+    _SQL_BATCH = 500
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        model_name: str,
+        db_path: str,
+        max_entries: int = 500_000,
+    ):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS embeddings (
+                    key TEXT PRIMARY KEY,
+                    vector BLOB NOT NULL,
+                    last_used REAL NOT NULL
+                )"""
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings (last_used)"
+            )
+            self._entries = self._conn.execute(
+                "SELECT COUNT(*) FROM embeddings"
+            ).fetchone()[0]
+
+    def _key(self, kind: str, text: str) -> str:
+        # Documents and queries can be embedded differently (task type)
+        return hashlib.sha256(
+            f"{self.model_name}\0{kind}\0{text}".encode("utf-8")
+        ).hexdigest()
+
+    def _lookup(self, keys: List[str]) -> dict:
+        found = {}
+        now = time.time()
+        with self._lock, self._conn:
+            for i in range(0, len(keys), self._SQL_BATCH):
+                batch = keys[i : i + self._SQL_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    batch,
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+                if rows:
+                    self._conn.execute(
+                        f"UPDATE embeddings SET last_used = ? WHERE key IN ({placeholders})",
+                        [now, *batch],
+                    )
+        return found
+
+    def _store(self, items: dict):
+        now = time.time()
+        with self._lock, self._conn:
+            cursor = self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings VALUES (?, ?, ?)",
+                [
+                    (key, array("f", vector).tobytes(), now)
+                    for key, vector in items.items()
+                ],
+            )
+            self._entries += max(cursor.rowcount, 0)
+            if self._entries > self.max_entries:
+                self._evict()
+
+    def _evict(self):
+        # Evict down to 90% of the bound so eviction doesn't run on every insert
+        excess = self._entries - int(self.max_entries * 0.9)
+        self._conn.execute(
+            """DELETE FROM embeddings WHERE key IN (
+                SELECT key FROM embeddings ORDER BY last_used LIMIT ?
+            )""",
+            (excess,),
+        )
+        self.evictions += excess
+        self._entries -= excess
+
+    def _embed(self, kind: str, texts: List[str], embed_fn) -> List[List[float]]:
+        keys = [self._key(kind, text) for text in texts]
+        cached = self._lookup(list(set(keys)))
+
+        # Embed each missing text once, even if it repeats in the batch
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+
+        with self._lock:
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            vectors = embed_fn(list(missing.values()))
+            new_items = dict(zip(missing.keys(), vectors))
+            self._store(new_items)
+            cached.update(new_items)
+
+        return [list(cached[key]) for key in keys]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed("document", texts, self.embeddings.embed_documents)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(
+            "query", [text], lambda texts: [self.embeddings.embed_query(texts[0])]
+        )[0]
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "model": self.model_name,
+                "entries": self._entries,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,214 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+
+class FileRegistry:
+    """
+    Persistent manifest of the uploaded files (SQLite, stored next to chroma_db).
+
+    Keeps per file its chunk ids (a row each), chunk count, active flag, size
+    and upload time, so file management doesn't need to scan the whole vector
+    store.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS files (
+                    file_id TEXT PRIMARY KEY,
+                    filename TEXT NOT NULL,
+                    chunk_count INTEGER NOT NULL,
+                    is_active INTEGER NOT NULL,
+                    size_bytes INTEGER,
+                    uploaded_at REAL NOT NULL
+                )"""
+            )
+            # One row per chunk, so ingestion appends a batch without
+            # rewriting the ids of the whole file (kept in insertion order)
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS chunks (
+                    file_id TEXT NOT NULL,
+                    chunk_id TEXT NOT NULL,
+                    PRIMARY KEY (file_id, chunk_id)
+                )"""
+            )
+
+    @staticmethod
+    def _row_to_dict(row: sqlite3.Row) -> dict:
+        return {
+            "file_id": row["file_id"],
+            "filename": row["filename"],
+            "chunk_count": row["chunk_count"],
+            "is_active": bool(row["is_active"]),
+            "size_bytes": row["size_bytes"],
+            "uploaded_at": row["uploaded_at"],
+        }
+
+    def add_file(
+        self,
+        file_id: str,
+        filename: str,
+        chunk_ids: list,
+        size_bytes: Optional[int] = None,
+        is_active: bool = True,
+        uploaded_at: Optional[float] = None,
+    ):
+        """Register a file and the ids of its chunks in the vector store."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM chunks WHERE file_id = ?", (file_id,))
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO chunks VALUES (?, ?)",
+                ((file_id, chunk_id) for chunk_id in chunk_ids),
+            )
+            (chunk_count,) = self._conn.execute(
+                "SELECT COUNT(*) FROM chunks WHERE file_id = ?", (file_id,)
+            ).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    file_id,
+                    filename,
+                    chunk_count,
+                    int(is_active),
+                    size_bytes,
+                    uploaded_at if uploaded_at is not None else time.time(),
+                ),
+            )
+
+    def add_chunks(self, file_id: str, chunk_ids: list) -> bool:
+        """
+        Append chunk ids to a registered file (incremental ingestion).
+        Returns False if the file isn't registered (e.g. deleted meanwhile).
+        """
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT 1 FROM files WHERE file_id = ?", (file_id,)
+            ).fetchone()
+            if row is None:
+                return False
+            changes = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO chunks VALUES (?, ?)",
+                ((file_id, chunk_id) for chunk_id in chunk_ids),
+            )
+            self._conn.execute(
+                "UPDATE files SET chunk_count = chunk_count + ? WHERE file_id = ?",
+                (self._conn.total_changes - changes, file_id),
+            )
+        return True
+
+    def get_file(self, file_id: str) -> Optional[dict]:
+        """File info including its chunk ids, or None if it isn't registered."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM files WHERE file_id = ?", (file_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            chunk_rows = self._conn.execute(
+                "SELECT chunk_id FROM chunks WHERE file_id = ? ORDER BY rowid",
+                (file_id,),
+            ).fetchall()
+        file_info = self._row_to_dict(row)
+        file_info["chunk_ids"] = [chunk_id for (chunk_id,) in chunk_rows]
+        return file_info
+
+    def list_files(self) -> list:
+        """All registered files, oldest upload first (without chunk ids)."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM files ORDER BY uploaded_at"
+            ).fetchall()
+        return [self._row_to_dict(row) for row in rows]
+
+    def total_chunks(self) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COALESCE(SUM(chunk_count), 0) FROM files"
+            ).fetchone()
+        return row[0]
+
+    def active_fingerprint(self) -> str:
+        """
+        Hash of the active files and their chunk counts. Changes whenever a
+        file is uploaded (or gets more chunks), toggled or deleted.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                """SELECT file_id, chunk_count FROM files
+                WHERE is_active = 1 ORDER BY file_id"""
+            ).fetchall()
+        return hashlib.sha256(
+            json.dumps([tuple(row) for row in rows]).encode("utf-8")
+        ).hexdigest()
+
+    def set_active(self, file_id: str, is_active: bool) -> bool:
+        """Update the active flag. Returns False if the file isn't registered."""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE files SET is_active = ? WHERE file_id = ?",
+                (int(is_active), file_id),
+            )
+        return cursor.rowcount > 0
+
+    def delete_file(self, file_id: str) -> bool:
+        """Remove a file. Returns False if the file isn't registered."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM chunks WHERE file_id = ?", (file_id,))
+            cursor = self._conn.execute(
+                "DELETE FROM files WHERE file_id = ?", (file_id,)
+            )
+        return cursor.rowcount > 0
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM files LIMIT 1").fetchone()
+        return row is None
+
+    def rebuild_from_store(self, vector_store, batch_size: int = 5000) -> int:
+        """
+        Backfill the registry from the chunk metadata in the vector store, for
+        stores created before the registry existed. Returns the files found.
+        """
+        files = {}
+        offset = 0
+        while True:
+            batch = vector_store.get(
+                include=["metadatas"], limit=batch_size, offset=offset
+            )
+            if not batch["ids"]:
+                break
+            for chunk_id, metadata in zip(batch["ids"], batch["metadatas"]):
+                if not metadata or "file_id" not in metadata:
+                    continue
+                file_info = files.setdefault(
+                    metadata["file_id"],
+                    {
+                        "filename": metadata.get("filename", "Unknown"),
+                        "chunk_ids": [],
+                        "active_chunks": 0,
+                    },
+                )
+                file_info["chunk_ids"].append(chunk_id)
+                if metadata.get("is_active", True):
+                    file_info["active_chunks"] += 1
+            offset += len(batch["ids"])
+
+        for file_id, file_info in files.items():
+            self.add_file(
+                file_id,
+                file_info["filename"],
+                file_info["chunk_ids"],
+                # File is considered active if ALL chunks are active
+                is_active=file_info["active_chunks"] == len(file_info["chunk_ids"]),
+            )
+        return len(files)
@@ -0,0 +1,213 @@
+import asyncio
+import logging
+import math
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+from Metrics import (
+    generation_active_gauge,
+    generation_queue_depth_gauge,
+    generation_queue_wait_seconds,
+    generation_rejected_total,
+)
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = "interactive"  # Streaming chat (/ws/stream)
+BATCH = "batch"  # /rag and /vector_search
+LANES = (INTERACTIVE, BATCH)
+
+
+class SchedulerBusy(Exception):
+    """No generation slot within the lane's deadline; retry after a while."""
+
+    def __init__(self, lane: str, reason: str, retry_after: int):
+        super().__init__(
+            f"Generation queue {reason} ({lane}), retry after {retry_after}s"
+        )
+        self.lane = lane
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class GenerationScheduler:
+    """
+    Admission control in front of RAGChain: at most max_concurrent queries
+    (rewrite, retrieval and generation) run at once, the others wait in a
+    queue, so a burst of readers or a script can't exhaust the provider
+    quota and slow everyone down.
+
+    Two lanes: interactive (streaming chat) is served first, batch gets one
+    slot in every batch_every + 1 while both are waiting, so it can't starve.
+    Within a lane, sessions take turns (round robin), so one session with
+    many queries doesn't hold up the others.
+
+    A request that would wait more than its lane's deadline, or finds its
+    lane's queue full, fails fast with SchedulerBusy and a retry-after
+    estimated from the queue and the mean time a slot is held.
+
+    Runs on the event loop (asyncio, not thread-safe).
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = 16,
+        deadlines: Optional[Dict[str, float]] = None,  # Seconds in the queue
+        max_queue: Optional[Dict[str, int]] = None,
+        batch_every: int = 4,
+    ):
+        self.max_concurrent = max_concurrent
+        self.deadlines = deadlines or {INTERACTIVE: 20.0, BATCH: 5.0}
+        self.max_queue = max_queue or {INTERACTIVE: 256, BATCH: 64}
+        self.batch_every = batch_every
+        self.active = 0
+        # lane -> session -> waiting futures, sessions in round-robin order
+        self._queues: Dict[str, "OrderedDict[str, deque]"] = {
+            lane: OrderedDict() for lane in LANES
+        }
+        self._depth = {lane: 0 for lane in LANES}
+        self._interactive_streak = 0
+        # Mean seconds a slot is held, per lane (exponential moving average)
+        self._hold_seconds = {INTERACTIVE: 2.0, BATCH: 2.0}
+        self._counts = {
+            lane: {"admitted": 0, "queued": 0, "queue_full": 0, "deadline": 0}
+            for lane in LANES
+        }
+        self._waited = {lane: [0, 0.0] for lane in LANES}  # [count, seconds]
+        for lane in LANES:
+            generation_queue_depth_gauge.set(0, lane=lane)
+        generation_active_gauge.set(0)
+
+    def retry_after(self, lane: str) -> int:
+        """Seconds until a new request of the lane would likely get a slot."""
+        ahead = self._depth[INTERACTIVE] + (self._depth[BATCH] if lane == BATCH else 0)
+        seconds = (ahead + 1) * self._hold_seconds[lane] / self.max_concurrent
+        return max(1, math.ceil(seconds))
+
+    def _reject(self, lane: str, reason: str):
+        self._counts[lane][reason] += 1
+        generation_rejected_total.inc(lane=lane, reason=reason)
+        retry_after = self.retry_after(lane)
+        logger.warning(
+            "Generation queue %s (%s lane), retry after %ds", reason, lane, retry_after
+        )
+        raise SchedulerBusy(lane, reason, retry_after)
+
+    def _set_depth(self, lane: str, change: int):
+        self._depth[lane] += change
+        generation_queue_depth_gauge.set(self._depth[lane], lane=lane)
+
+    def _next_lane(self) -> Optional[str]:
+        if self._depth[INTERACTIVE] and (
+            not self._depth[BATCH] or self._interactive_streak < self.batch_every
+        ):
+            return INTERACTIVE
+        if self._depth[BATCH]:
+            return BATCH
+        return None
+
+    def _grant(self):
+        """Hand free slots to waiting requests."""
+        while self.active < self.max_concurrent:
+            lane = self._next_lane()
+            if lane is None:
+                return
+            self._interactive_streak = (
+                self._interactive_streak + 1 if lane == INTERACTIVE else 0
+            )
+            sessions = self._queues[lane]
+            session_id, waiters = next(iter(sessions.items()))
+            future = waiters.popleft()
+            # The session goes to the back of the round
+            del sessions[session_id]
+            if waiters:
+                sessions[session_id] = waiters
+            self._set_depth(lane, -1)
+            if future.cancelled():
+                continue  # Its task was cancelled while waiting
+            self.active += 1
+            generation_active_gauge.set(self.active)
+            future.set_result(None)
+
+    def _dequeue(self, lane: str, session_id: str, future: asyncio.Future):
+        waiters = self._queues[lane].get(session_id)
+        if waiters is not None and future in waiters:
+            waiters.remove(future)
+            if not waiters:
+                del self._queues[lane][session_id]
+            self._set_depth(lane, -1)
+
+    async def acquire(self, session_id: str, lane: str = INTERACTIVE) -> float:
+        """Wait for a slot; returns the seconds waited."""
+        if self.active < self.max_concurrent and not any(self._depth.values()):
+            self.active += 1
+            generation_active_gauge.set(self.active)
+            self._counts[lane]["admitted"] += 1
+            generation_queue_wait_seconds.observe(0.0, lane=lane)
+            return 0.0
+        if self._depth[lane] >= self.max_queue[lane]:
+            self._reject(lane, "queue_full")
+
+        future = asyncio.get_running_loop().create_future()
+        self._queues[lane].setdefault(session_id, deque()).append(future)
+        self._set_depth(lane, 1)
+        self._counts[lane]["queued"] += 1
+        start = time.perf_counter()
+        try:
+            async with asyncio.timeout(self.deadlines[lane]):
+                await future
+        except BaseException as e:
+            self._dequeue(lane, session_id, future)
+            if future.done() and not future.cancelled():
+                # Granted just as the deadline passed or the task was cancelled
+                self.release()
+            if isinstance(e, TimeoutError):
+                self._reject(lane, "deadline")
+            raise
+        waited = time.perf_counter() - start
+        self._counts[lane]["admitted"] += 1
+        self._waited[lane][0] += 1
+        self._waited[lane][1] += waited
+        generation_queue_wait_seconds.observe(waited, lane=lane)
+        return waited
+
+    def release(self, lane: Optional[str] = None, held: Optional[float] = None):
+        self.active -= 1
+        generation_active_gauge.set(self.active)
+        if lane is not None and held is not None:
+            self._hold_seconds[lane] += 0.1 * (held - self._hold_seconds[lane])
+        self._grant()
+
+    @asynccontextmanager
+    async def slot(self, session_id: str, lane: str = INTERACTIVE):
+        """Hold a generation slot for the duration of the block."""
+        await self.acquire(session_id, lane)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(lane, time.perf_counter() - start)
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "active": self.active,
+            "lanes": {
+                lane: {
+                    **self._counts[lane],
+                    "waiting": self._depth[lane],
+                    "sessions_waiting": len(self._queues[lane]),
+                    "deadline_seconds": self.deadlines[lane],
+                    "mean_wait_seconds": (
+                        self._waited[lane][1] / self._waited[lane][0]
+                        if self._waited[lane][0]
+                        else 0.0
+                    ),
+                    "mean_hold_seconds": self._hold_seconds[lane],
+                    "retry_after": self.retry_after(lane),
+                }
+                for lane in LANES
+            },
+        }
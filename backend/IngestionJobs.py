@@ -0,0 +1,456 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Optional
+
+from BatchEmbedder import BatchEmbedder
+from DocProcessing import DocProcessing
+from FileRegistry import FileRegistry
+from KeywordIndex import KeywordIndex
+from Metrics import ingestion_stage_seconds
+from StageTimings import timed
+
+logger = logging.getLogger(__name__)
+
+# Job statuses
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED_STATUSES = (COMPLETED, FAILED, CANCELLED)
+
+
+class IngestionJobStore:
+    """
+    Persistent record of ingestion jobs (SQLite), so queued and running jobs
+    survive a restart and resume from their last committed batch.
+    """
+
+    _COLUMNS = (
+        "job_id",
+        "file_id",
+        "filename",
+        "spool_path",
+        "size_bytes",
+        "status",
+        "stage",
+        "pages_total",
+        "pages_parsed",
+        "chunks_total",
+        "chunks_embedded",
+        "eta_seconds",
+        "chunks_per_second",
+        "error",
+        "created_at",
+        "started_at",
+        "updated_at",
+        "finished_at",
+    )
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    file_id TEXT NOT NULL,
+                    filename TEXT NOT NULL,
+                    spool_path TEXT NOT NULL,
+                    size_bytes INTEGER,
+                    status TEXT NOT NULL,
+                    stage TEXT,
+                    pages_total INTEGER,
+                    pages_parsed INTEGER NOT NULL DEFAULT 0,
+                    chunks_total INTEGER,
+                    chunks_embedded INTEGER NOT NULL DEFAULT 0,
+                    eta_seconds REAL,
+                    chunks_per_second REAL,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    updated_at REAL NOT NULL,
+                    finished_at REAL
+                )"""
+            )
+
+    def create_job(
+        self, file_id: str, filename: str, spool_path: str, size_bytes: int
+    ) -> dict:
+        now = time.time()
+        job_id = str(uuid.uuid4())
+        with self._lock, self._conn:
+            self._conn.execute(
+                """INSERT INTO jobs (job_id, file_id, filename, spool_path,
+                    size_bytes, status, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                (job_id, file_id, filename, spool_path, size_bytes, QUEUED, now, now),
+            )
+        return self.get_job(job_id)
+
+    def get_job(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def update(self, job_id: str, **fields):
+        """Commit progress/status fields of a job."""
+        unknown = set(fields) - set(self._COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown job fields: {sorted(unknown)}")
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"UPDATE jobs SET {assignments} WHERE job_id = ?",
+                [*fields.values(), job_id],
+            )
+
+    def claim(self, job_id: str, lease_seconds: float = 60.0) -> bool:
+        """
+        Mark a job running, unless it is finished or another worker runs it
+        (a running job is updated at least every lease_seconds). Atomic, so
+        workers sharing the store never run a job twice.
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                """UPDATE jobs SET status = ?, stage = 'parsing', started_at = ?,
+                    updated_at = ?
+                WHERE job_id = ? AND (status = ? OR (status = ? AND updated_at < ?))""",
+                (RUNNING, now, now, job_id, QUEUED, RUNNING, now - lease_seconds),
+            )
+        return cursor.rowcount == 1
+
+    def unfinished_jobs(self) -> list:
+        """Queued or interrupted jobs, oldest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM jobs WHERE status IN (?, ?) ORDER BY created_at",
+                (QUEUED, RUNNING),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+
+class IngestionWorker:
+    """
+    Background worker pool running parse -> chunk -> embed -> insert for
+    uploaded files. Pages are streamed into the chunker, batches are embedded
+    concurrently by the BatchEmbedder and each one is committed to the vector
+    store (and keyword index) and recorded in the job as soon as it completes,
+    so an interrupted job resumes where it stopped.
+    """
+
+    def __init__(
+        self,
+        job_store: IngestionJobStore,
+        vector_store,
+        text_splitter,
+        file_registry: FileRegistry,
+        embedder: BatchEmbedder,
+        spool_dir: str,
+        workers: int = 2,
+        keyword_index: Optional[KeywordIndex] = None,
+        lease_seconds: float = 60.0,
+    ):
+        self.job_store = job_store
+        self.vector_store = vector_store
+        self.text_splitter = text_splitter
+        self.file_registry = file_registry
+        self.embedder = embedder
+        self.spool_dir = spool_dir
+        self.workers = workers
+        self.keyword_index = keyword_index
+        self.lease_seconds = lease_seconds
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks = []
+        self._stopping = threading.Event()
+        os.makedirs(spool_dir, exist_ok=True)
+
+    async def start(self):
+        """Start the worker tasks and re-queue jobs left over from a restart."""
+        self._stopping.clear()
+        self._queue = asyncio.Queue()
+        for job in self.job_store.unfinished_jobs():
+            if not os.path.exists(job["spool_path"]):
+                continue  # Uploaded to another host, which will resume it
+            logger.info(
+                "Resuming ingestion job %s (%s)", job["job_id"], job["filename"]
+            )
+            self._queue.put_nowait(job["job_id"])
+        self._tasks = [
+            asyncio.create_task(self._worker_loop()) for _ in range(self.workers)
+        ]
+
+    async def stop(self):
+        """Stop the workers. Running jobs stop after their current batch."""
+        self._stopping.set()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, filename: str, content: bytes) -> dict:
+        """Spool the uploaded file to disk and queue its ingestion."""
+        file_id = str(uuid.uuid4())
+        spool_path = os.path.join(self.spool_dir, file_id)
+        await asyncio.to_thread(self._write_spool, spool_path, content)
+        job = await asyncio.to_thread(
+            self.job_store.create_job, file_id, filename, spool_path, len(content)
+        )
+        await self._queue.put(job["job_id"])
+        return job
+
+    @staticmethod
+    def _write_spool(path: str, content: bytes):
+        with open(path, "wb") as spool_file:
+            spool_file.write(content)
+
+    async def _worker_loop(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                claimed = await asyncio.to_thread(self._run_job, job_id)
+                if not claimed:
+                    # Another worker runs it: check again once its lease is over
+                    asyncio.get_running_loop().call_later(
+                        self.lease_seconds, self._queue.put_nowait, job_id
+                    )
+            except Exception as e:
+                logger.error("Ingestion job %s crashed: %s", job_id, e)
+            finally:
+                self._queue.task_done()
+
+    def _run_job(self, job_id: str) -> bool:
+        """Run a job. False if another worker holds it (or did until recently)."""
+        job = self.job_store.get_job(job_id)
+        if not job or job["status"] in FINISHED_STATUSES:
+            return True
+
+        if not self.job_store.claim(job_id, self.lease_seconds):
+            return False
+        try:
+            progress = {"pages_parsed": 0, "pages_total": None}
+            timings = {}  # ms per stage
+            chunks = self._iter_chunks(job, progress, timings)
+            self._embed_and_insert(job, chunks, progress, timings)
+        except Exception as e:
+            logger.error("Ingestion job %s failed: %s", job_id, e)
+            detail = getattr(e, "detail", None) or str(e)
+            self.job_store.update(
+                job_id, status=FAILED, error=detail, finished_at=time.time()
+            )
+            self._remove_spool(job)
+            self._discard_file(job)
+        return True
+
+    def _iter_chunks(self, job: dict, progress: dict, timings: dict):
+        """Stream the chunks of the spooled file, parsing pages lazily."""
+        job_id = job["job_id"]
+
+        with open(job["spool_path"], "rb") as spool_file:
+            content = spool_file.read()
+
+        last_update = 0.0
+
+        def on_page(pages_parsed: int, pages_total: int):
+            nonlocal last_update
+            progress["pages_parsed"] = pages_parsed
+            progress["pages_total"] = pages_total
+            # Throttle progress writes
+            now = time.monotonic()
+            if now - last_update >= 0.5 or pages_parsed == pages_total:
+                last_update = now
+                self.job_store.update(
+                    job_id, pages_parsed=pages_parsed, pages_total=pages_total
+                )
+
+        return DocProcessing(job["filename"], content).iter_chunks(
+            self.text_splitter, on_page=on_page, timings=timings
+        )
+
+    def _embed_and_insert(self, job: dict, chunks, progress: dict, timings: dict):
+        job_id, file_id = job["job_id"], job["file_id"]
+
+        # Register the file up front so it can be listed, toggled or deleted
+        # while it is being ingested
+        if job["chunks_embedded"] == 0:
+            self.file_registry.add_file(
+                file_id, job["filename"], [], size_bytes=job["size_bytes"]
+            )
+
+        # Resume after the last committed batch: chunking is deterministic, so
+        # the chunks already stored are skipped
+        start = job["chunks_embedded"]
+        chunks_seen = 0
+
+        def iter_timed(iterable, stage: str):
+            iterator = iter(iterable)
+            while True:
+                with timed(timings, stage):
+                    item = next(iterator, None)
+                if item is None:
+                    return
+                yield item
+
+        def iter_batches():
+            # Keyed by (batch start, chunk positions) so each batch is stored
+            # with the reading position of its chunks
+            nonlocal chunks_seen
+            batch, positions, batch_start = [], [], start
+            for index, chunk in enumerate(iter_timed(chunks, "source")):
+                chunks_seen = index + 1
+                if index < start:
+                    continue
+                batch.append(chunk.page_content)
+                positions.append(chunk.metadata)
+                if len(batch) == self.embedder.batch_size:
+                    yield (batch_start, positions), batch
+                    batch, positions, batch_start = [], [], index + 1
+            if batch:
+                yield (batch_start, positions), batch
+
+        embed_started_at = time.time()
+        chunks_per_second = None
+        # Parsing, chunking and waiting for embeddings all happen while pulling
+        # the next embedded batch: "source" (parse + chunk) is timed inside it
+        embedded_batches = iter_timed(
+            self.embedder.embed_batches(iter_batches()), "pull"
+        )
+        for (batch_start, positions), batch, vectors in embedded_batches:
+            if self._stopping.is_set():
+                logger.info("Ingestion job %s paused at chunk %d", job_id, batch_start)
+                return
+
+            file_info = self.file_registry.get_file(file_id)
+            if file_info is None:
+                # File deleted while ingesting
+                self._cancel(job)
+                return
+
+            # Deterministic ids make re-running a batch idempotent
+            ids = [f"{file_id}:{batch_start + i}" for i in range(len(batch))]
+            metadatas = [
+                {
+                    "file_id": file_id,
+                    "filename": job["filename"],
+                    "is_active": file_info["is_active"],
+                    **position,
+                }
+                for position in positions
+            ]
+            # Vectors are already computed, write them straight to the collection
+            with timed(timings, "insert"):
+                self.vector_store._collection.upsert(
+                    ids=ids, embeddings=vectors, metadatas=metadatas, documents=batch
+                )
+                if self.keyword_index is not None:
+                    self.keyword_index.add_chunks(
+                        file_id,
+                        ids,
+                        batch,
+                        metadatas,
+                        is_active=file_info["is_active"],
+                    )
+                registered = self.file_registry.add_chunks(file_id, ids)
+            if not registered:
+                # Deleted between the check and the insert
+                self.vector_store.delete(ids=ids)
+                if self.keyword_index is not None:
+                    self.keyword_index.delete_file(file_id)
+                self._cancel(job)
+                return
+
+            chunks_embedded = batch_start + len(batch)
+            elapsed = max(time.time() - embed_started_at, 1e-6)
+            chunks_per_second = (chunks_embedded - start) / elapsed
+            self.job_store.update(
+                job_id,
+                stage="embedding",
+                chunks_embedded=chunks_embedded,
+                chunks_per_second=chunks_per_second,
+                eta_seconds=self._eta(progress, elapsed),
+            )
+
+        self.job_store.update(
+            job_id,
+            status=COMPLETED,
+            stage=None,
+            chunks_total=chunks_seen,
+            eta_seconds=0.0,
+            finished_at=time.time(),
+        )
+        self._remove_spool(job)
+        self._observe_stages(timings)
+        throughput = f"{chunks_per_second:.1f} chunks/s" if chunks_per_second else "-"
+        logger.info(
+            "Ingestion job %s completed: %d chunks (%s)",
+            job_id,
+            chunks_seen,
+            throughput,
+        )
+
+    @staticmethod
+    def _observe_stages(timings: dict):
+        """Record the time of each stage of a completed job (timings in ms)."""
+        source = timings.get("source", 0.0)
+        chunk = timings.get("chunk", 0.0)
+        stages = {
+            "parse": source - chunk,
+            "chunk": chunk,
+            # Time spent waiting for embeddings beyond producing the batches
+            "embed": timings.get("pull", 0.0) - source,
+            "insert": timings.get("insert", 0.0),
+        }
+        for stage, elapsed_ms in stages.items():
+            ingestion_stage_seconds.observe(max(elapsed_ms, 0.0) / 1000, stage=stage)
+        logger.info(
+            "Ingestion stages: %s",
+            ", ".join(f"{stage}={ms / 1000:.2f}s" for stage, ms in stages.items()),
+        )
+
+    @staticmethod
+    def _eta(progress: dict, elapsed: float):
+        # Pages are parsed as chunks are embedded, so page progress drives the ETA
+        pages_parsed, pages_total = progress["pages_parsed"], progress["pages_total"]
+        if not pages_parsed or not pages_total:
+            return None
+        return elapsed * (pages_total - pages_parsed) / pages_parsed
+
+    def _cancel(self, job: dict):
+        logger.info("Ingestion job %s cancelled, file was deleted", job["job_id"])
+        self.job_store.update(
+            job["job_id"], status=CANCELLED, finished_at=time.time()
+        )
+        self._remove_spool(job)
+
+    def _discard_file(self, job: dict):
+        """Remove what a failed job stored, so the file isn't left half listed."""
+        file_id = job["file_id"]
+        try:
+            # By file_id, not the registry's chunk ids: a batch may be stored
+            # but not yet registered when the job failed
+            self.vector_store._collection.delete(where={"file_id": file_id})
+            if self.keyword_index is not None:
+                self.keyword_index.delete_file(file_id)
+            self.file_registry.delete_file(file_id)
+        except Exception as e:
+            logger.error("Could not clean up failed ingestion of %s: %s", file_id, e)
+
+    @staticmethod
+    def _remove_spool(job: dict):
+        try:
+            os.remove(job["spool_path"])
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,337 @@
+import math
+import sqlite3
+import threading
+from typing import Optional
+
+import numpy as np
+
+from DocProcessing import keyword_counts
+
+# Reading position bound -> chunk column that must not go past it
+_READ_UP_TO_COLUMNS = {
+    "page": "page_end",
+    "chapter": "chapter_end",
+    "char_offset": "char_end",
+}
+
+
+class KeywordIndex:
+    """
+    Persistent inverted index (SQLite) with BM25 scoring, next to the vector
+    store, so exact names and rare terms the embedding misses are retrieved.
+
+    Postings (term, chunk, term frequency) and document frequencies are kept
+    in SQLite and updated incrementally. The per-chunk data needed to score
+    and filter (file, length, reading position) is mirrored in NumPy arrays,
+    so a search reads the postings of the query terms and does the rest in
+    memory, applying the same active-file and read_up_to filters as the
+    vector query. Common terms are not skipped, their low IDF weighs them
+    down: a character's name can be in most chunks of a book and still be
+    what the reader asks about.
+    """
+
+    def __init__(self, db_path: str, k1: float = 1.2, b: float = 0.75):
+        self.db_path = db_path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS chunks (
+                    rowid INTEGER PRIMARY KEY,
+                    chunk_id TEXT NOT NULL UNIQUE,
+                    file_id TEXT NOT NULL,
+                    length INTEGER NOT NULL,
+                    page_end INTEGER,
+                    chapter_end INTEGER,
+                    char_end INTEGER
+                )"""
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_chunks_file ON chunks (file_id)"
+            )
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS postings (
+                    term TEXT NOT NULL,
+                    chunk INTEGER NOT NULL,
+                    tf INTEGER NOT NULL,
+                    PRIMARY KEY (term, chunk)
+                ) WITHOUT ROWID"""
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_postings_chunk ON postings (chunk)"
+            )
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS terms (
+                    term TEXT PRIMARY KEY,
+                    doc_count INTEGER NOT NULL
+                ) WITHOUT ROWID"""
+            )
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS files (
+                    file_id TEXT PRIMARY KEY,
+                    is_active INTEGER NOT NULL
+                )"""
+            )
+            self._load()
+
+    # In-memory mirror of the chunks table, indexed by rowid
+
+    def _load(self):
+        self._file_index = {}  # file_id -> position in _file_active
+        self._file_active = np.zeros(0, dtype=bool)
+        self._row_file = np.full(0, -1, dtype=np.int32)  # -1: no chunk
+        self._row_length = np.zeros(0, dtype=np.float32)
+        self._row_bounds = {
+            column: np.full(0, -1, dtype=np.int64)  # -1: unknown position
+            for column in _READ_UP_TO_COLUMNS.values()
+        }
+        self._chunk_count = 0
+        self._total_length = 0
+
+        for file_id, is_active in self._conn.execute("SELECT * FROM files"):
+            self._file_slot(file_id, bool(is_active))
+        rows = self._conn.execute(
+            """SELECT rowid, file_id, length, page_end, chapter_end, char_end
+            FROM chunks"""
+        ).fetchall()
+        for rowid, file_id, length, *bounds in rows:
+            self._set_row(rowid, self._file_slot(file_id), length, bounds)
+
+    def _file_slot(self, file_id: str, is_active: Optional[bool] = None) -> int:
+        slot = self._file_index.get(file_id)
+        if slot is None:
+            slot = self._file_index[file_id] = len(self._file_index)
+            self._file_active = np.append(self._file_active, True)
+        if is_active is not None:
+            self._file_active[slot] = is_active
+        return slot
+
+    def _set_row(self, rowid: int, slot: int, length: int, bounds):
+        if rowid >= len(self._row_file):
+            size = max(rowid + 1, 2 * len(self._row_file), 1024)
+            grow = size - len(self._row_file)
+            self._row_file = np.append(self._row_file, np.full(grow, -1, np.int32))
+            self._row_length = np.append(self._row_length, np.zeros(grow, np.float32))
+            for column, values in self._row_bounds.items():
+                self._row_bounds[column] = np.append(
+                    values, np.full(grow, -1, np.int64)
+                )
+        self._row_file[rowid] = slot
+        self._row_length[rowid] = length
+        for column, value in zip(self._row_bounds, bounds):
+            self._row_bounds[column][rowid] = -1 if value is None else value
+        self._chunk_count += 1
+        self._total_length += length
+
+    def _clear_row(self, rowid: int):
+        self._chunk_count -= 1
+        self._total_length -= int(self._row_length[rowid])
+        self._row_file[rowid] = -1
+        self._row_length[rowid] = 0
+
+    # Updates
+
+    def add_chunks(
+        self,
+        file_id: str,
+        chunk_ids: list,
+        texts: list,
+        metadatas: Optional[list] = None,
+        is_active: bool = True,
+    ):
+        """Index chunks of a file, replacing chunks with the same ids."""
+        metadatas = metadatas or [{} for _ in chunk_ids]
+        with self._lock, self._conn:
+            placeholders = ",".join("?" * len(chunk_ids))
+            existing = self._conn.execute(
+                f"SELECT rowid FROM chunks WHERE chunk_id IN ({placeholders})",
+                chunk_ids,
+            ).fetchall()
+            self._delete_rows([rowid for (rowid,) in existing])
+
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?)", (file_id, int(is_active))
+            )
+            slot = self._file_slot(file_id, is_active)
+            for chunk_id, text, metadata in zip(chunk_ids, texts, metadatas):
+                counts = keyword_counts(text)
+                length = sum(counts.values())
+                bounds = [metadata.get(column) for column in self._row_bounds]
+                rowid = self._conn.execute(
+                    """INSERT INTO chunks (chunk_id, file_id, length, page_end,
+                        chapter_end, char_end) VALUES (?, ?, ?, ?, ?, ?)""",
+                    (chunk_id, file_id, length, *bounds),
+                ).lastrowid
+                self._conn.executemany(
+                    "INSERT INTO postings VALUES (?, ?, ?)",
+                    [(term, rowid, tf) for term, tf in counts.items()],
+                )
+                self._conn.executemany(
+                    """INSERT INTO terms VALUES (?, 1) ON CONFLICT (term)
+                    DO UPDATE SET doc_count = doc_count + 1""",
+                    [(term,) for term in counts],
+                )
+                self._set_row(rowid, slot, length, bounds)
+
+    def _delete_rows(self, rowids: list):
+        for rowid in rowids:
+            self._conn.execute(
+                """UPDATE terms SET doc_count = doc_count - 1 WHERE term IN (
+                    SELECT term FROM postings WHERE chunk = ?
+                )""",
+                (rowid,),
+            )
+            self._conn.execute("DELETE FROM postings WHERE chunk = ?", (rowid,))
+            self._conn.execute("DELETE FROM chunks WHERE rowid = ?", (rowid,))
+            self._clear_row(rowid)
+        if rowids:
+            self._conn.execute("DELETE FROM terms WHERE doc_count <= 0")
+
+    def set_active(self, file_id: str, is_active: bool):
+        with self._lock, self._conn:
+            if file_id not in self._file_index:
+                return
+            self._conn.execute(
+                "UPDATE files SET is_active = ? WHERE file_id = ?",
+                (int(is_active), file_id),
+            )
+            self._file_slot(file_id, is_active)
+
+    def delete_file(self, file_id: str):
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                "SELECT rowid FROM chunks WHERE file_id = ?", (file_id,)
+            ).fetchall()
+            self._delete_rows([rowid for (rowid,) in rows])
+            self._conn.execute("DELETE FROM files WHERE file_id = ?", (file_id,))
+            if file_id in self._file_index:
+                self._file_active[self._file_index[file_id]] = False
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            return self._chunk_count == 0
+
+    def rebuild_from_store(self, vector_store, batch_size: int = 1000) -> int:
+        """
+        Backfill the index from the chunks in the vector store, for stores
+        created before the index existed. Returns the chunks indexed.
+        """
+        indexed = 0
+        offset = 0
+        while True:
+            batch = vector_store.get(
+                include=["documents", "metadatas"], limit=batch_size, offset=offset
+            )
+            if not batch["ids"]:
+                break
+            by_file = {}
+            for chunk_id, text, metadata in zip(
+                batch["ids"], batch["documents"], batch["metadatas"]
+            ):
+                if not metadata or "file_id" not in metadata:
+                    continue
+                chunks = by_file.setdefault(metadata["file_id"], ([], [], []))
+                chunks[0].append(chunk_id)
+                chunks[1].append(text)
+                chunks[2].append(metadata)
+            for file_id, (chunk_ids, texts, metadatas) in by_file.items():
+                self.add_chunks(
+                    file_id,
+                    chunk_ids,
+                    texts,
+                    metadatas,
+                    is_active=all(m.get("is_active", True) for m in metadatas),
+                )
+                indexed += len(chunk_ids)
+            offset += len(batch["ids"])
+        return indexed
+
+    # Search
+
+    def _allowed(self, rowids: np.ndarray, read_up_to: Optional[list]) -> np.ndarray:
+        # Same rules as the vector store filter: active files, and chunks of
+        # bounded files must end before the reader's position
+        slots = self._row_file[rowids]
+        allowed = (slots >= 0) & self._file_active[np.maximum(slots, 0)]
+        for position in read_up_to or []:
+            slot = self._file_index.get(position["file_id"])
+            if slot is None:
+                continue
+            within = np.ones(len(rowids), dtype=bool)
+            for key, column in _READ_UP_TO_COLUMNS.items():
+                if position.get(key) is None:
+                    continue
+                values = self._row_bounds[column][rowids]
+                within &= (values >= 0) & (values <= position[key])
+            allowed &= (slots != slot) | within
+        return allowed
+
+    def search(self, query: str, k: int = 15, read_up_to: Optional[list] = None):
+        """
+        Best BM25 matches among the active chunks within the reading position.
+        Returns [(chunk_id, score)], best first.
+        """
+        terms = list(keyword_counts(query))
+        with self._lock:
+            if not terms or not self._chunk_count:
+                return []
+            placeholders = ",".join("?" * len(terms))
+            doc_counts = self._conn.execute(
+                f"SELECT term, doc_count FROM terms WHERE term IN ({placeholders})",
+                terms,
+            ).fetchall()
+            if not doc_counts:
+                return []
+
+            average_length = self._total_length / self._chunk_count
+            rowid_parts, score_parts = [], []
+            for term, doc_count in doc_counts:
+                postings = np.array(
+                    self._conn.execute(
+                        "SELECT chunk, tf FROM postings WHERE term = ?", (term,)
+                    ).fetchall(),
+                    dtype=np.int64,
+                ).reshape(-1, 2)
+                rowids, tf = postings[:, 0], postings[:, 1].astype(np.float32)
+                idf = math.log(
+                    1 + (self._chunk_count - doc_count + 0.5) / (doc_count + 0.5)
+                )
+                norm = self.k1 * (
+                    1 - self.b + self.b * self._row_length[rowids] / average_length
+                )
+                rowid_parts.append(rowids)
+                score_parts.append(idf * tf * (self.k1 + 1) / (tf + norm))
+
+            rowids, inverse = np.unique(np.concatenate(rowid_parts), return_inverse=True)
+            scores = np.bincount(inverse, weights=np.concatenate(score_parts))
+            allowed = self._allowed(rowids, read_up_to)
+            rowids, scores = rowids[allowed], scores[allowed]
+            if len(rowids) > k:
+                top = np.argpartition(-scores, k)[:k]
+                rowids, scores = rowids[top], scores[top]
+            order = np.argsort(-scores, kind="stable")
+            rowids, scores = rowids[order].tolist(), scores[order].tolist()
+
+            placeholders = ",".join("?" * len(rowids))
+            chunk_ids = dict(
+                self._conn.execute(
+                    f"SELECT rowid, chunk_id FROM chunks WHERE rowid IN ({placeholders})",
+                    rowids,
+                ).fetchall()
+            )
+        return [(chunk_ids[rowid], score) for rowid, score in zip(rowids, scores)]
+
+    def stats(self) -> dict:
+        with self._lock:
+            terms = self._conn.execute("SELECT COUNT(*) FROM terms").fetchone()[0]
+            return {
+                "chunks": self._chunk_count,
+                "terms": terms,
+                "files": len(self._file_index),
+                "average_length": (
+                    self._total_length / self._chunk_count if self._chunk_count else 0.0
+                ),
+            }
@@ -0,0 +1,43 @@
+import logging
+import threading
+import time
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets at most `burst` records of the same message (logger, level and
+    unformatted template) through every `period` seconds, so a failing
+    dependency or a hot path can't flood the log. The next record that
+    gets through reports how many were suppressed meanwhile.
+    """
+
+    def __init__(self, period: float = 10.0, burst: int = 5, max_keys: int = 10_000):
+        super().__init__()
+        self.period = period
+        self.burst = burst
+        self.max_keys = max_keys
+        self.suppressed = 0
+        self._windows = {}  # key -> [window start, passed, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = (record.name, record.levelno, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.period:
+                suppressed = window[2] if window is not None else 0
+                if window is None and len(self._windows) >= self.max_keys:
+                    self._windows.clear()
+                window = self._windows[key] = [now, 0, suppressed]
+            if window[1] >= self.burst:
+                window[2] += 1
+                self.suppressed += 1
+                return False
+            window[1] += 1
+            suppressed, window[2] = window[2], 0
+
+        if suppressed:
+            record.msg = f"{record.getMessage()} ({suppressed} similar suppressed)"
+            record.args = None
+        return True
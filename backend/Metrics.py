@@ -0,0 +1,282 @@
+import bisect
+import math
+import threading
+from typing import Dict, Sequence, Tuple
+
+# Seconds, from cache hits and keyword lookups up to long generations
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+
+def _format_labels(labelnames: Sequence[str], values: Tuple, extra: str = "") -> str:
+    pairs = [
+        '{}="{}"'.format(
+            name,
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+        )
+        for name, value in zip(labelnames, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> Tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"{self.name} expects labels {self.labelnames}, got {sorted(labels)}"
+            )
+        return tuple(labels[name] for name in self.labelnames)
+
+    def render(self) -> list:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> list:
+        with self._lock:
+            values = sorted(self._values.items())
+        return super().render() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in values
+        ]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self) -> list:
+        with self._lock:
+            values = sorted(self._values.items())
+        return super().render() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in values
+        ]
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram, as Prometheus histograms are exposed."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (+Inf last), sum, count]
+        self._series: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list:
+        with self._lock:
+            series = sorted(
+                (key, (list(counts), total, count))
+                for key, (counts, total, count) in self._series.items()
+            )
+        lines = super().render()
+        for key, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                labels = _format_labels(
+                    self.labelnames, key, f'le="{_format_value(bound)}"'
+                )
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Metrics of the process, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames=()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+rag_stage_seconds = metrics.histogram(
+    "coreader_rag_stage_seconds",
+    "Time spent per stage of answering a query.",
+    ["stage"],
+)
+ingestion_stage_seconds = metrics.histogram(
+    "coreader_ingestion_stage_seconds",
+    "Time spent per stage of an ingestion job (whole job).",
+    ["stage"],
+)
+embedding_batch_seconds = metrics.histogram(
+    "coreader_embedding_batch_seconds",
+    "Latency of an ingestion embedding batch, retries included.",
+)
+embedding_retries_total = metrics.counter(
+    "coreader_embedding_retries_total",
+    "Embedding batches retried after a transient or rate-limit error.",
+)
+answers_total = metrics.counter(
+    "coreader_answers_total",
+    "Answers given, by source (generated or answer cache).",
+    ["source"],
+)
+query_rewrites_total = metrics.counter(
+    "coreader_query_rewrites_total",
+    "Queries by how their rewrite was resolved (skipped_no_history, "
+    "skipped_no_reference, cache_hit, llm).",
+    ["outcome"],
+)
+generations_cancelled_total = metrics.counter(
+    "coreader_generations_cancelled_total",
+    "Answers cancelled before they were complete, by the stage they were in.",
+    ["stage"],
+)
+cancelled_tokens_saved_total = metrics.counter(
+    "coreader_cancelled_tokens_saved_total",
+    "Answer tokens not generated thanks to cancellations (estimated).",
+)
+cancellations_unestimated_total = metrics.counter(
+    "coreader_cancellations_unestimated_total",
+    "Cancellations before any answer was complete, with no tokens saved estimate.",
+)
+ws_answers_cancelled_total = metrics.counter(
+    "coreader_ws_answers_cancelled_total",
+    "Answers on /ws/stream cancelled, by reason (disconnect, superseded, client).",
+    ["reason"],
+)
+generation_queue_wait_seconds = metrics.histogram(
+    "coreader_generation_queue_wait_seconds",
+    "Time generation requests waited for a slot, by lane.",
+    ["lane"],
+)
+generation_rejected_total = metrics.counter(
+    "coreader_generation_rejected_total",
+    "Generation requests turned away, by lane and reason (queue_full, deadline).",
+    ["lane", "reason"],
+)
+generation_queue_depth_gauge = metrics.gauge(
+    "coreader_generation_queue_depth",
+    "Generation requests waiting for a slot, by lane.",
+    ["lane"],
+)
+generation_active_gauge = metrics.gauge(
+    "coreader_generation_active", "Generation requests holding a slot."
+)
+ws_frames_total = metrics.counter(
+    "coreader_ws_frames_total",
+    "Frames sent on /ws/stream with the framed protocol, by type.",
+    ["type"],
+)
+ws_backpressure_seconds_total = metrics.counter(
+    "coreader_ws_backpressure_seconds_total",
+    "Time answers were held back waiting for slow /ws/stream clients.",
+)
+
+# Sizes, refreshed when /metrics is scraped
+sessions_gauge = metrics.gauge(
+    "coreader_sessions", "Conversation sessions held in memory."
+)
+answer_cache_entries_gauge = metrics.gauge(
+    "coreader_answer_cache_entries", "Answers held by the answer cache."
+)
+answer_cache_hit_ratio_gauge = metrics.gauge(
+    "coreader_answer_cache_hit_ratio", "Share of answer cache lookups that hit."
+)
+keyword_index_chunks_gauge = metrics.gauge(
+    "coreader_keyword_index_chunks", "Chunks in the keyword index."
+)
@@ -1,22 +1,55 @@
 import os
+import re
+import asyncio
+import logging
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import aclosing
+from typing import Callable, Optional
+import numpy as np
 from dotenv import load_dotenv
-from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
 
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
 # from langchain_experimental.text_splitter import SemanticChunker
-from langchain_chroma import Chroma
+from langchain_core.language_models import BaseChatModel
 from langchain_core.prompts import PromptTemplate
 from langchain_core.vectorstores.base import VectorStoreRetriever
-from langchain.memory import ConversationBufferWindowMemory
+from langchain_core.messages import AIMessageChunk
+from langchain_core.documents import Document
+
+from AnswerCache import AnswerCache
+from ContextAssembler import ContextAssembler
+from DocProcessing import keyword_matches, keyword_tokens
+from EmbeddingBackends import load_embeddings
+from EmbeddingCache import CachedEmbeddings
+from KeywordIndex import KeywordIndex
+from Metrics import (
+    answers_total,
+    cancellations_unestimated_total,
+    cancelled_tokens_saved_total,
+    generations_cancelled_total,
+    query_rewrites_total,
+    rag_stage_seconds,
+)
+from Reranker import OnnxCrossEncoder, Reranker
+from Services import ServiceContainer
+from StageTimings import StageTimings, timed
+from StoreServer import build_store, connect_stores, open_vector_store
+
+logger = logging.getLogger(__name__)
 
 # Load env variables (GOOGLE API KEY)
 load_dotenv()
-# Instance the llm chat
-llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash-lite")
-
-# Load embeddings model
-embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
+# Where the stores live (vector store, caches, registries); defaults to backend/
+DATA_DIR = os.getenv("DATA_DIR", os.path.dirname(__file__))
+# Store server shared by several API workers (see StoreServer.py), if any
+STORE_ADDRESS = os.getenv("STORE_ADDRESS")
+# Clients and stores are built on first use (or by the startup warm-up), not
+# at import: see the factories registered below
+services = ServiceContainer()
 
 # Text splitter - Using RecursiveCharacterTextSplitter for better chunking
 text_splitter = RecursiveCharacterTextSplitter(
@@ -33,13 +66,107 @@ text_splitter = RecursiveCharacterTextSplitter(
     keep_separator=True,  # Keep separators to maintain context
 )
 
-vector_store = Chroma(
-    collection_name="test_collection",
-    embedding_function=embeddings,
-    persist_directory=os.path.join(os.path.dirname(__file__), "chroma_db"),
-)
 
-retriever = vector_store.as_retriever()
+def _build_embeddings():
+    # Embeddings model (EMBEDDING_BACKEND: Gemini or a local CPU model), behind
+    # a persistent cache so known chunks aren't re-embedded
+    base_embeddings, model_name = services.embedding_backend
+    return CachedEmbeddings(
+        base_embeddings,
+        model_name=model_name,
+        db_path=os.path.join(DATA_DIR, "embedding_cache.db"),
+    )
+
+
+def _build_llm():
+    # Imported here: the Gemini client libraries are slow to import
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    return ChatGoogleGenerativeAI(model="gemini-2.0-flash-lite")
+
+
+def _build_vector_store():
+    # Vectors of different models can't share a collection: after switching
+    # EMBEDDING_BACKEND, migrate with reindex.py and point CHROMA_COLLECTION to it
+    return open_vector_store(
+        os.getenv("CHROMA_COLLECTION", "test_collection"),
+        os.path.join(DATA_DIR, "chroma_db"),
+        embedding_function=services.embeddings,
+    )
+
+
+def _load_vector_index(store):
+    """Query the collection once with a stored vector, so Chroma loads its index."""
+    sample = store._collection.get(limit=1, include=["embeddings"])
+    if len(sample["embeddings"]):
+        store._collection.query(query_embeddings=sample["embeddings"], n_results=1)
+
+
+def open_store(name: str):
+    """
+    One of the stores shared by the API workers: a proxy to the store server
+    at STORE_ADDRESS (several workers or hosts), else a local instance.
+    """
+    if STORE_ADDRESS:
+        return getattr(services.store_server, name)()
+    return build_store(name, DATA_DIR)
+
+
+def _build_file_registry():
+    # Manifest of uploaded files, kept next to the vector store
+    file_registry = open_store("file_registry")
+    if not STORE_ADDRESS and file_registry.is_empty():
+        # Stores created before the registry existed: index their files once
+        # (the store server does it itself)
+        file_registry.rebuild_from_store(services.vector_store)
+    return file_registry
+
+
+def _build_keyword_index():
+    # BM25 index of the same chunks, for exact names and rare terms
+    keyword_index = open_store("keyword_index")
+    if (
+        not STORE_ADDRESS
+        and keyword_index.is_empty()
+        and not services.file_registry.is_empty()
+    ):
+        # Stores created before the keyword index existed: index their chunks once
+        keyword_index.rebuild_from_store(services.vector_store)
+    return keyword_index
+
+
+def _build_reranker():
+    # Optional local cross-encoder replacing the heuristic ranking (CPU, ONNX).
+    # Without a model directory, or when it misses its latency budget, the
+    # heuristic in RAGChain.rank_documents is used
+    model_dir = os.getenv("RERANKER_MODEL_DIR")
+    if not model_dir:
+        return None
+    return OnnxCrossEncoder(
+        model_dir,
+        model_file=os.getenv("RERANKER_MODEL_FILE", "model.onnx"),
+        budget_ms=float(os.getenv("RERANKER_BUDGET_MS", "250")),
+    )
+
+
+services.register("llm", _build_llm)
+services.register(
+    "store_server",
+    lambda: connect_stores(STORE_ADDRESS, os.getenv("STORE_AUTHKEY", "")),
+)
+services.register("embedding_backend", load_embeddings)
+services.register("embeddings", _build_embeddings)
+services.register("vector_store", _build_vector_store, warm=_load_vector_index)
+services.register("file_registry", _build_file_registry)
+services.register(
+    "keyword_index", _build_keyword_index, warm=lambda index: index.search("warm", 1)
+)
+services.register("reranker", _build_reranker)
+# Answers to repeated questions, dropped whenever the set of active files changes
+services.register(
+    "answer_cache",
+    lambda: AnswerCache(services.embeddings, services.file_registry.active_fingerprint),
+)
 
 prompt_template = """You are a helpful and knowledgeable assistant, and an expert content writer. Use the context provided to give a detailed and comprehensive answer to the user's question below. You also need to look at the chat history to give a more accurate answer, and if the user's question is related to the chat history, you should use the chat history to think how the chat history can be used to answer the user's question.
 Your response should:
@@ -71,15 +198,103 @@ Answer: """
 
 custom_rag_prompt = PromptTemplate.from_template(prompt_template)
 
+# Reading position bound -> chunk metadata that must not go past it
+READ_UP_TO_FIELDS = {
+    "page": "page_end",
+    "chapter": "chapter_end",
+    "char_offset": "char_end",
+}
+
+
+def reading_position_filter(read_up_to: Optional[list] = None) -> dict:
+    """
+    Chroma where clause for active chunks within the reader's position.
+    read_up_to is a list of {"file_id", "page"/"chapter"/"char_offset"}: chunks
+    of those files must end before the bound, other files are unbounded.
+    """
+    bounds = []
+    for position in read_up_to or []:
+        conditions = [{"file_id": position["file_id"]}] + [
+            {field: {"$lte": position[key]}}
+            for key, field in READ_UP_TO_FIELDS.items()
+            if position.get(key) is not None
+        ]
+        if len(conditions) > 1:
+            bounds.append({"$and": conditions})
+    if not bounds:
+        return {"is_active": True}
+
+    bounded_files = [bound["$and"][0]["file_id"] for bound in bounds]
+    return {
+        "$and": [
+            {"is_active": True},
+            {"$or": [{"file_id": {"$nin": bounded_files}}, *bounds]},
+        ]
+    }
+
+
+def within_reading_position(
+    metadata: dict, read_up_to: Optional[list] = None
+) -> bool:
+    """Same check as reading_position_filter, on the metadata of one chunk."""
+    for position in read_up_to or []:
+        if metadata.get("file_id") != position["file_id"]:
+            continue
+        for key, field in READ_UP_TO_FIELDS.items():
+            if position.get(key) is None:
+                continue
+            # Chunks stored without positions can't be placed, leave them out
+            if metadata.get(field) is None or metadata[field] > position[key]:
+                return False
+    return True
+
+
+# Words that refer back to the conversation (English and Spanish): a query
+# using them needs the history to be understood
+_REFERRING_WORDS = frozenset(
+    """he she it they him her them his hers its their theirs himself herself
+    themselves this that these those there then former latter previous above
+    again else more same next
+    él ella ellos ellas le les lo su sus suyo suya suyos suyas este esta esto
+    estos estas ese esa eso esos esas aquel aquella aquello aquellos aquellas
+    ahí allí entonces luego anterior mismo misma más""".split()
+)
+# Openings of follow-up questions ("and her sister?", "¿y luego?")
+_FOLLOW_UP_STARTS = tuple(
+    f"{start} "
+    for start in ("and", "also", "what about", "how about", "y", "también", "qué hay")
+)
+_WORD_PATTERN = re.compile(r"\w+")
+# Queries this short are usually elliptical ("why?", "her sister?")
+_ELLIPTICAL_MAX_WORDS = 2
+
+
+def needs_query_rewrite(query: str, history: str) -> bool:
+    """
+    Cheap local check of whether a query must be rewritten with the chat
+    history before retrieval: there is history and the query refers back to
+    it (pronouns, demonstratives, follow-up openings) or is elliptical.
+    """
+    if not history.strip():
+        return False
+    words = _WORD_PATTERN.findall(query.lower())
+    if len(words) <= _ELLIPTICAL_MAX_WORDS:
+        return True
+    if f"{' '.join(words[:2])} ".startswith(_FOLLOW_UP_STARTS):
+        return True
+    return not _REFERRING_WORDS.isdisjoint(words)
+
 
 class Utils:
-    def __init__(self, llm: ChatGoogleGenerativeAI):
+    def __init__(self, llm: BaseChatModel, rewrite_cache_size: int = 256):
         self.llm = llm
+        # LRU cache of rewritten queries, keyed on (query, history hash)
+        self.rewrite_cache_size = rewrite_cache_size
+        self._rewrite_cache = OrderedDict()
+        self._rewrite_lock = threading.Lock()
 
-    def query_rewrite(self, query: str, history: str):
-        # Rewrite to optimize input query
-
-        query_rewrite_prompt = f"""You are a helpful assistant. Your task is to understand a user's query in the context of the provided chat history.
+    def _query_rewrite_prompt(self, query: str, history: str) -> str:
+        return f"""You are a helpful assistant. Your task is to understand a user's query in the context of the provided chat history.
         First, identify if the query contains pronouns or needs clarification based on the history.
         Then, rephrase the user's query into a concise statement or paragraph suitable for a semantic similarity search on a vector database.
         This rewritten query should incorporate resolved pronouns or context from the chat history to be self-contained and specific.
@@ -98,9 +313,61 @@ class Utils:
 
         Rewritten Query for Semantic Search:"""
 
-        retrieval_query = self.llm.invoke(query_rewrite_prompt)
+    def _rewrite_lookup(self, query: str, history: str):
+        """
+        Resolve a rewrite without the LLM when possible. Returns (rewritten
+        query, None), or (None, cache key) when the LLM has to be called.
+        """
+        if not history.strip():
+            query_rewrites_total.inc(outcome="skipped_no_history")
+            return query, None
+        if not needs_query_rewrite(query, history):
+            query_rewrites_total.inc(outcome="skipped_no_reference")
+            return query, None
+
+        key = (query, hashlib.sha256(history.encode("utf-8")).hexdigest())
+        with self._rewrite_lock:
+            rewritten = self._rewrite_cache.get(key)
+            if rewritten is not None:
+                self._rewrite_cache.move_to_end(key)
+        if rewritten is not None:
+            query_rewrites_total.inc(outcome="cache_hit")
+            return rewritten, None
+
+        query_rewrites_total.inc(outcome="llm")
+        return None, key
+
+    def _rewrite_store(self, key, retrieval_query) -> str:
+        rewritten = getattr(retrieval_query, "content", str(retrieval_query))
+        with self._rewrite_lock:
+            self._rewrite_cache[key] = rewritten
+            self._rewrite_cache.move_to_end(key)
+            while len(self._rewrite_cache) > self.rewrite_cache_size:
+                self._rewrite_cache.popitem(last=False)
+        return rewritten
+
+    def query_rewrite(self, query: str, history: str) -> str:
+        # Rewrite to optimize input query, skipping the LLM when there is no
+        # history to resolve or the rewrite is cached
+        rewritten, key = self._rewrite_lookup(query, history)
+        if rewritten is not None:
+            return rewritten
+
+        retrieval_query = self.llm.invoke(self._query_rewrite_prompt(query, history))
 
-        return retrieval_query
+        return self._rewrite_store(key, retrieval_query)
+
+    async def aquery_rewrite(self, query: str, history: str) -> str:
+        # Async version of query_rewrite, does not block the event loop
+        rewritten, key = self._rewrite_lookup(query, history)
+        if rewritten is not None:
+            return rewritten
+
+        retrieval_query = await self.llm.ainvoke(
+            self._query_rewrite_prompt(query, history)
+        )
+
+        return self._rewrite_store(key, retrieval_query)
 
     def format_docs(self, docs):
         # Document parse to string concat
@@ -110,110 +377,117 @@ class Utils:
 class RAGChain:
     def __init__(
         self,
-        llm: ChatGoogleGenerativeAI,
+        llm: BaseChatModel,
         retriever: VectorStoreRetriever,
         prompt: PromptTemplate,
-        memory_window_k: int = 3,  # Number of interactions to keep in memory
+        answer_cache: Optional[AnswerCache] = None,
+        keyword_index: Optional[KeywordIndex] = None,
+        reranker: Optional[Reranker] = None,
+        context_assembler: Optional[ContextAssembler] = None,
+        initial_k: int = 15,  # Candidates retrieved for ranking
+        rrf_k: int = 60,  # Reciprocal rank fusion constant
     ):
+        # Stateless: conversation history is kept per session by the caller
+        # (SessionStore) and passed in with each query
         self.llm = llm
         self.retriever = retriever
         self.prompt = prompt
         self.utils = Utils(llm)
-        self.chat_memory = ConversationBufferWindowMemory(
-            memory_key="chat_history",
-            return_messages=False,
-            output_key="answer",
-            input_key="question",
-            k=memory_window_k,
-        )
+        self.answer_cache = answer_cache
+        self.keyword_index = keyword_index
+        self.reranker = reranker
+        self.context_assembler = context_assembler or ContextAssembler()
+        self.initial_k = initial_k
+        self.rrf_k = rrf_k
+        self.timings = StageTimings()
+        # Cancelled turns, and the mean answer length to estimate what
+        # cancelling saved
+        self._cancel_lock = threading.Lock()
+        self._cancellations = {"retrieval": 0, "generation": 0}
+        self._tokens_saved = 0
+        # Cancelled before any answer was complete: no mean length to go by
+        self._unestimated = 0
+        self._answers_seen = 0
+        self._mean_answer_tokens = 0.0
 
     def rank_documents(self, docs_with_scores, query: str, max_docs: int = 5):
         """
         Rank documents based on similarity scores and other factors.
         Returns the top-ranked documents up to max_docs limit.
+        All candidates are scored at once with NumPy arrays.
         """
         if not docs_with_scores:
             return []
 
-        # Extract query keywords for relevance scoring
-        query_keywords = set(query.lower().split())
+        docs = [doc for doc, _ in docs_with_scores]
+        distances = np.array([score for _, score in docs_with_scores], dtype=float)
 
-        ranked_docs = []
-        for doc, score in docs_with_scores:
-            # Base similarity score (lower is better for distance, so invert it)
-            similarity_score = 1.0 / (1.0 + score) if score > 0 else 1.0
+        # Base similarity score (lower is better for distance, so invert it)
+        similarity_scores = np.where(
+            distances > 0, 1.0 / (1.0 + np.maximum(distances, 0.0)), 1.0
+        )
 
-            # Content relevance score based on keyword matching
-            doc_text = doc.page_content.lower()
-            keyword_matches = sum(
-                1 for keyword in query_keywords if keyword in doc_text
-            )
-            keyword_score = (
-                keyword_matches / len(query_keywords) if query_keywords else 0
-            )
+        # Content relevance score: share of the query keywords found as words
+        # in the chunk's text
+        query_tokens = keyword_tokens(query)
+        if query_tokens:
+            keyword_scores = np.array(
+                [keyword_matches(doc.page_content, query_tokens) for doc in docs]
+            ) / len(query_tokens)
+        else:
+            keyword_scores = np.zeros(len(docs))
 
-            # Document length score (normalized, prefer medium-length docs)
-            doc_length = len(doc.page_content)
-            # Optimal length around 800-1200 characters, score decreases for very short or very long
-            if doc_length < 100:
-                length_score = 0.3  # Too short
-            elif 800 <= doc_length <= 1200:
-                length_score = 1.0  # Optimal
-            elif doc_length > 2000:
-                length_score = 0.7  # Too long
-            else:
-                length_score = 0.8  # Decent length
+        # Document length score (normalized, prefer medium-length docs)
+        # Optimal length around 800-1200 characters, score decreases for very short or very long
+        doc_lengths = np.array([len(doc.page_content) for doc in docs])
+        length_scores = np.select(
+            [
+                doc_lengths < 100,  # Too short
+                (doc_lengths >= 800) & (doc_lengths <= 1200),  # Optimal
+                doc_lengths > 2000,  # Too long
+            ],
+            [0.3, 1.0, 0.7],
+            default=0.8,  # Decent length
+        )
 
-            # Combined ranking score (weighted combination)
-            final_score = (
-                0.6 * similarity_score  # Primary factor: similarity
-                + 0.3 * keyword_score  # Secondary: keyword relevance
-                + 0.1 * length_score  # Tertiary: document length
-            )
+        # Combined ranking score (weighted combination)
+        final_scores = (
+            0.6 * similarity_scores  # Primary factor: similarity
+            + 0.3 * keyword_scores  # Secondary: keyword relevance
+            + 0.1 * length_scores  # Tertiary: document length
+        )
 
-            ranked_docs.append(
-                (
-                    doc,
-                    final_score,
-                    {
-                        "similarity_score": similarity_score,
-                        "keyword_score": keyword_score,
-                        "length_score": length_score,
-                        "final_score": final_score,
-                        "original_distance": score,
-                    },
-                )
-            )
+        # Sort by final score (descending - higher is better, ties keep order)
+        top = np.argsort(-final_scores, kind="stable")[:max_docs]
 
-        # Sort by final score (descending - higher is better)
-        ranked_docs.sort(key=lambda x: x[1], reverse=True)
-
-        # Log ranking information
-        print("RAGChain - Document ranking results:")
-        for i, (doc, final_score, scores) in enumerate(ranked_docs[:max_docs]):
-            print(
-                f"  Rank {i + 1}: Score={final_score:.3f} "
-                f"(sim={scores['similarity_score']:.3f}, "
-                f"kw={scores['keyword_score']:.3f}, "
-                f"len={scores['length_score']:.3f}) "
-                f"Content preview: {doc.page_content[:100]}..."
+        # Log ranking information (only built when debugging)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "Document ranking results (%d candidates):\n%s",
+                len(docs),
+                "\n".join(
+                    f"  Rank {rank + 1}: Score={final_scores[i]:.3f} "
+                    f"(sim={similarity_scores[i]:.3f}, "
+                    f"kw={keyword_scores[i]:.3f}, "
+                    f"len={length_scores[i]:.3f}) "
+                    f"Content preview: {docs[i].page_content[:100]}..."
+                    for rank, i in enumerate(top)
+                ),
             )
 
         # Return top documents only
-        return [doc for doc, _, _ in ranked_docs[:max_docs]]
-
-    def get_retrieved_documents(self, query: str, history_str: str = ""):
-        print(f"RAGChain - Input User Query: '{query}'")
-
-        retrieval_query_result = self.utils.query_rewrite(query, history_str)
-        retrieval_query_content = getattr(
-            retrieval_query_result, "content", str(retrieval_query_result)
-        )
+        return [docs[i] for i in top]
 
-        print(f"RAGChain - Query rewrite: {retrieval_query_content}")
-
-        # Get more documents for ranking (up to 15 to have good selection)
-        initial_k = 15
+    def _search_documents(
+        self, retrieval_query_content: str, read_up_to: Optional[list] = None
+    ):
+        """
+        Similarity search over the active documents, bounded by the reader's
+        position (read_up_to) in the vector query itself. Blocking (Chroma).
+        """
+        # Get more documents for ranking to have good selection
+        initial_k = self.initial_k
+        vector_store = self.retriever.vectorstore
 
         # Try to get documents with similarity scores for better ranking
         try:
@@ -221,33 +495,39 @@ class RAGChain:
             docs_with_scores = vector_store.similarity_search_with_score(
                 retrieval_query_content,
                 k=initial_k,
-                filter={"is_active": True},  # Filter for active documents
+                # Filter for active documents the reader has reached
+                filter=reading_position_filter(read_up_to),
             )
-            print(
-                f"RAGChain - Retrieved {len(docs_with_scores)} documents with scores using filter"
+            logger.debug(
+                "Retrieved %d documents with scores using filter", len(docs_with_scores)
             )
         except Exception as e:
-            print(f"RAGChain - Filtered search failed: {e}")
+            logger.warning("Filtered search failed: %s", e)
             # Fallback: get all documents and filter manually
             try:
                 docs_with_scores = vector_store.similarity_search_with_score(
                     retrieval_query_content, k=initial_k
                 )
-                print(
-                    f"RAGChain - Retrieved {len(docs_with_scores)} documents with scores (no filter)"
+                logger.debug(
+                    "Retrieved %d documents with scores (no filter)",
+                    len(docs_with_scores),
                 )
 
                 # Manual filtering to ensure we only get active documents
                 filtered_docs_with_scores = []
                 for doc, score in docs_with_scores:
-                    if doc.metadata and doc.metadata.get("is_active", False):
+                    if (
+                        doc.metadata
+                        and doc.metadata.get("is_active", False)
+                        and within_reading_position(doc.metadata, read_up_to)
+                    ):
                         filtered_docs_with_scores.append((doc, score))
                 docs_with_scores = filtered_docs_with_scores
-                print(
-                    f"RAGChain - After manual filtering: {len(docs_with_scores)} active documents"
+                logger.debug(
+                    "After manual filtering: %d active documents", len(docs_with_scores)
                 )
             except Exception as e2:
-                print(f"RAGChain - Similarity search with scores failed: {e2}")
+                logger.warning("Similarity search with scores failed: %s", e2)
                 # Final fallback: use regular retriever
                 docs = self.retriever.invoke(
                     retrieval_query_content,
@@ -257,81 +537,554 @@ class RAGChain:
                 docs_with_scores = [
                     (doc, 0.5)
                     for doc in docs
-                    if doc.metadata and doc.metadata.get("is_active", False)
+                    if doc.metadata
+                    and doc.metadata.get("is_active", False)
+                    and within_reading_position(doc.metadata, read_up_to)
                 ]
-                print(
-                    f"RAGChain - Using fallback retriever: {len(docs_with_scores)} documents"
+                logger.debug(
+                    "Using fallback retriever: %d documents", len(docs_with_scores)
+                )
+
+        return docs_with_scores
+
+    def _fetch_scored_documents(
+        self, retrieval_query_content: str, ids: list, read_up_to: Optional[list]
+    ):
+        """Documents and vector distances of the given chunk ids. Blocking (Chroma)."""
+        vector_store = self.retriever.vectorstore
+        query_embedding = vector_store.embeddings.embed_query(retrieval_query_content)
+        results = vector_store._collection.query(
+            query_embeddings=[query_embedding],
+            ids=ids,
+            n_results=len(ids),
+            where=reading_position_filter(read_up_to),
+            include=["documents", "metadatas", "distances"],
+        )
+        return {
+            doc_id: (
+                Document(page_content=text, metadata=metadata, id=doc_id),
+                distance,
+            )
+            for doc_id, text, metadata, distance in zip(
+                results["ids"][0],
+                results["documents"][0],
+                results["metadatas"][0],
+                results["distances"][0],
+            )
+        }
+
+    def _hybrid_search(
+        self,
+        retrieval_query_content: str,
+        read_up_to: Optional[list] = None,
+        timings: Optional[dict] = None,
+    ):
+        """
+        Vector and BM25 candidates merged by reciprocal rank fusion, keeping
+        the initial_k best. Chunks found only by keywords get their vector
+        distance from Chroma so rank_documents can score them like the rest.
+        Blocking (Chroma, SQLite).
+        """
+        timings = timings if timings is not None else {}
+        with timed(timings, "vector_search"):
+            docs_with_scores = self._search_documents(
+                retrieval_query_content, read_up_to
+            )
+        # The retriever fallback may return documents without ids
+        if self.keyword_index is None or any(
+            doc.id is None for doc, _ in docs_with_scores
+        ):
+            return docs_with_scores
+
+        try:
+            with timed(timings, "keyword_search"):
+                keyword_hits = self.keyword_index.search(
+                    retrieval_query_content, k=self.initial_k, read_up_to=read_up_to
                 )
+        except Exception as e:
+            logger.warning("Keyword search failed: %s", e)
+            return docs_with_scores
+        if not keyword_hits:
+            return docs_with_scores
+
+        fused = {}
+        for ranking in (
+            [doc.id for doc, _ in docs_with_scores],
+            [chunk_id for chunk_id, _ in keyword_hits],
+        ):
+            for rank, doc_id in enumerate(ranking):
+                fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (self.rrf_k + rank + 1)
 
+        candidates = {doc.id: (doc, score) for doc, score in docs_with_scores}
+        missing = [
+            doc_id
+            for doc_id in sorted(fused, key=fused.get, reverse=True)[: self.initial_k]
+            if doc_id not in candidates
+        ]
+        if missing:
+            try:
+                with timed(timings, "keyword_fetch"):
+                    candidates.update(
+                        self._fetch_scored_documents(
+                            retrieval_query_content, missing, read_up_to
+                        )
+                    )
+            except Exception as e:
+                logger.warning("Fetching keyword matches failed: %s", e)
+
+        ranked_ids = sorted(
+            (doc_id for doc_id in fused if doc_id in candidates),
+            key=fused.get,
+            reverse=True,
+        )[: self.initial_k]
+        logger.debug(
+            "Hybrid search: %d vector, %d keyword, %d keyword-only candidates",
+            len(docs_with_scores),
+            len(keyword_hits),
+            len(missing),
+        )
+        return [candidates[doc_id] for doc_id in ranked_ids]
+
+    def _rank_retrieved_documents(
+        self,
+        docs_with_scores,
+        retrieval_query_content,
+        timings: Optional[dict] = None,
+    ):
+        timings = timings if timings is not None else {}
         # If no active documents found, return empty list
         if not docs_with_scores:
-            print("RAGChain - WARNING: No active documents found!")
+            logger.warning("No active documents found")
             return []
 
-        # Rank documents and return top ones
-        ranked_docs = self.rank_documents(
-            docs_with_scores, retrieval_query_content, max_docs=5
+        ranked_docs = None
+        if self.reranker is not None:
+            with timed(timings, "rerank"):
+                ranked_docs = self.reranker.rerank(
+                    retrieval_query_content,
+                    [doc for doc, _ in docs_with_scores],
+                    max_docs=5,
+                )
+            if ranked_docs is None:
+                logger.info("Reranker over budget, using heuristic ranking")
+
+        if ranked_docs is None:
+            # Rank documents and return top ones
+            with timed(timings, "heuristic_rank"):
+                ranked_docs = self.rank_documents(
+                    docs_with_scores, retrieval_query_content, max_docs=5
+                )
+
+        logger.debug("Final ranked documents: %d", len(ranked_docs))
+        return ranked_docs
+
+    def _retrieve(
+        self,
+        retrieval_query_content: str,
+        read_up_to: Optional[list],
+        timings: dict,
+        cancelled: Optional[threading.Event] = None,
+    ):
+        """
+        Search and rank. Blocking (Chroma, SQLite, reranker). Once cancelled
+        is set the ranking is skipped: nobody waits for the result anymore.
+        """
+        docs_with_scores = self._hybrid_search(
+            retrieval_query_content, read_up_to, timings
         )
+        if cancelled is not None and cancelled.is_set():
+            return []
+        return self._rank_retrieved_documents(
+            docs_with_scores, retrieval_query_content, timings
+        )
+
+    def _record_timings(self, timings: dict):
+        """Add a request's stage timings (ms) to the rolling window and metrics."""
+        self.timings.record(timings)
+        for stage, elapsed_ms in timings.items():
+            rag_stage_seconds.observe(elapsed_ms / 1000, stage=stage)
+        logger.debug(
+            "Stage timings: %s",
+            ", ".join(f"{stage}={ms:.1f}ms" for stage, ms in timings.items()),
+        )
+
+    def get_retrieved_documents(
+        self, query: str, history_str: str = "", read_up_to: Optional[list] = None
+    ):
+        logger.debug("Input user query: %r", query)
+
+        timings = {}
+        with timed(timings, "query_rewrite"):
+            retrieval_query_content = self.utils.query_rewrite(query, history_str)
 
-        print(f"RAGChain - Final ranked documents: {len(ranked_docs)}")
+        logger.debug("Query rewrite: %r", retrieval_query_content)
+
+        with timed(timings, "retrieval"):
+            ranked_docs = self._retrieve(retrieval_query_content, read_up_to, timings)
+        self._record_timings(timings)
         return ranked_docs
 
-    def _prepare_rag_inputs(self, query: str):
-        loaded_memory_vars = self.chat_memory.load_memory_variables({})
-        history_str = loaded_memory_vars.get("chat_history", "")
+    async def aget_retrieved_documents(
+        self, query: str, history_str: str = "", read_up_to: Optional[list] = None
+    ):
+        logger.debug("Input user query: %r", query)
+
+        timings = {}
+        with timed(timings, "query_rewrite"):
+            retrieval_query_content = await self.utils.aquery_rewrite(
+                query, history_str
+            )
+
+        logger.debug("Query rewrite: %r", retrieval_query_content)
 
-        docs = self.get_retrieved_documents(query, history_str)
+        # Chroma and the reranker are synchronous, run them in a worker thread
+        # (which can't be interrupted, only told to stop early)
+        cancelled = threading.Event()
+        try:
+            with timed(timings, "retrieval"):
+                ranked_docs = await asyncio.to_thread(
+                    self._retrieve,
+                    retrieval_query_content,
+                    read_up_to,
+                    timings,
+                    cancelled,
+                )
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+        self._record_timings(timings)
+        return ranked_docs
 
-        context = self.utils.format_docs(docs)
+    def _build_prompt(self, query: str, docs) -> str:
+        context = self.context_assembler.assemble(docs)
 
         prompt_inputs = {
             "context": context,
             "query": query,
         }
-        final_prompt_str = self.prompt.format(**prompt_inputs)
+        return self.prompt.format(**prompt_inputs)
 
-        return final_prompt_str, query, docs
+    def _cacheable(self, query: str, history: str) -> bool:
+        # Only self-contained questions: others depend on the session history
+        return self.answer_cache is not None and not needs_query_rewrite(
+            query, history
+        )
 
-    def process_query(self, query: str, stream_response: bool = True):
-        final_prompt_str, original_query, retrieved_docs = self._prepare_rag_inputs(
-            query
+    def _cached_turn(self, query, probe, on_answer, started_at) -> "RAGTurn":
+        logger.debug("Answer cache hit for: %r", probe.hit.query)
+        return RAGTurn(
+            self,
+            query,
+            None,
+            probe.hit.docs,
+            on_answer,
+            cached_answer=probe.hit.answer,
+            started_at=started_at,
         )
 
-        if stream_response:
-            response_parts = []
-            for token in self.llm.stream(final_prompt_str):
-                response_parts.append(token.content)
-                yield token
-
-            full_response_content = "".join(response_parts)
-            self.chat_memory.save_context(
-                {"question": original_query}, {"answer": full_response_content}
-            )
-            print(f"RAGChain - LLM Answer (streamed): '{full_response_content}'")
-            return retrieved_docs  # Return docs for citations when streaming
+    def start_turn(
+        self,
+        query: str,
+        history: str = "",
+        on_answer: Optional[Callable] = None,
+        read_up_to: Optional[list] = None,
+    ) -> "RAGTurn":
+        """
+        Retrieve the context for a query once and return the turn built on it.
+        on_answer(answer) is called when the answer is complete, so the caller
+        can save the exchange to the session history (from a worker thread
+        with the async methods, so it may block). read_up_to bounds the
+        context to what the reader has already read.
+        """
+        started_at = time.perf_counter()
+        timings = {}
+        probe = None
+        if self._cacheable(query, history):
+            with timed(timings, "answer_cache_lookup"):
+                probe = self.answer_cache.lookup(query, read_up_to)
+            if probe.hit is not None:
+                self._record_timings(timings)
+                return self._cached_turn(query, probe, on_answer, started_at)
+
+        docs = self.get_retrieved_documents(query, history, read_up_to)
+        with timed(timings, "prompt_build"):
+            prompt_str = self._build_prompt(query, docs)
+        self._record_timings(timings)
+        return RAGTurn(
+            self, query, prompt_str, docs, on_answer, probe, started_at=started_at
+        )
+
+    async def astart_turn(
+        self,
+        query: str,
+        history: str = "",
+        on_answer: Optional[Callable] = None,
+        read_up_to: Optional[list] = None,
+    ) -> "RAGTurn":
+        """Async version of start_turn."""
+        started_at = time.perf_counter()
+        timings = {}
+        probe = None
+        try:
+            if self._cacheable(query, history):
+                # Embedding the query may call the provider, keep it off the loop
+                with timed(timings, "answer_cache_lookup"):
+                    probe = await asyncio.to_thread(
+                        self.answer_cache.lookup, query, read_up_to
+                    )
+                if probe.hit is not None:
+                    self._record_timings(timings)
+                    return self._cached_turn(query, probe, on_answer, started_at)
+
+            docs = await self.aget_retrieved_documents(query, history, read_up_to)
+        except asyncio.CancelledError:
+            # The cache lookup, the rewrite or the retrieval: the whole answer
+            # is saved
+            self.record_cancellation("retrieval")
+            raise
+        with timed(timings, "prompt_build"):
+            prompt_str = self._build_prompt(query, docs)
+        self._record_timings(timings)
+        return RAGTurn(
+            self, query, prompt_str, docs, on_answer, probe, started_at=started_at
+        )
+
+    def record_answer_length(self, answer: str):
+        tokens = self.context_assembler.count_tokens(answer)
+        with self._cancel_lock:
+            self._answers_seen += 1
+            self._mean_answer_tokens += (
+                tokens - self._mean_answer_tokens
+            ) / self._answers_seen
+
+    def record_cancellation(self, stage: str, partial_answer: str = ""):
+        """
+        Count a turn cancelled during retrieval or generation, and the answer
+        tokens it didn't generate (estimated from the mean answer length).
+        Until an answer has been completed there is no mean to estimate from:
+        those cancellations are counted as unestimated instead, and add
+        nothing to the tokens saved.
+        """
+        generated = self.context_assembler.count_tokens(partial_answer)
+        with self._cancel_lock:
+            self._cancellations[stage] += 1
+            estimated = self._answers_seen > 0
+            if estimated:
+                saved = max(0, round(self._mean_answer_tokens) - generated)
+                self._tokens_saved += saved
+            else:
+                self._unestimated += 1
+        generations_cancelled_total.inc(stage=stage)
+        if estimated:
+            cancelled_tokens_saved_total.inc(saved)
         else:
-            full_response = self.llm.invoke(final_prompt_str)
-            full_response_content = getattr(
-                full_response, "content", str(full_response)
-            )
+            cancellations_unestimated_total.inc()
 
-            self.chat_memory.save_context(
-                {"question": original_query}, {"answer": full_response_content}
-            )
-            print(f"RAGChain - LLM Answer (invoked): '{full_response_content}'")
-            return full_response_content, retrieved_docs
+    def cancellation_stats(self) -> dict:
+        with self._cancel_lock:
+            return {
+                "cancelled": dict(self._cancellations),
+                "tokens_saved": self._tokens_saved,
+                "unestimated": self._unestimated,
+                "mean_answer_tokens": self._mean_answer_tokens,
+            }
+
+    def process_query(
+        self,
+        query: str,
+        stream_response: bool = True,
+        history: str = "",
+        on_answer: Optional[Callable] = None,
+        read_up_to: Optional[list] = None,
+    ):
+        """
+        Answer a query. When streaming, returns a token generator; otherwise
+        returns the answer together with the documents used as its context.
+        """
+        turn = self.start_turn(query, history, on_answer, read_up_to)
 
-    def get_citations_for_query(self, query: str):
+        if stream_response:
+            return turn.stream()
+
+        return turn.invoke(), turn.docs
+
+    async def aprocess_query(
+        self,
+        query: str,
+        stream_response: bool = True,
+        history: str = "",
+        on_answer: Optional[Callable] = None,
+        read_up_to: Optional[list] = None,
+    ):
+        """
+        Async version of process_query. When streaming, returns an async token
+        generator; otherwise returns the answer and the documents used.
+        """
+        turn = await self.astart_turn(query, history, on_answer, read_up_to)
+
+        if stream_response:
+            return turn.astream()
+
+        return await turn.ainvoke(), turn.docs
+
+    def get_citations_for_query(
+        self, query: str, history: str = "", read_up_to: Optional[list] = None
+    ):
         """Get citations for a given query without generating a response"""
-        loaded_memory_vars = self.chat_memory.load_memory_variables({})
-        history_str = loaded_memory_vars.get("chat_history", "")
-        docs = self.get_retrieved_documents(query, history_str)
-        return docs
+        return self.get_retrieved_documents(query, history, read_up_to)
+
+
+class RAGTurn:
+    """
+    A single question/answer exchange. Retrieval is done once, when the turn is
+    created, so the citations are exactly the documents the answer was built on.
+    A turn served from the answer cache replays the cached answer instead.
+    Time to first token (from started_at, when the query arrived) and the
+    generation time are recorded with the chain's stage timings.
+    """
+
+    def __init__(
+        self,
+        chain: RAGChain,
+        query: str,
+        prompt_str: Optional[str],
+        docs,
+        on_answer: Optional[Callable] = None,
+        cache_probe=None,
+        cached_answer: Optional[str] = None,
+        started_at: Optional[float] = None,
+    ):
+        self.chain = chain
+        self.query = query
+        self.prompt_str = prompt_str
+        self.docs = docs
+        self.on_answer = on_answer
+        self.cache_probe = cache_probe
+        self.cached_answer = cached_answer
+        self.started_at = started_at if started_at is not None else time.perf_counter()
+        self.answer = None
+        self._generation_started = None
+        self._first_token_at = None
+
+    def _start_generation(self):
+        self._generation_started = time.perf_counter()
+
+    def _first_token(self):
+        if self._first_token_at is None:
+            self._first_token_at = time.perf_counter()
+
+    def _finish_generation(self, source: str):
+        answers_total.inc(source=source)
+        timings = {}
+        if self._first_token_at is not None:
+            timings["ttft"] = (self._first_token_at - self.started_at) * 1000
+        if self._generation_started is not None:
+            timings["generation"] = (
+                time.perf_counter() - self._generation_started
+            ) * 1000
+        self.chain._record_timings(timings)
+        logger.debug("LLM answer (%s): %d chars", source, len(self.answer or ""))
+
+    def _save_answer(self, answer: str):
+        self.answer = answer
+        if self.cached_answer is None:
+            self.chain.record_answer_length(answer)
+        if self.on_answer is not None:
+            self.on_answer(answer)
+        if self.cache_probe is not None:
+            self.chain.answer_cache.store(
+                self.cache_probe, self.query, answer, self.docs
+            )
+
+    def _replay_cached(self):
+        self._first_token()
+        self._save_answer(self.cached_answer)
+        self._finish_generation("answer_cache")
+        return AIMessageChunk(content=self.cached_answer)
+
+    async def _areplay_cached(self):
+        self._first_token()
+        # on_answer and the stores may be proxies to the store server
+        await asyncio.to_thread(self._save_answer, self.cached_answer)
+        self._finish_generation("answer_cache")
+        return AIMessageChunk(content=self.cached_answer)
+
+    def stream(self):
+        """Stream the answer tokens, reporting the full answer at the end."""
+        if self.cached_answer is not None:
+            yield self._replay_cached()
+            return
+
+        response_parts = []
+        self._start_generation()
+        for token in self.chain.llm.stream(self.prompt_str):
+            self._first_token()
+            response_parts.append(token.content)
+            yield token
+
+        self._save_answer("".join(response_parts))
+        self._finish_generation("generated")
+
+    def invoke(self) -> str:
+        """Generate the whole answer in one call."""
+        if self.cached_answer is not None:
+            return self._replay_cached().content
+
+        self._start_generation()
+        full_response = self.chain.llm.invoke(self.prompt_str)
+        self._save_answer(getattr(full_response, "content", str(full_response)))
+        self._finish_generation("generated")
+        return self.answer
+
+    async def astream(self):
+        """
+        Async version of stream. Cancelling the consumer (or closing this
+        generator) closes the model stream, aborting the generation.
+        """
+        if self.cached_answer is not None:
+            yield await self._areplay_cached()
+            return
+
+        response_parts = []
+        self._start_generation()
+        try:
+            async with aclosing(self.chain.llm.astream(self.prompt_str)) as tokens:
+                async for token in tokens:
+                    self._first_token()
+                    response_parts.append(token.content)
+                    yield token
+        except (asyncio.CancelledError, GeneratorExit):
+            self.chain.record_cancellation("generation", "".join(response_parts))
+            raise
+
+        await asyncio.to_thread(self._save_answer, "".join(response_parts))
+        self._finish_generation("generated")
+
+    async def ainvoke(self) -> str:
+        """Async version of invoke."""
+        if self.cached_answer is not None:
+            return (await self._areplay_cached()).content
+
+        self._start_generation()
+        full_response = await self.chain.llm.ainvoke(self.prompt_str)
+        await asyncio.to_thread(
+            self._save_answer, getattr(full_response, "content", str(full_response))
+        )
+        self._finish_generation("generated")
+        return self.answer
+
 
-    def clear_memory(self):
-        """Clear the chat memory to reset the conversation history."""
-        self.chat_memory.clear()
-        print("RAGChain - Memory cleared successfully")
+def _build_rag_chain():
+    return RAGChain(
+        services.llm,
+        services.vector_store.as_retriever(),
+        custom_rag_prompt,
+        services.answer_cache,
+        services.keyword_index,
+        services.reranker,
+        # Packs the ranked chunks into the prompt, merging overlapping ones
+        ContextAssembler(token_budget=int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))),
+    )
 
 
-rag_chain = RAGChain(llm, retriever, custom_rag_prompt)
+services.register("rag_chain", _build_rag_chain)
@@ -0,0 +1,174 @@
+import abc
+import concurrent.futures
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class Reranker(abc.ABC):
+    """
+    Reorders retrieval candidates by a relevance model, within a latency budget.
+
+    Subclasses implement score(query, texts), scoring all candidates in one
+    call. rerank() runs it on a single background thread and gives up after
+    budget_ms, returning None so the caller falls back to its own ranking.
+    It also gives up without trying when the previous call is still running
+    or the observed cost per candidate predicts the budget will be exceeded,
+    so a slow model degrades to the fallback instead of queueing requests.
+    """
+
+    def __init__(self, budget_ms: float = 250.0):
+        self.budget_ms = budget_ms
+        self.reranked = 0
+        self.timeouts = 0
+        self.skipped = 0
+        self.errors = 0
+        # Moving average of the scoring cost per candidate, in ms
+        self._ms_per_candidate = None
+        self._slot = threading.Semaphore(1)
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="reranker"
+        )
+        self._lock = threading.Lock()
+
+    @abc.abstractmethod
+    def score(self, query: str, texts: List[str]) -> np.ndarray:
+        """Relevance of each text to the query, higher is better. Blocking."""
+
+    def _timed_score(self, query: str, texts: List[str]) -> np.ndarray:
+        try:
+            started = time.perf_counter()
+            scores = self.score(query, texts)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            with self._lock:
+                cost = elapsed_ms / len(texts)
+                self._ms_per_candidate = (
+                    cost
+                    if self._ms_per_candidate is None
+                    else 0.8 * self._ms_per_candidate + 0.2 * cost
+                )
+            return scores
+        finally:
+            self._slot.release()
+
+    def rerank(self, query: str, docs: list, max_docs: int = 5) -> Optional[list]:
+        """The max_docs most relevant docs, or None if the budget can't be met."""
+        if not docs:
+            return []
+        with self._lock:
+            predicted_ms = (
+                self._ms_per_candidate * len(docs)
+                if self._ms_per_candidate is not None
+                else 0.0
+            )
+            if predicted_ms > self.budget_ms:
+                # Lower the estimate on every skip, so the model gets retried
+                # once the load that slowed it down has passed
+                self._ms_per_candidate *= 0.9
+                self.skipped += 1
+                return None
+        if not self._slot.acquire(blocking=False):
+            with self._lock:
+                self.skipped += 1
+            return None
+
+        future = self._executor.submit(
+            self._timed_score, query, [doc.page_content for doc in docs]
+        )
+        try:
+            scores = future.result(timeout=self.budget_ms / 1000)
+        except concurrent.futures.TimeoutError:
+            # Left to finish in the background: it still updates the cost
+            # estimate, and holds the slot so calls meanwhile fall back
+            with self._lock:
+                self.timeouts += 1
+            return None
+        except Exception as e:
+            logger.warning("Scoring failed: %s", e)
+            with self._lock:
+                self.errors += 1
+            return None
+
+        with self._lock:
+            self.reranked += 1
+        top = np.argsort(-np.asarray(scores, dtype=float), kind="stable")[:max_docs]
+        return [docs[i] for i in top]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "model": type(self).__name__,
+                "budget_ms": self.budget_ms,
+                "ms_per_candidate": self._ms_per_candidate,
+                "reranked": self.reranked,
+                "timeouts": self.timeouts,
+                "skipped": self.skipped,
+                "errors": self.errors,
+            }
+
+
+class OnnxCrossEncoder(Reranker):
+    """
+    CPU cross-encoder (e.g. a quantized ms-marco-MiniLM export) run with
+    ONNX Runtime. model_dir holds the model (model.onnx, or model_file) and
+    its tokenizer.json. All (query, text) pairs go through one forward pass.
+    """
+
+    def __init__(
+        self,
+        model_dir: str,
+        model_file: str = "model.onnx",
+        max_length: int = 256,
+        threads: int = 2,
+        budget_ms: float = 250.0,
+    ):
+        # Optional dependencies, only needed when a model is configured
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        super().__init__(budget_ms=budget_ms)
+        self.model_dir = model_dir
+        self.tokenizer = Tokenizer.from_file(
+            os.path.join(model_dir, "tokenizer.json")
+        )
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_dir, model_file),
+            sess_options=options,
+            providers=["CPUExecutionProvider"],
+        )
+        self._input_names = {
+            model_input.name for model_input in self.session.get_inputs()
+        }
+
+    def score(self, query: str, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch([(query, text) for text in texts])
+        inputs = {
+            "input_ids": [e.ids for e in encodings],
+            "attention_mask": [e.attention_mask for e in encodings],
+            "token_type_ids": [e.type_ids for e in encodings],
+        }
+        logits = self.session.run(
+            None,
+            {
+                name: np.array(value, dtype=np.int64)
+                for name, value in inputs.items()
+                if name in self._input_names
+            },
+        )[0]
+        # Single relevance logit, or the "relevant" class of a two-class head
+        return logits[:, -1] if logits.ndim == 2 else logits
+
+    def stats(self) -> dict:
+        return {**super().stats(), "model_dir": self.model_dir}
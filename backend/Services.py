@@ -0,0 +1,136 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceContainer:
+    """
+    Application services (clients, stores, the RAG chain) built lazily: each
+    one is created by its factory the first time it is used, once, so
+    importing the app is cheap and a broken credential only fails what needs
+    it. Factories may use other services; failed builds are retried on the
+    next use.
+
+    warm_up() builds services ahead of the first request (and runs their
+    optional warm hook, e.g. loading an index into memory), recording per
+    service timings and errors for the readiness endpoint.
+    """
+
+    def __init__(self):
+        self._factories: Dict[str, Callable] = {}
+        self._warmers: Dict[str, Callable] = {}
+        self._instances = {}
+        self._build_seconds: Dict[str, float] = {}
+        self._warm_seconds: Dict[str, float] = {}
+        self._errors: Dict[str, str] = {}
+        # Reentrant: factories get the services they depend on
+        self._lock = threading.RLock()
+        self.ready = threading.Event()
+
+    def register(self, name: str, factory: Callable, warm: Optional[Callable] = None):
+        """Register how to build a service, and optionally how to warm it."""
+        self._factories[name] = factory
+        if warm is not None:
+            self._warmers[name] = warm
+
+    def override(self, name: str, instance):
+        """Use this instance instead of building the service (benchmarks)."""
+        with self._lock:
+            self._instances[name] = instance
+            self._errors.pop(name, None)
+
+    @contextmanager
+    def overridden(self, **instances):
+        """
+        Override services within a with block (tests), then put back the
+        instances they replaced: services not built before are built again
+        on their next use.
+        """
+        with self._lock:
+            previous = {
+                name: self._instances[name]
+                for name in instances
+                if name in self._instances
+            }
+            for name, instance in instances.items():
+                self.override(name, instance)
+        try:
+            yield self
+        finally:
+            with self._lock:
+                for name in instances:
+                    if name in previous:
+                        self._instances[name] = previous[name]
+                    else:
+                        self._instances.pop(name, None)
+
+    def is_created(self, name: str) -> bool:
+        return name in self._instances
+
+    def get(self, name: str):
+        try:
+            return self._instances[name]
+        except KeyError:
+            pass
+        if name not in self._factories:
+            raise KeyError(f"Unknown service: {name}")
+
+        with self._lock:
+            if name in self._instances:
+                return self._instances[name]
+            start = time.perf_counter()
+            try:
+                instance = self._factories[name]()
+            except Exception as e:
+                self._errors[name] = f"{type(e).__name__}: {e}"
+                raise
+            self._build_seconds[name] = time.perf_counter() - start
+            self._errors.pop(name, None)
+            self._instances[name] = instance
+            logger.info(
+                "Service %s built in %.2fs", name, self._build_seconds[name]
+            )
+            return instance
+
+    def __getattr__(self, name: str):
+        # Only called for names that aren't attributes: services.vector_store
+        if name.startswith("_") or name not in self._factories:
+            raise AttributeError(name)
+        return self.get(name)
+
+    def warm_up(self, names: Optional[Iterable[str]] = None) -> bool:
+        """
+        Build (and warm) the services, all registered ones by default. Errors
+        are logged and recorded, not raised. True if every service is up.
+        """
+        ok = True
+        for name in names if names is not None else list(self._factories):
+            try:
+                instance = self.get(name)
+                warm = self._warmers.get(name)
+                if warm is not None and name not in self._warm_seconds:
+                    start = time.perf_counter()
+                    warm(instance)
+                    self._warm_seconds[name] = time.perf_counter() - start
+                self._errors.pop(name, None)
+            except Exception as e:
+                self._errors[name] = f"{type(e).__name__}: {e}"
+                logger.error("Warm-up of service %s failed: %s", name, e)
+                ok = False
+        return ok
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                name: {
+                    "created": name in self._instances,
+                    "build_seconds": self._build_seconds.get(name),
+                    "warm_seconds": self._warm_seconds.get(name),
+                    "error": self._errors.get(name),
+                }
+                for name in self._factories
+            }
@@ -0,0 +1,133 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Optional
+
+
+class Session:
+    """Conversation history of one reader: the last k question/answer pairs."""
+
+    def __init__(self, session_id: str, memory_window_k: int):
+        self.session_id = session_id
+        self.turns = deque(maxlen=memory_window_k)
+        self.size_bytes = 0
+        self.created_at = time.time()
+        self.last_used = time.monotonic()
+
+    @staticmethod
+    def _turn_size(question: str, answer: str) -> int:
+        return len(question.encode("utf-8")) + len(answer.encode("utf-8"))
+
+    def add_turn(self, question: str, answer: str) -> int:
+        """Append a turn, dropping the oldest past the window. Returns the size delta."""
+        delta = self._turn_size(question, answer)
+        if len(self.turns) == self.turns.maxlen:
+            delta -= self._turn_size(*self.turns[0])
+        self.turns.append((question, answer))
+        self.size_bytes += delta
+        return delta
+
+    def history_str(self) -> str:
+        # Same format as ConversationBufferWindowMemory's buffer string
+        return "\n".join(
+            f"Human: {question}\nAI: {answer}" for question, answer in self.turns
+        )
+
+
+class SessionStore:
+    """
+    In-process conversation memory keyed by session id, so concurrent readers
+    don't share or wipe each other's history.
+
+    Sessions expire after ttl_seconds without use, and the least recently used
+    ones are evicted when there are more than max_sessions or their histories
+    add up to more than max_bytes.
+    """
+
+    def __init__(
+        self,
+        memory_window_k: int = 3,  # Number of interactions to keep per session
+        max_sessions: int = 1000,
+        ttl_seconds: float = 3600.0,
+        max_bytes: int = 64 * 2**20,
+    ):
+        self.memory_window_k = memory_window_k
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self.expirations = 0
+        # Least recently used first
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._size_bytes = 0
+        self._lock = threading.Lock()
+
+    def _remove(self, session_id: str) -> Optional[Session]:
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self._size_bytes -= session.size_bytes
+        return session
+
+    def _expire(self, now: float):
+        # Sessions are ordered by last use, so the expired ones are at the front
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.last_used < self.ttl_seconds:
+                break
+            self._remove(session.session_id)
+            self.expirations += 1
+
+    def _enforce_limits(self, keep: str):
+        while len(self._sessions) > 1 and (
+            len(self._sessions) > self.max_sessions
+            or self._size_bytes > self.max_bytes
+        ):
+            oldest = next(iter(self._sessions))
+            if oldest == keep:
+                break
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _touch(self, session_id: str) -> Session:
+        now = time.monotonic()
+        self._expire(now)
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = self._sessions[session_id] = Session(
+                session_id, self.memory_window_k
+            )
+            self._enforce_limits(keep=session_id)
+        else:
+            self._sessions.move_to_end(session_id)
+        session.last_used = now
+        return session
+
+    def history(self, session_id: str) -> str:
+        """History string of a session, empty for new or expired sessions."""
+        with self._lock:
+            return self._touch(session_id).history_str()
+
+    def save_turn(self, session_id: str, question: str, answer: str):
+        with self._lock:
+            session = self._touch(session_id)
+            self._size_bytes += session.add_turn(question, answer)
+            self._enforce_limits(keep=session_id)
+
+    def clear(self, session_id: str) -> bool:
+        """Forget a session. Returns False if it didn't exist (or had expired)."""
+        with self._lock:
+            return self._remove(session_id) is not None
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._expire(time.monotonic())
+            return {
+                "sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "size_bytes": self._size_bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "memory_window_k": self.memory_window_k,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
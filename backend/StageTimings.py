@@ -0,0 +1,52 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+
+@contextmanager
+def timed(timings: dict, stage: str):
+    """Add the time spent in the block to timings[stage], in ms."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        timings[stage] = timings.get(stage, 0.0) + elapsed_ms
+
+
+class StageTimings:
+    """
+    Rolling window of per-stage latencies of the last window requests, to see
+    where retrieval time goes and tune k against it.
+    """
+
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self._stages = {}  # stage -> deque of ms
+        self._lock = threading.Lock()
+
+    def record(self, timings: dict):
+        with self._lock:
+            for stage, elapsed_ms in timings.items():
+                samples = self._stages.get(stage)
+                if samples is None:
+                    samples = self._stages[stage] = deque(maxlen=self.window)
+                samples.append(elapsed_ms)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stages = {stage: list(samples) for stage, samples in self._stages.items()}
+        result = {}
+        for stage, samples in stages.items():
+            p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+            result[stage] = {
+                "count": len(samples),
+                "p50_ms": round(float(p50), 3),
+                "p95_ms": round(float(p95), 3),
+                "p99_ms": round(float(p99), 3),
+                "max_ms": round(max(samples), 3),
+            }
+        return result
@@ -0,0 +1,173 @@
+"""
+Store server: one process owning the state the API workers must share (file
+registry, keyword index, ingestion jobs and chat sessions), served over a
+socket, so several uvicorn workers or hosts can serve the same readers.
+Vectors go to a Chroma server (CHROMA_HOST / CHROMA_PORT) that all of them
+use.
+
+    chroma run --path ./chroma_db --port 8001
+    CHROMA_HOST=localhost CHROMA_PORT=8001 STORE_AUTHKEY=secret \\
+        python StoreServer.py --address 127.0.0.1:50051
+    CHROMA_HOST=localhost CHROMA_PORT=8001 STORE_AUTHKEY=secret \\
+        STORE_ADDRESS=127.0.0.1:50051 uvicorn main:app --workers 4
+
+Without STORE_ADDRESS the API opens these stores itself (one process).
+"""
+
+import argparse
+import logging
+import os
+from multiprocessing.managers import BaseManager
+
+from dotenv import load_dotenv
+
+from FileRegistry import FileRegistry
+from IngestionJobs import IngestionJobStore
+from KeywordIndex import KeywordIndex
+from SessionStore import SessionStore
+
+logger = logging.getLogger(__name__)
+
+STORE_NAMES = (
+    "file_registry",
+    "keyword_index",
+    "ingestion_job_store",
+    "session_store",
+)
+
+
+def open_vector_store(
+    collection_name: str, persist_directory: str, embedding_function=None
+):
+    """
+    The Chroma collection: on the Chroma server at CHROMA_HOST if set (shared
+    by processes and hosts), else embedded in persist_directory.
+    """
+    # Imported here: chromadb is slow to import
+    from langchain_chroma import Chroma
+
+    chroma_host = os.getenv("CHROMA_HOST")
+    if chroma_host:
+        import chromadb
+
+        return Chroma(
+            collection_name=collection_name,
+            embedding_function=embedding_function,
+            client=chromadb.HttpClient(
+                host=chroma_host, port=int(os.getenv("CHROMA_PORT", "8000"))
+            ),
+        )
+    return Chroma(
+        collection_name=collection_name,
+        embedding_function=embedding_function,
+        persist_directory=persist_directory,
+    )
+
+
+def chroma_batches(vector_store, ids: list):
+    """
+    ids in slices Chroma accepts in one call: it rejects updates and deletes
+    of more ids than its max batch size (a few thousand), e.g. a large book.
+    """
+    size = vector_store._client.get_max_batch_size()
+    for start in range(0, len(ids), size):
+        yield ids[start : start + size]
+
+
+def build_store(name: str, data_dir: str):
+    """A local instance of one of the shared stores."""
+    if name == "file_registry":
+        return FileRegistry(os.path.join(data_dir, "file_registry.db"))
+    if name == "keyword_index":
+        return KeywordIndex(os.path.join(data_dir, "keyword_index.db"))
+    if name == "ingestion_job_store":
+        return IngestionJobStore(os.path.join(data_dir, "ingestion_jobs.db"))
+    if name == "session_store":
+        # Conversation history per reader session
+        return SessionStore(
+            memory_window_k=3,
+            max_sessions=1000,
+            ttl_seconds=3600,
+            max_bytes=64 * 2**20,
+        )
+    raise KeyError(f"Unknown store: {name}")
+
+
+def parse_address(address: str):
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+class _ServerManager(BaseManager):
+    pass
+
+
+class _ClientManager(BaseManager):
+    pass
+
+
+for _name in STORE_NAMES:
+    _ClientManager.register(_name)
+
+
+def connect_stores(address: str, authkey: str) -> BaseManager:
+    """
+    Connect to a store server. manager.<store name>() returns a proxy whose
+    method calls run on the server.
+    """
+    manager = _ClientManager(
+        address=parse_address(address), authkey=authkey.encode()
+    )
+    manager.connect()
+    return manager
+
+
+def serve(address: str, authkey: str, data_dir: str, collection_name: str):
+    stores = {name: build_store(name, data_dir) for name in STORE_NAMES}
+
+    # Stores created before the registry and the keyword index existed
+    file_registry, keyword_index = stores["file_registry"], stores["keyword_index"]
+    if file_registry.is_empty() or keyword_index.is_empty():
+        vector_store = open_vector_store(
+            collection_name, os.path.join(data_dir, "chroma_db")
+        )
+        if file_registry.is_empty():
+            file_registry.rebuild_from_store(vector_store)
+        if keyword_index.is_empty() and not file_registry.is_empty():
+            keyword_index.rebuild_from_store(vector_store)
+
+    for name, store in stores.items():
+        _ServerManager.register(name, callable=lambda store=store: store)
+    server = _ServerManager(
+        address=parse_address(address), authkey=authkey.encode()
+    ).get_server()
+    logger.info("Store server listening on %s", address)
+    server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--address", default=os.getenv("STORE_ADDRESS", "127.0.0.1:50051")
+    )
+    parser.add_argument(
+        "--data-dir", default=os.getenv("DATA_DIR", os.path.dirname(__file__))
+    )
+    parser.add_argument(
+        "--collection", default=os.getenv("CHROMA_COLLECTION", "test_collection")
+    )
+    args = parser.parse_args()
+    authkey = os.getenv("STORE_AUTHKEY")
+    if not authkey:
+        parser.error("Set STORE_AUTHKEY (shared with the API workers)")
+
+    logging.basicConfig(
+        level=os.getenv("LOG_LEVEL", "INFO").upper(),
+        format="%(asctime)s - %(levelname)s - %(name)s - %(message)s",
+    )
+    serve(args.address, authkey, args.data_dir, args.collection)
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    main()
@@ -0,0 +1,211 @@
+"""
+Version 2 of the /ws/stream protocol: JSON frames instead of raw tokens mixed
+with <<...>> markers. A client selects it with the WebSocket subprotocol
+(new WebSocket(url, "coreader.v2")) or ?protocol=2, else it gets the text
+protocol of version 1.
+
+Server to client, one JSON object per frame:
+    {"type": "hello", "v": 2, "session_id": ...}            once, on connect
+    {"type": "start", "turn": 1, "id": ...}                 a query was accepted
+    {"type": "token", "text": ...}                          answer text, batched
+    {"type": "citations", "turn": 1, "citations": [...]}
+    {"type": "end", "turn": 1}                              the answer is done
+    {"type": "cancelled", "turn": 1, "reason": ...}         superseded or client
+    {"type": "error", "code": ..., "message": ..., "turn": 1}
+A turn ends with "end", "cancelled" or "error"; errors such as NO_QUERY or
+BAD_READ_UP_TO don't close the connection. "id" echoes the client's id.
+
+Client to server:
+    {"type": "query", "query": ..., "session_id": ..., "read_up_to": [...],
+     "id": ...}                     cancels the answer in progress, if any
+    {"type": "cancel"}              cancels the answer in progress
+"""
+
+import asyncio
+import json
+import logging
+import time
+from typing import Awaitable, Callable, Optional
+
+from starlette.websockets import WebSocketDisconnect
+
+from Metrics import ws_backpressure_seconds_total, ws_frames_total
+
+logger = logging.getLogger(__name__)
+
+PROTOCOL_VERSION = 2
+SUBPROTOCOL = f"coreader.v{PROTOCOL_VERSION}"
+
+_CLOSE = object()
+
+
+def encode_frame(frame: dict) -> str:
+    return json.dumps(frame, separators=(",", ":"))
+
+
+class TextSender:
+    """
+    FrameSender's interface for clients of the text protocol (version 1):
+    one message per token, then <<CITATIONS>>[...] and <<END>>, or
+    <<E:CODE>> on errors, sent right away.
+    """
+
+    def __init__(self, send_text: Callable[[str], Awaitable[None]]):
+        self.send_text = send_text
+
+    def start(self):
+        pass
+
+    async def token(self, text: str):
+        await self.send_text(text)
+
+    async def send(self, frame: dict):
+        kind = frame["type"]
+        if kind == "citations":
+            await self.send_text(f"<<CITATIONS>>{json.dumps(frame['citations'])}")
+        elif kind in ("end", "cancelled"):
+            await self.send_text("<<END>>")
+        elif kind == "error":
+            await self.send_text(f"<<E:{frame['code']}>>")
+
+    async def aclose(self):
+        pass
+
+
+class FrameSender:
+    """
+    Sends the frames of one connection from a bounded queue, in a task of its
+    own, so producing an answer and writing it to the socket overlap.
+
+    Tokens are coalesced: the first token after a "start" frame goes out at
+    once (time to first token), then the tokens of each max_delay window, at
+    most max_chars per frame, share one "token" frame. A typed frame (e.g.
+    the end of the answer) or max_chars of tokens close the window early;
+    typed frames keep their order with the tokens.
+
+    When the client reads slower than the answer is generated the queue fills
+    up and token() waits, which stops pulling tokens from the model until the
+    client catches up. A client that doesn't read for send_timeout seconds is
+    dropped.
+    """
+
+    def __init__(
+        self,
+        send_text: Callable[[str], Awaitable[None]],
+        max_delay: float = 0.04,
+        max_chars: int = 2048,
+        max_queue: int = 256,
+        send_timeout: float = 30.0,
+    ):
+        self.send_text = send_text
+        self.max_delay = max_delay
+        self.max_chars = max_chars
+        self.send_timeout = send_timeout
+        self.frames = 0
+        self.backpressure_seconds = 0.0
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._error: Optional[BaseException] = None
+        self._immediate = False
+        self._window: Optional[asyncio.Future] = None
+        self._window_chars = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def _put(self, item):
+        if self._error is not None:
+            raise WebSocketDisconnect(code=1006)
+        if not self._queue.full():
+            self._queue.put_nowait(item)
+            return
+        start = time.perf_counter()
+        await self._queue.put(item)
+        waited = time.perf_counter() - start
+        self.backpressure_seconds += waited
+        ws_backpressure_seconds_total.inc(waited)
+        if self._error is not None:
+            raise WebSocketDisconnect(code=1006)
+
+    async def token(self, text: str):
+        if text:
+            await self._put(text)
+            self._window_chars += len(text)
+            if self._window_chars >= self.max_chars:
+                self._end_window()
+
+    async def send(self, frame: dict):
+        """Queue a typed frame (after the tokens queued before it)."""
+        await self._put(frame)
+        self._end_window()
+
+    async def aclose(self):
+        """Send what is queued, then stop."""
+        if self._task is None or self._task.done():
+            return
+        try:
+            await self._put(_CLOSE)
+        except WebSocketDisconnect:
+            pass
+        await self._task
+
+    def _end_window(self):
+        if self._window is not None and not self._window.done():
+            self._window.set_result(None)
+
+    async def _wait_window(self):
+        loop = asyncio.get_running_loop()
+        self._window = loop.create_future()
+        timer = loop.call_later(self.max_delay, self._end_window)
+        try:
+            await self._window
+        finally:
+            timer.cancel()
+            self._window = None
+
+    async def _send(self, frame: dict):
+        async with asyncio.timeout(self.send_timeout):
+            await self.send_text(encode_frame(frame))
+        self.frames += 1
+        ws_frames_total.inc(type=frame["type"])
+
+    async def _run(self):
+        try:
+            while True:
+                item = await self._queue.get()
+                if isinstance(item, str):
+                    # Wait for the rest of the window, unless tokens are
+                    # already waiting (the client is the slower side)
+                    if not self._immediate and self._queue.empty():
+                        await self._wait_window()
+                    self._immediate = False
+                    self._window_chars = 0
+                    parts, size, item = [item], len(item), None
+                    while size < self.max_chars and not self._queue.empty():
+                        queued = self._queue.get_nowait()
+                        if not isinstance(queued, str):
+                            item = queued
+                            break
+                        parts.append(queued)
+                        size += len(queued)
+                    await self._send({"type": "token", "text": "".join(parts)})
+                    if item is None:
+                        continue
+                if item is _CLOSE:
+                    return
+                await self._send(item)
+                self._immediate = item["type"] == "start"
+        except TimeoutError:
+            logger.warning(
+                "Dropping a /ws/stream client that read nothing for %gs",
+                self.send_timeout,
+            )
+            self._error = ConnectionError("Client too slow")
+        except Exception as e:
+            self._error = e
+        finally:
+            if self._error is None:
+                self._error = ConnectionError("Sender closed")
+            # Unblock a producer waiting for room in the queue
+            while not self._queue.empty():
+                self._queue.get_nowait()
@@ -0,0 +1,100 @@
+"""
+Latency of N simultaneous chat sessions, blocking vs async RAG pipeline.
+
+The blocking mode reproduces the old handler (sync rewrite, search and token
+stream inside the coroutine); the async mode uses astart_turn/astream.
+
+    cd backend && python -m benchmarks.bench_concurrency --sessions 1 8 32
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import time
+
+from langchain_chroma import Chroma
+
+from benchmarks.fakes import FakeChatModel, FakeEmbeddings, percentile
+import RAGChain as rag_module
+
+
+def build_chain(args):
+    store = Chroma(
+        collection_name="bench_concurrency",
+        embedding_function=FakeEmbeddings(size=256),
+    )
+    store.add_texts(
+        [f"Passage {i} of the synthetic book." * 20 for i in range(args.chunks)],
+        metadatas=[{"file_id": "bench", "is_active": True}] * args.chunks,
+    )
+    llm = FakeChatModel(
+        first_token_latency=args.first_token_latency, token_latency=args.token_latency
+    )
+    return rag_module.RAGChain(
+        llm, store.as_retriever(), rag_module.custom_rag_prompt
+    )
+
+
+async def blocking_session(chain, queries, ttft, totals):
+    for query in queries:
+        start = time.perf_counter()
+        turn = chain.start_turn(query)
+        first = True
+        for _ in turn.stream():
+            if first:
+                ttft.append(time.perf_counter() - start)
+                first = False
+            await asyncio.sleep(0)
+        totals.append(time.perf_counter() - start)
+
+
+async def async_session(chain, queries, ttft, totals):
+    for query in queries:
+        start = time.perf_counter()
+        turn = await chain.astart_turn(query)
+        first = True
+        async for _ in turn.astream():
+            if first:
+                ttft.append(time.perf_counter() - start)
+                first = False
+        totals.append(time.perf_counter() - start)
+
+
+async def run(chain, mode, sessions, turns):
+    session = blocking_session if mode == "blocking" else async_session
+    ttft, totals = [], []
+    queries = [f"Who is character {i}?" for i in range(turns)]
+    start = time.perf_counter()
+    await asyncio.gather(*(session(chain, queries, ttft, totals) for _ in range(sessions)))
+    return ttft, totals, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--chunks", type=int, default=500)
+    parser.add_argument("--first-token-latency", type=float, default=0.2)
+    parser.add_argument("--token-latency", type=float, default=0.005)
+    args = parser.parse_args()
+
+    chain = build_chain(args)
+
+    print(f"{'mode':<9}{'sessions':>9}{'ttft p50':>10}{'ttft p99':>10}"
+          f"{'total p50':>11}{'total p99':>11}{'wall':>8}")
+    for sessions in args.sessions:
+        for mode in ("blocking", "async"):
+            # Silence the pipeline's per-query logging
+            with contextlib.redirect_stdout(io.StringIO()):
+                ttft, totals, wall = asyncio.run(run(chain, mode, sessions, args.turns))
+            print(
+                f"{mode:<9}{sessions:>9}"
+                f"{percentile(ttft, 50):>10.3f}{percentile(ttft, 99):>10.3f}"
+                f"{percentile(totals, 50):>11.3f}{percentile(totals, 99):>11.3f}"
+                f"{wall:>8.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
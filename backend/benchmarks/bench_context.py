@@ -0,0 +1,91 @@
+"""
+Prompt context size per query: the plain "\\n\\n" join of the ranked chunks vs
+the ContextAssembler (overlap merging + token budget), on a synthetic book
+chunked by the app's text splitter. Retrieval is simulated with top 5 lists
+where a share of the hits are neighbours of the best chunk, as happens when a
+passage spans several chunks.
+
+    cd backend && python -m benchmarks.bench_context --locality 0 0.5 1
+"""
+
+import argparse
+import random
+import time
+
+from benchmarks.bench_ranking import build_vocabulary
+from benchmarks.fakes import percentile
+from ContextAssembler import ContextAssembler
+from DocProcessing import DocProcessing
+import RAGChain as rag_module
+
+
+def build_chunks(paragraphs: int, vocabulary):
+    words, weights = vocabulary
+    text = "\n\n".join(
+        ". ".join(
+            " ".join(random.choices(words, weights, k=random.randint(8, 20)))
+            for _ in range(random.randint(1, 30))
+        )
+        + "."
+        for _ in range(paragraphs)
+    )
+    chunks = list(
+        DocProcessing("book.txt", text.encode("utf-8")).iter_chunks(
+            rag_module.text_splitter
+        )
+    )
+    for chunk in chunks:
+        chunk.metadata["file_id"] = "book"
+    return chunks
+
+
+def simulate_top_k(chunks, locality: float, k: int = 5):
+    anchor = random.randrange(k, len(chunks) - k)
+    picked = [anchor]
+    while len(picked) < k:
+        if random.random() < locality:
+            index = anchor + random.randint(-(k // 2), k // 2)
+        else:
+            index = random.randrange(len(chunks))
+        if index not in picked:
+            picked.append(index)
+    return [chunks[i] for i in picked]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--locality", type=float, nargs="+", default=[0, 0.5, 1])
+    parser.add_argument("--budget", type=int, default=1500)
+    parser.add_argument("--queries", type=int, default=500)
+    args = parser.parse_args()
+
+    random.seed(0)
+    chunks = build_chunks(2000, build_vocabulary())
+    utils = rag_module.Utils(None)
+
+    print(
+        f"{'locality':>9}{'join tokens':>13}{'packed tokens':>15}{'saved':>8}"
+        f"{'spans':>7}{'lossless':>10}{'p50 ms':>8}"
+    )
+    for locality in args.locality:
+        assembler = ContextAssembler(token_budget=args.budget)
+        lossless, timings = 0, []
+        for _ in range(args.queries):
+            docs = simulate_top_k(chunks, locality)
+            start = time.perf_counter()
+            context = assembler.assemble(docs)
+            timings.append(time.perf_counter() - start)
+            # Every chunk's text is still in the context, unless over budget
+            lossless += all(doc.page_content in context for doc in docs)
+            assert utils.format_docs(docs)  # The previous context, for reference
+        stats = assembler.stats()
+        print(
+            f"{locality:>9.1f}{stats['avg_tokens_in']:>13.0f}"
+            f"{stats['avg_tokens_out']:>15.0f}{stats['token_reduction']:>8.0%}"
+            f"{stats['avg_spans_out']:>7.1f}{lossless / args.queries:>10.0%}"
+            f"{percentile(timings, 50) * 1000:>8.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
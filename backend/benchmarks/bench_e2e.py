@@ -0,0 +1,458 @@
+"""
+End-to-end benchmark of the API: ingestion, chat sessions and file management.
+
+The app (main.py) is served by uvicorn in this process, on a temporary
+DATA_DIR, with the Gemini chat model and embeddings swapped for the
+deterministic fakes of benchmarks.fakes (configurable latency), so it runs
+offline. It then:
+  1. uploads synthetic PDF books through /upload_file and polls /jobs/{id}
+  2. runs concurrent reader sessions over /ws/stream and /rag
+  3. lists, toggles and deletes the books (/get_uploaded_files,
+     /toggle_file_status, /delete_file)
+and reports throughput, latency percentiles and memory (RSS of the process,
+server and client together).
+
+    cd backend && python -m benchmarks.bench_e2e --pages 10 100 1000 5000
+    cd backend && python -m benchmarks.bench_e2e --quick --json results.json
+    cd backend && python -m benchmarks.bench_e2e --quick --baseline results.json
+
+With --baseline the run exits with status 1 when a latency or memory figure
+is more than --max-regression worse than in the baseline JSON, so CI can
+catch performance regressions.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import fitz
+
+from benchmarks.fakes import FakeChatModel, FakeEmbeddings, install_fakes, percentile
+from StreamProtocol import SUBPROTOCOL
+
+QUICK = {"pages": [10, 100], "sessions": 8, "turns": 2}
+
+STORY_WORDS = (
+    "rain river mill sack bell Marta Tomas caretaker letter house road winter "
+    "bridge lantern village mother brother promise storm harvest flour night "
+    "window stranger debt ledger church orchard wolf snow market cellar key"
+).split()
+
+
+def build_book(path: str, pages: int, seed: int):
+    """A PDF of varied pages (chunks aren't duplicates of each other)."""
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for page_number in range(pages):
+        page = doc.new_page()
+        if page_number % 25 == 0:
+            page.insert_text((72, 60), f"Chapter {page_number // 25 + 1}", fontsize=14)
+        paragraphs = [
+            ". ".join(
+                " ".join(rng.choices(STORY_WORDS, k=rng.randint(6, 16))).capitalize()
+                for _ in range(rng.randint(3, 6))
+            )
+            + "."
+            for _ in range(4)
+        ]
+        page.insert_textbox(
+            fitz.Rect(72, 80, 540, 780), "\n".join(paragraphs), fontsize=10
+        )
+    doc.save(path)
+    doc.close()
+
+
+def rss_mb() -> float:
+    with open("/proc/self/status") as status_file:
+        for line in status_file:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def latency_stats(values) -> dict:
+    return {
+        "count": len(values),
+        "p50_ms": percentile(values, 50) * 1000 if values else None,
+        "p95_ms": percentile(values, 95) * 1000 if values else None,
+        "p99_ms": percentile(values, 99) * 1000 if values else None,
+        "max_ms": max(values) * 1000 if values else None,
+    }
+
+
+def start_server(app):
+    import uvicorn
+
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    server = uvicorn.Server(
+        uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning")
+    )
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("The benchmark server failed to start")
+        time.sleep(0.05)
+    return server, thread, port
+
+
+async def ingest(client, path: str, pages: int) -> dict:
+    start = time.perf_counter()
+    with open(path, "rb") as book:
+        response = await client.post(
+            "/upload_file",
+            files={"file": (f"book_{pages}.pdf", book, "application/pdf")},
+        )
+    response.raise_for_status()
+    accepted = time.perf_counter() - start
+    upload = response.json()
+    while True:
+        job = (await client.get(f"/jobs/{upload['job_id']}")).json()["job"]
+        if job["status"] in ("completed", "failed", "cancelled"):
+            break
+        await asyncio.sleep(0.1)
+    seconds = time.perf_counter() - start
+    if job["status"] != "completed":
+        raise RuntimeError(f"Ingestion of {pages} pages {job['status']}: {job}")
+    return {
+        "pages": pages,
+        "file_id": upload["file_id"],
+        "chunks": job["chunks_total"],
+        "accept_ms": accepted * 1000,
+        "seconds": seconds,
+        "pages_per_s": pages / seconds,
+        "chunks_per_s": job["chunks_total"] / seconds,
+    }
+
+
+async def ws_session(url: str, queries, ttft, totals, busy: dict):
+    from websockets.asyncio.client import connect
+
+    async with connect(
+        url, max_size=None, subprotocols=[SUBPROTOCOL]
+    ) as websocket:
+        await websocket.recv()  # hello
+        for query in queries:
+            # Latencies count from the first attempt, retries included
+            start = time.perf_counter()
+            first = True
+            answered = False
+            while not answered:
+                await websocket.send(json.dumps({"type": "query", "query": query}))
+                while True:
+                    frame = json.loads(await websocket.recv())
+                    if frame["type"] == "end":
+                        answered = True
+                        break
+                    if frame["type"] == "error" and frame["code"] == "BUSY":
+                        # Turned away by the generation scheduler
+                        busy["ws"] += 1
+                        await asyncio.sleep(frame["retry_after"])
+                        break
+                    if frame["type"] == "error":
+                        raise RuntimeError(f"Chat error {frame}")
+                    if first and frame["type"] == "token":
+                        ttft.append(time.perf_counter() - start)
+                        first = False
+            totals.append(time.perf_counter() - start)
+
+
+async def rag_session(client, session_id: str, queries, totals, busy: dict):
+    for query in queries:
+        start = time.perf_counter()
+        while True:
+            response = await client.post(
+                "/rag", json={"query": query, "session_id": session_id}
+            )
+            if response.status_code != 503:
+                break
+            busy["rag"] += 1
+            await asyncio.sleep(float(response.headers.get("Retry-After", "1")))
+        response.raise_for_status()
+        totals.append(time.perf_counter() - start)
+
+
+def session_queries(session: int, turns: int):
+    # Distinct per session, so the answer cache doesn't serve them
+    return [
+        f"What does {STORY_WORDS[(session + turn) % len(STORY_WORDS)]} "
+        f"mean to reader {session} in part {turn}?"
+        for turn in range(turns)
+    ]
+
+
+async def chat(client, port: int, sessions: int, turns: int) -> dict:
+    ws_ttft, ws_totals, rag_totals = [], [], []
+    busy = {"ws": 0, "rag": 0}
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(
+            ws_session(
+                f"ws://127.0.0.1:{port}/ws/stream?session_id=ws-{uuid.uuid4()}",
+                session_queries(session, turns),
+                ws_ttft,
+                ws_totals,
+                busy,
+            )
+            for session in range(sessions)
+        ),
+        *(
+            rag_session(
+                client,
+                f"rag-{uuid.uuid4()}",
+                session_queries(sessions + session, turns),
+                rag_totals,
+                busy,
+            )
+            for session in range(sessions)
+        ),
+    )
+    elapsed = time.perf_counter() - start
+    return {
+        "sessions": sessions * 2,
+        "turns": len(ws_totals) + len(rag_totals),
+        "seconds": elapsed,
+        "turns_per_s": (len(ws_totals) + len(rag_totals)) / elapsed,
+        "ws_ttft": latency_stats(ws_ttft),
+        "ws_total": latency_stats(ws_totals),
+        "rag": latency_stats(rag_totals),
+        "busy_retries": busy,
+    }
+
+
+async def timed_request(client, method: str, url: str, timings, **kwargs):
+    start = time.perf_counter()
+    response = await client.request(method, url, **kwargs)
+    timings.append(time.perf_counter() - start)
+    response.raise_for_status()
+    return response
+
+
+async def manage_files(client, file_ids, repeats: int = 20) -> dict:
+    listing, toggles, deletes = [], [], []
+    for _ in range(repeats):
+        await timed_request(client, "GET", "/get_uploaded_files", listing)
+    for file_id in file_ids:
+        for is_active in (False, True):
+            await timed_request(
+                client,
+                "POST",
+                "/toggle_file_status",
+                toggles,
+                json={"file_id": file_id, "is_active": is_active},
+            )
+    for file_id in file_ids:
+        await timed_request(client, "DELETE", f"/delete_file/{file_id}", deletes)
+    return {
+        "list": latency_stats(listing),
+        "toggle": latency_stats(toggles),
+        "delete": latency_stats(deletes),
+    }
+
+
+async def wait_ready(client, started: float) -> float:
+    while (await client.get("/readyz")).status_code != 200:
+        await asyncio.sleep(0.05)
+    return time.perf_counter() - started
+
+
+async def run(args, port: int, books, started: float, on_ready) -> dict:
+    import httpx
+
+    results = {"ingestion": [], "memory": {"start_rss_mb": rss_mb()}}
+    async with httpx.AsyncClient(
+        base_url=f"http://127.0.0.1:{port}", timeout=600
+    ) as client:
+        results["ready_s"] = await wait_ready(client, started)
+        on_ready()
+        for pages, path in books:
+            results["ingestion"].append(await ingest(client, path, pages))
+        results["memory"]["after_ingestion_rss_mb"] = rss_mb()
+
+        results["chat"] = await chat(client, port, args.sessions, args.turns)
+        results["memory"]["after_chat_rss_mb"] = rss_mb()
+
+        file_ids = [row.pop("file_id") for row in results["ingestion"]]
+        results["files"] = await manage_files(client, file_ids)
+    results["memory"]["peak_rss_mb"] = peak_rss_mb()
+    return results
+
+
+def summary(results) -> dict:
+    """Lower is better figures, the ones compared against a baseline."""
+    figures = {"ready_s": results["ready_s"]}
+    for row in results["ingestion"]:
+        figures[f"ingest_s[{row['pages']} pages]"] = row["seconds"]
+    chat_stats = results["chat"]
+    figures["ws_ttft_p95_ms"] = chat_stats["ws_ttft"]["p95_ms"]
+    figures["ws_total_p95_ms"] = chat_stats["ws_total"]["p95_ms"]
+    figures["rag_p95_ms"] = chat_stats["rag"]["p95_ms"]
+    for operation, stats in results["files"].items():
+        figures[f"{operation}_p95_ms"] = stats["p95_ms"]
+    figures["peak_rss_mb"] = results["memory"]["peak_rss_mb"]
+    return figures
+
+
+def report(results):
+    print(f"Ready {results['ready_s']:.2f} s after start\n")
+    print(f"{'pages':>6}{'chunks':>8}{'accept ms':>11}{'total s':>9}"
+          f"{'pages/s':>9}{'chunks/s':>10}")
+    for row in results["ingestion"]:
+        print(
+            f"{row['pages']:>6}{row['chunks']:>8}{row['accept_ms']:>11.1f}"
+            f"{row['seconds']:>9.2f}{row['pages_per_s']:>9.1f}"
+            f"{row['chunks_per_s']:>10.1f}"
+        )
+
+    chat_stats = results["chat"]
+    print(
+        f"\n{chat_stats['sessions']} sessions, {chat_stats['turns']} turns in "
+        f"{chat_stats['seconds']:.2f} s ({chat_stats['turns_per_s']:.1f} turns/s), "
+        f"retried when busy: {chat_stats['busy_retries']['ws']} on /ws/stream, "
+        f"{chat_stats['busy_retries']['rag']} on /rag"
+    )
+    rows = [
+        ("ws ttft", chat_stats["ws_ttft"]),
+        ("ws total", chat_stats["ws_total"]),
+        ("/rag", chat_stats["rag"]),
+    ] + [(operation, stats) for operation, stats in results["files"].items()]
+    print(f"{'':<10}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, stats in rows:
+        print(
+            f"{name:<10}{stats['count']:>6}{stats['p50_ms']:>10.1f}"
+            f"{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}{stats['max_ms']:>10.1f}"
+        )
+
+    memory = results["memory"]
+    print(
+        f"\nRSS MB: start {memory['start_rss_mb']:.0f}, after ingestion "
+        f"{memory['after_ingestion_rss_mb']:.0f}, after chat "
+        f"{memory['after_chat_rss_mb']:.0f}, peak {memory['peak_rss_mb']:.0f}"
+    )
+
+
+def compare(figures: dict, baseline: dict, max_regression: float) -> list:
+    regressions = []
+    for name, value in figures.items():
+        previous = baseline.get(name)
+        if value is None or not previous:
+            continue
+        change = value / previous - 1
+        flag = "REGRESSION" if change > max_regression else ""
+        print(f"{name:<24}{previous:>12.2f}{value:>12.2f}{change:>+9.0%}  {flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    parser.add_argument("--sessions", type=int, default=32)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument(
+        "--quick", action="store_true", help="Small profile for CI: " + str(QUICK)
+    )
+    parser.add_argument("--first-token-latency", type=float, default=0.2)
+    parser.add_argument("--token-latency", type=float, default=0.005)
+    parser.add_argument(
+        "--embed-latency", type=float, default=0.05, help="Seconds per embed call"
+    )
+    parser.add_argument(
+        "--embed-rps",
+        type=float,
+        default=1000.0,
+        help="Embedding request rate limit (the Gemini quota is 5)",
+    )
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--baseline", help="Results JSON of a previous run")
+    parser.add_argument("--max-regression", type=float, default=0.25)
+    args = parser.parse_args()
+    if args.quick:
+        for name, value in QUICK.items():
+            setattr(args, name, value)
+
+    data_dir = tempfile.mkdtemp(prefix="coreader-bench-")
+    os.environ["DATA_DIR"] = data_dir
+    os.environ.setdefault("EMBEDDING_BACKEND", "google")  # Replaced by the fake
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    try:
+        books = []
+        for pages in args.pages:
+            path = os.path.join(data_dir, f"book_{pages}.pdf")
+            build_book(path, pages, seed=pages)
+            books.append((pages, path))
+
+        # DATA_DIR is read when the app modules are imported
+        import main as app_module
+        from BatchEmbedder import TokenBucket
+        from RAGChain import services
+
+        install_fakes(
+            services,
+            FakeChatModel(
+                first_token_latency=args.first_token_latency,
+                token_latency=args.token_latency,
+            ),
+            FakeEmbeddings(size=768, latency=args.embed_latency),
+        )
+
+        def on_ready():
+            services.ingestion_worker.embedder.rate_limiter = TokenBucket(
+                args.embed_rps
+            )
+
+        started = time.perf_counter()
+        server, thread, port = start_server(app_module.app)
+        try:
+            results = asyncio.run(run(args, port, books, started, on_ready))
+        finally:
+            server.should_exit = True
+            thread.join()
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    results["config"] = {
+        key: value
+        for key, value in vars(args).items()
+        if key not in ("json", "baseline", "max_regression")
+    }
+    results["summary"] = summary(results)
+    report(results)
+    if args.json:
+        with open(args.json, "w") as results_file:
+            json.dump(results, results_file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get("config") != results["config"]:
+            print("\nWarning: the baseline was run with a different configuration")
+        print(f"\n{'':<24}{'baseline':>12}{'current':>12}{'change':>9}")
+        regressions = compare(
+            results["summary"], baseline.get("summary", {}), args.max_regression
+        )
+        if regressions:
+            print(f"\n{len(regressions)} figures regressed by more than "
+                  f"{args.max_regression:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
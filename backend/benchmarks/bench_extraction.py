@@ -0,0 +1,112 @@
+"""
+PDF extraction and chunking: legacy whole-document path vs the streaming
+extractor (serial and with the per-page-range process pool).
+
+Each mode runs in a fresh process so peak RSS is measured independently.
+
+    cd backend && python -m benchmarks.bench_extraction --pages 1000
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+import fitz
+
+PARAGRAPH = (
+    "The rain had not stopped for three days, and the river was rising behind "
+    "the mill. Marta counted the sacks again, though she knew the number by "
+    "heart. Somewhere upstream a bell was ringing.\n"
+)
+
+
+def build_fixture(path: str, pages: int):
+    doc = fitz.open()
+    for page_number in range(pages):
+        page = doc.new_page()
+        if page_number % 25 == 0:
+            page.insert_text((72, 60), f"Chapter {page_number // 25 + 1}", fontsize=14)
+        page.insert_textbox(fitz.Rect(72, 80, 540, 780), PARAGRAPH * 12, fontsize=10)
+    doc.save(path)
+    doc.close()
+
+
+def legacy_extract(content: bytes, text_splitter) -> int:
+    from DocProcessing import DocProcessing
+
+    doc = fitz.open(stream=content, filetype="pdf")
+    file_str = ""
+    for page in doc:
+        file_str += page.get_text()
+    doc.close()
+    formatted = DocProcessing("fixture.pdf", content).text_formatter(file_str)
+    return len(text_splitter.split_text(formatted))
+
+
+def run_mode(mode: str, path: str, results):
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    from DocProcessing import DocProcessing
+
+    # Same settings as RAGChain.text_splitter, without importing the clients
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=1000,
+        chunk_overlap=200,
+        length_function=len,
+        separators=["\n\n", "\n", ".", "!", "?"],
+        keep_separator=True,
+    )
+    with open(path, "rb") as pdf_file:
+        content = pdf_file.read()
+
+    start = time.perf_counter()
+    if mode == "legacy":
+        chunks = legacy_extract(content, text_splitter)
+    else:
+        workers = 1 if mode == "streaming" else None
+        processor = DocProcessing("fixture.pdf", content)
+        chunks = sum(1 for _ in processor.iter_chunks(text_splitter, max_workers=workers))
+    elapsed = time.perf_counter() - start
+
+    results.put(
+        {
+            "mode": mode,
+            "seconds": elapsed,
+            "chunks": chunks,
+            # ru_maxrss is in KiB on Linux
+            "rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "children_rss_mib": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+            / 1024,
+        }
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pages", type=int, default=1000)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), f"fixture_{args.pages}.pdf")
+    build_fixture(path, args.pages)
+    print(f"Fixture: {args.pages} pages, {os.path.getsize(path) / 2**20:.1f} MiB")
+
+    context = multiprocessing.get_context("spawn")
+    print(f"{'mode':<20}{'seconds':>9}{'pages/s':>10}{'chunks':>8}{'peak RSS MiB':>14}{'pool RSS MiB':>14}")
+    for mode in ("legacy", "streaming", "streaming-parallel"):
+        results = context.Queue()
+        process = context.Process(target=run_mode, args=(mode, path, results))
+        process.start()
+        result = results.get()
+        process.join()
+        print(
+            f"{mode:<20}{result['seconds']:>9.2f}{args.pages / result['seconds']:>10.0f}"
+            f"{result['chunks']:>8}{result['rss_mib']:>14.1f}"
+            f"{result['children_rss_mib']:>14.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
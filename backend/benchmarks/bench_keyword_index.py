@@ -0,0 +1,111 @@
+"""
+KeywordIndex (BM25) lookup latency for growing libraries of synthetic books,
+by query kind: rare terms (names), mid-frequency terms, and queries mixing in
+very common words (skipped by the index).
+
+    cd backend && python -m benchmarks.bench_keyword_index --books 20 300
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.bench_ranking import build_vocabulary
+from benchmarks.fakes import percentile
+from KeywordIndex import KeywordIndex
+
+
+def build_index(path, books, chunks_per_book, vocabulary):
+    words, weights = vocabulary
+    index = KeywordIndex(path)
+    start = time.perf_counter()
+    for book in range(books):
+        texts = [
+            " ".join(random.choices(words, weights, k=170))
+            for _ in range(chunks_per_book)
+        ]
+        index.add_chunks(
+            f"book{book}",
+            [f"book{book}:{i}" for i in range(chunks_per_book)],
+            texts,
+            [
+                {"page_end": i // 2 + 1, "chapter_end": i // 40, "char_end": i * 1000}
+                for i in range(chunks_per_book)
+            ],
+        )
+    return index, time.perf_counter() - start
+
+
+def queries_by_kind(index, count=20):
+    def terms_between(low, high):
+        return [
+            term
+            for (term,) in index._conn.execute(
+                "SELECT term FROM terms WHERE doc_count BETWEEN ? AND ? LIMIT ?",
+                (low, high, count * 3),
+            )
+        ]
+
+    chunks = index.stats()["chunks"]
+    # Least frequent terms, whatever their count at this library size
+    rare = [
+        term
+        for (term,) in index._conn.execute(
+            "SELECT term FROM terms ORDER BY doc_count LIMIT ?", (count * 3,)
+        )
+    ]
+    mid = terms_between(chunks // 200, chunks // 50)
+    return {
+        "rare terms": [" ".join(rare[i : i + 3]) for i in range(0, len(rare) - 2, 3)],
+        "mid terms": [" ".join(mid[i : i + 3]) for i in range(0, len(mid) - 2, 3)],
+        "with common": [
+            f"who is {term} and where did the rain go" for term in rare[:count]
+        ],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--books", type=int, nargs="+", default=[20, 300])
+    parser.add_argument("--chunks-per-book", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    random.seed(0)
+    vocabulary = build_vocabulary(20000)
+    print(f"{'books':>6}{'chunks':>9}{'build s':>9}  {'query kind':<13}"
+          f"{'p50 ms':>8}{'p99 ms':>8}{'bounded p50':>13}")
+    for books in args.books:
+        with tempfile.TemporaryDirectory() as tmp:
+            index, build_seconds = build_index(
+                os.path.join(tmp, "keyword_index.db"),
+                books,
+                args.chunks_per_book,
+                vocabulary,
+            )
+            for kind, queries in queries_by_kind(index).items():
+                if not queries:
+                    # No terms in that frequency range at this size
+                    continue
+                timings = {None: [], "bounded": []}
+                for query in queries:
+                    for bound, read_up_to in (
+                        (None, None),
+                        ("bounded", [{"file_id": "book0", "page": 50}]),
+                    ):
+                        for _ in range(args.repeat):
+                            start = time.perf_counter()
+                            index.search(query, k=15, read_up_to=read_up_to)
+                            timings[bound].append(time.perf_counter() - start)
+                print(
+                    f"{books:>6}{index.stats()['chunks']:>9}{build_seconds:>9.1f}  "
+                    f"{kind:<13}{percentile(timings[None], 50) * 1000:>8.3f}"
+                    f"{percentile(timings[None], 99) * 1000:>8.3f}"
+                    f"{percentile(timings['bounded'], 50) * 1000:>13.3f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
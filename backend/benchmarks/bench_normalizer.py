@@ -0,0 +1,159 @@
+"""
+Text normalizer: golden-output check and throughput (MB/s) against the
+original five-pass regex formatter.
+
+The golden corpus (normalizer_golden.json) holds edge cases with the output
+of the original formatter; every case is checked whole and streamed in
+pieces. Then a synthetic book is normalized by each implementation.
+
+    cd backend && python -m benchmarks.bench_normalizer --mb 8
+    cd backend && python -m benchmarks.bench_normalizer --regenerate-golden
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import time
+
+from DocProcessing import text_normalizer
+
+GOLDEN_PATH = os.path.join(os.path.dirname(__file__), "normalizer_golden.json")
+
+GOLDEN_INPUTS = {
+    "empty": "",
+    "only_whitespace": " \r\n \n\n\n  ",
+    "crlf_and_cr": "First line\r\nsecond line\rThird line.\r\nfourth",
+    "wrapped_sentence": "The rain had not\nstopped for three\ndays.\nMarta counted",
+    "sentence_end_keeps_break": "It ended.\nthen it began!\nand again?\nyes",
+    "uppercase_keeps_break": "end of line\nNew line starts\nnew line continues",
+    "paragraphs": "Para one.\n\n\n\n\nPara two.\n\nPara three\n\nlowercase after break",
+    "spaces": "Too   many    spaces  \n  around   here",
+    "chapter_headings": "Intro text.\nChapter 1\nIt begins. Chapter 2 is next. CHAPTER 10 ends",
+    "section_headings": "See Section 3 and SECTION 4.\nSection two is not a heading",
+    "heading_at_start": "Chapter 1\nThe beginning",
+    "heading_after_leading_space": "  Chapter 1 The beginning",
+    "heading_with_wrapped_number": "Chapter\n7 starts here, Chapter  8 too, Chapter\n\n9 does not",
+    "heading_inside_word": "SubChapter 5 and preSection 6",
+    "unicode": "Capítulo 1\nÉl dijo «hola»\ny se fue. Ñandú\n\nFin",
+    "unicode_digits": "Chapter ٣ and Section ²",
+    "tabs_and_nbsp": "Tab\tseparated\t\nline and\xa0nbsp\n\xa0next",
+    "page_breaks": "last line of page one\n\x0cfirst line of page two\n",
+    "dialogue": "\"Who's there?\"\nshe asked.\n\"Nobody,\" he\nlied.",
+}
+
+
+def legacy_text_formatter(file_str: str) -> str:
+    """The original formatter (five regex passes), kept as the reference."""
+    formatted_text = file_str.replace("\r\n", "\n").replace("\r", "\n")
+    formatted_text = re.sub(r"\n{3,}", "\n\n", formatted_text)
+    formatted_text = re.sub(r"(?<![.!?])\n(?![A-Z\n])", " ", formatted_text)
+    formatted_text = re.sub(r" {2,}", " ", formatted_text)
+    formatted_text = re.sub(
+        r"(?<!^)(?=Chapter \d+|CHAPTER \d+|Section \d+|SECTION \d+)",
+        "\n\n",
+        formatted_text,
+    )
+    return formatted_text.strip()
+
+
+def regenerate_golden():
+    cases = [
+        {"name": name, "input": text, "expected": legacy_text_formatter(text)}
+        for name, text in GOLDEN_INPUTS.items()
+    ]
+    with open(GOLDEN_PATH, "w", encoding="utf-8") as golden_file:
+        json.dump(cases, golden_file, ensure_ascii=False, indent=2)
+        golden_file.write("\n")
+    print(f"Wrote {len(cases)} golden cases to {GOLDEN_PATH}")
+
+
+def check_golden() -> bool:
+    with open(GOLDEN_PATH, encoding="utf-8") as golden_file:
+        cases = json.load(golden_file)
+
+    failures = 0
+    for case in cases:
+        text, expected = case["input"], case["expected"]
+        outputs = {"whole": text_normalizer.normalize(text)}
+        # Streamed in pieces of every size, so each boundary position is hit
+        for size in range(1, len(text) + 1):
+            pieces = [text[i : i + size] for i in range(0, len(text), size)]
+            outputs[f"pieces of {size}"] = "".join(
+                text_normalizer.iter_normalize(pieces)
+            )
+        for mode, output in outputs.items():
+            if output != expected:
+                failures += 1
+                print(f"FAIL {case['name']} ({mode}): {output!r} != {expected!r}")
+                break
+    print(f"Golden corpus: {len(cases) - failures}/{len(cases)} cases match")
+    return failures == 0
+
+
+def synthetic_book(megabytes: float) -> list:
+    """Pages of wrapped prose with headings, blank lines and stray spaces."""
+    random.seed(0)
+    words = (
+        "the rain had not stopped for three days and river was rising behind "
+        "mill Marta counted sacks again though she knew number by heart"
+    ).split()
+    pages, size, chapter = [], 0, 1
+    while size < megabytes * 2**20:
+        lines = []
+        if len(pages) % 20 == 0:
+            lines.append(f"Chapter {chapter}\n")
+            chapter += 1
+        for _ in range(45):
+            line = " ".join(random.choice(words) for _ in range(12))
+            if random.random() < 0.3:
+                line += random.choice(".!?")
+            if random.random() < 0.1:
+                line += "  "
+            lines.append(line + ("\n\n\n" if random.random() < 0.05 else "\n"))
+        page = "".join(lines)
+        pages.append(page)
+        size += len(page)
+    return pages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--mb", type=float, default=8.0, help="Synthetic book size")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--regenerate-golden", action="store_true")
+    args = parser.parse_args()
+
+    if args.regenerate_golden:
+        regenerate_golden()
+        return
+
+    if not check_golden():
+        raise SystemExit(1)
+
+    pages = synthetic_book(args.mb)
+    text = "".join(pages)
+    megabytes = len(text.encode("utf-8")) / 2**20
+    expected = legacy_text_formatter(text)
+
+    implementations = {
+        "legacy (5 passes)": lambda: legacy_text_formatter(text),
+        "normalize": lambda: text_normalizer.normalize(text),
+        "iter_normalize (pages)": lambda: "".join(
+            text_normalizer.iter_normalize(pages)
+        ),
+    }
+    print(f"Synthetic book: {megabytes:.1f} MB, {len(pages)} pages")
+    for name, run in implementations.items():
+        best = float("inf")
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            output = run()
+            best = min(best, time.perf_counter() - start)
+        assert output == expected, f"{name} output differs from the legacy formatter"
+        print(f"{name:<24}{megabytes / best:>8.1f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Cost of RAGChain.rank_documents per query, for growing candidate counts: the
+old per-document Python loop (substring keyword matches) vs the vectorized
+scoring (whole-word keyword matches, found in the chunk text at query time).
+
+    cd backend && python -m benchmarks.bench_ranking --candidates 15 100 500
+"""
+
+import argparse
+import contextlib
+import io
+import random
+import time
+
+from langchain_core.documents import Document
+
+from benchmarks.fakes import FakeChatModel, percentile
+import RAGChain as rag_module
+
+STORY_WORDS = (
+    "the rain had not stopped for three days and river was rising behind mill "
+    "Marta counted sacks again though she knew number by heart miller daughter "
+    "village bridge storm night lantern door window letter brother"
+).split()
+
+
+def legacy_rank_documents(docs_with_scores, query: str, max_docs: int = 5):
+    """The previous implementation (scoring part), kept as the reference."""
+    query_keywords = set(query.lower().split())
+    ranked_docs = []
+    for doc, score in docs_with_scores:
+        similarity_score = 1.0 / (1.0 + score) if score > 0 else 1.0
+        doc_text = doc.page_content.lower()
+        keyword_matches = sum(1 for keyword in query_keywords if keyword in doc_text)
+        keyword_score = keyword_matches / len(query_keywords) if query_keywords else 0
+        doc_length = len(doc.page_content)
+        if doc_length < 100:
+            length_score = 0.3
+        elif 800 <= doc_length <= 1200:
+            length_score = 1.0
+        elif doc_length > 2000:
+            length_score = 0.7
+        else:
+            length_score = 0.8
+        final_score = 0.6 * similarity_score + 0.3 * keyword_score + 0.1 * length_score
+        ranked_docs.append((doc, final_score))
+    ranked_docs.sort(key=lambda x: x[1], reverse=True)
+    for i, (doc, final_score) in enumerate(ranked_docs[:max_docs]):
+        print(f"  Rank {i + 1}: Score={final_score:.3f} {doc.page_content[:100]}...")
+    return [doc for doc, _ in ranked_docs[:max_docs]]
+
+
+def build_vocabulary(size: int = 5000):
+    """Story words plus filler words, Zipf-like weights (common words first)."""
+    fillers = [
+        "".join(random.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(n))
+        for n in (random.randint(3, 10) for _ in range(size))
+    ]
+    words = STORY_WORDS + fillers
+    return words, [1.0 / rank for rank in range(1, len(words) + 1)]
+
+
+def build_candidates(count: int, vocabulary):
+    words, weights = vocabulary
+    candidates = []
+    for _ in range(count):
+        # 20 to 220 words: from too short to ~1000-1200 chars
+        length = random.randint(20, 220)
+        text = " ".join(random.choices(words, weights, k=length))
+        candidates.append((Document(page_content=text), random.uniform(0.2, 1.5)))
+    return candidates
+
+
+def time_ranking(rank, candidates, query, repeat):
+    timings = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            top = rank(candidates, query)
+            timings.append(time.perf_counter() - start)
+    return timings, top
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--candidates", type=int, nargs="+", default=[15, 100, 500])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    random.seed(0)
+    vocabulary = build_vocabulary()
+    chain = rag_module.RAGChain(FakeChatModel(), None, rag_module.custom_rag_prompt)
+    query = "why did marta count the sacks before the storm"
+
+    print(f"{'candidates':>10}{'legacy p50 ms':>15}{'vector p50 ms':>15}{'same top 5':>12}")
+    for count in args.candidates:
+        candidates = build_candidates(count, vocabulary)
+        legacy, legacy_top = time_ranking(
+            legacy_rank_documents, candidates, query, args.repeat
+        )
+        vectorized, top = time_ranking(
+            chain.rank_documents, candidates, query, args.repeat
+        )
+        print(
+            f"{count:>10}{percentile(legacy, 50) * 1000:>15.3f}"
+            f"{percentile(vectorized, 50) * 1000:>15.3f}"
+            f"{str(top == legacy_top):>12}"
+        )
+
+
+if __name__ == "__main__":
+    main()
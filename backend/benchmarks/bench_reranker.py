@@ -0,0 +1,78 @@
+"""
+Ranking cost per query against the number of candidates (initial_k): the
+heuristic RAGChain.rank_documents vs a local ONNX cross-encoder, and how
+often the cross-encoder falls back to the heuristic within its budget.
+
+    cd backend && python -m benchmarks.bench_reranker --model-dir /models/minilm-l6
+    cd backend && python -m benchmarks.bench_reranker  # heuristic only
+"""
+
+import argparse
+import contextlib
+import io
+import random
+import time
+
+from benchmarks.bench_ranking import build_candidates, build_vocabulary
+from benchmarks.fakes import FakeChatModel, percentile
+from Reranker import OnnxCrossEncoder
+import RAGChain as rag_module
+
+
+def time_calls(call, repeat):
+    timings = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            call()
+            timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--k", type=int, nargs="+", default=[5, 10, 15, 30, 50])
+    parser.add_argument("--model-dir", default=None)
+    parser.add_argument("--model-file", default="model.onnx")
+    parser.add_argument("--budget-ms", type=float, default=250.0)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    random.seed(0)
+    vocabulary = build_vocabulary()
+    chain = rag_module.RAGChain(FakeChatModel(), None, rag_module.custom_rag_prompt)
+    reranker = (
+        OnnxCrossEncoder(
+            args.model_dir, model_file=args.model_file, budget_ms=args.budget_ms
+        )
+        if args.model_dir
+        else None
+    )
+    query = "why did marta count the sacks before the storm"
+
+    header = f"{'k':>5}{'heuristic p50 ms':>18}"
+    if reranker is not None:
+        header += f"{'model p50 ms':>14}{'model p99 ms':>14}{'within budget':>15}"
+    print(header)
+    for k in args.k:
+        candidates = build_candidates(k, vocabulary)
+        docs = [doc for doc, _ in candidates]
+        heuristic = time_calls(
+            lambda: chain.rank_documents(candidates, query), args.repeat
+        )
+        row = f"{k:>5}{percentile(heuristic, 50) * 1000:>18.3f}"
+        if reranker is not None:
+            texts = [doc.page_content for doc in docs]
+            reranker.score(query, texts)  # Warm up
+            model = time_calls(lambda: reranker.score(query, texts), args.repeat)
+            within = sum(t * 1000 <= args.budget_ms for t in model) / len(model)
+            row += (
+                f"{percentile(model, 50) * 1000:>14.3f}"
+                f"{percentile(model, 99) * 1000:>14.3f}"
+                f"{within:>15.0%}"
+            )
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
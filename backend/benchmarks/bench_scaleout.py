@@ -0,0 +1,170 @@
+"""
+Scale-out on one machine: the API served by one process with embedded stores
+vs by N uvicorn workers sharing a Chroma server and the store server
+(StoreServer.py), all started here on a temporary DATA_DIR with the fakes of
+benchmarks.fakes (benchmarks.fake_app).
+
+Each deployment ingests a synthetic book, then serves concurrent chat
+sessions over /ws/stream and /rag (see bench_e2e). The shared deployment is
+also checked for consistency: every worker lists the book, and the sessions
+of all workers are in the one session store.
+
+    cd backend && python -m benchmarks.bench_scaleout --workers 4 --sessions 32
+"""
+
+import argparse
+import asyncio
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.bench_e2e import build_book, chat, ingest, wait_ready
+
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def wait_port(port: int, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with socket.socket() as probe:
+            if probe.connect_ex(("127.0.0.1", port)) == 0:
+                return
+        time.sleep(0.1)
+    raise RuntimeError(f"Nothing listening on port {port}")
+
+
+def spawn(command, env) -> subprocess.Popen:
+    return subprocess.Popen(
+        command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+async def check_shared(client, file_id: str, sessions: int):
+    # Requests are spread over the workers by the kernel
+    listings = await asyncio.gather(
+        *(client.get("/get_uploaded_files") for _ in range(20))
+    )
+    listed = all(
+        any(f["id"] == file_id for f in listing.json()["files"])
+        for listing in listings
+    )
+    session_stats = (await client.get("/debug/stats")).json()["sessions"]
+    stored = session_stats["sessions"] if session_stats else 0
+    return listed, stored == sessions
+
+
+async def run_deployment(port: int, book: str, pages: int, args, started: float):
+    import httpx
+
+    async with httpx.AsyncClient(
+        base_url=f"http://127.0.0.1:{port}", timeout=600
+    ) as client:
+        ready = await wait_ready(client, started)
+        ingestion = await ingest(client, book, pages)
+        results = await chat(client, port, args.sessions, args.turns)
+        results["ready_s"] = ready
+        results["ingest_s"] = ingestion["seconds"]
+        results["listed"], results["sessions_shared"] = await check_shared(
+            client, ingestion["file_id"], results["sessions"]
+        )
+    return results
+
+
+def deploy(name: str, workers: int, base_env: dict, book: str, args) -> dict:
+    data_dir = tempfile.mkdtemp(prefix="coreader-scaleout-")
+    env = dict(base_env, DATA_DIR=data_dir)
+    processes = []
+    try:
+        if name == "shared":
+            chroma_port, store_port = free_port(), free_port()
+            env.update(
+                CHROMA_HOST="127.0.0.1",
+                CHROMA_PORT=str(chroma_port),
+                STORE_ADDRESS=f"127.0.0.1:{store_port}",
+                STORE_AUTHKEY="benchmark",
+            )
+            processes.append(
+                spawn(
+                    [
+                        "chroma",
+                        "run",
+                        "--path",
+                        os.path.join(data_dir, "chroma_db"),
+                        "--port",
+                        str(chroma_port),
+                    ],
+                    env,
+                )
+            )
+            wait_port(chroma_port)
+            processes.append(spawn([sys.executable, "StoreServer.py"], env))
+            wait_port(store_port)
+
+        port = free_port()
+        started = time.perf_counter()
+        processes.append(
+            spawn(
+                [
+                    sys.executable,
+                    "-m",
+                    "uvicorn",
+                    "benchmarks.fake_app:app",
+                    "--port",
+                    str(port),
+                    "--workers",
+                    str(workers),
+                ],
+                env,
+            )
+        )
+        wait_port(port)
+        return asyncio.run(run_deployment(port, book, args.pages, args, started))
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            process.wait()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--sessions", type=int, default=32)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--pages", type=int, default=100)
+    args = parser.parse_args()
+
+    base_env = dict(os.environ, LOG_LEVEL="WARNING", WARM_UP="1")
+    book_dir = tempfile.mkdtemp(prefix="coreader-book-")
+    book = os.path.join(book_dir, "book.pdf")
+    build_book(book, args.pages, seed=args.pages)
+
+    print(
+        f"{'deployment':<14}{'ready s':>8}{'ingest s':>9}{'turns/s':>9}"
+        f"{'ttft p95':>10}{'rag p95':>9}{'listed':>8}{'sessions':>10}"
+    )
+    try:
+        for name, workers in (("single", 1), ("shared", args.workers)):
+            results = deploy(name, workers, base_env, book, args)
+            print(
+                f"{f'{name} x{workers}':<14}{results['ready_s']:>8.2f}"
+                f"{results['ingest_s']:>9.2f}{results['turns_per_s']:>9.1f}"
+                f"{results['ws_ttft']['p95_ms']:>10.0f}"
+                f"{results['rag']['p95_ms']:>9.0f}"
+                f"{'ok' if results['listed'] else 'MISSING':>8}"
+                f"{'shared' if results['sessions_shared'] else 'split':>10}"
+            )
+    finally:
+        shutil.rmtree(book_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
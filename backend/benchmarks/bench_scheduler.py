@@ -0,0 +1,212 @@
+"""
+Admission control under a /rag flood: chat readers on /ws/stream while one
+client hammers /rag, with the generation scheduler effectively off
+(unbounded) and on (--concurrency slots).
+
+The fake model stands for a provider with a quota: at most --capacity calls
+(rewrites and answers) run at once, the rest wait their turn upstream. The
+app is served in this process on a temporary DATA_DIR (see bench_e2e).
+
+    cd backend && python -m benchmarks.bench_scheduler --flood 32 --sessions 8
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from typing import Optional
+
+from pydantic import PrivateAttr
+
+from benchmarks.bench_e2e import (
+    build_book,
+    ingest,
+    latency_stats,
+    session_queries,
+    start_server,
+    wait_ready,
+)
+from benchmarks.fakes import FakeChatModel, FakeEmbeddings, install_fakes
+
+
+class QuotaChatModel(FakeChatModel):
+    """Fake chat model of a provider serving at most `capacity` calls at once."""
+
+    capacity: int = 4
+    _semaphore: Optional[asyncio.Semaphore] = PrivateAttr(default=None)
+
+    def _quota(self) -> asyncio.Semaphore:
+        # Created on first use, on the server's event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.capacity)
+        return self._semaphore
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        async with self._quota():
+            return await super()._agenerate(messages, stop, run_manager, **kwargs)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        async with self._quota():
+            async for chunk in super()._astream(messages, stop, run_manager, **kwargs):
+                yield chunk
+
+
+async def reader(port: int, queries, ttft, totals, errors):
+    from websockets.asyncio.client import connect
+
+    from StreamProtocol import SUBPROTOCOL
+
+    async with connect(
+        f"ws://127.0.0.1:{port}/ws/stream?session_id=ws-{uuid.uuid4()}",
+        subprotocols=[SUBPROTOCOL],
+    ) as websocket:
+        await websocket.recv()  # hello
+        for query in queries:
+            start = time.perf_counter()
+            await websocket.send(json.dumps({"type": "query", "query": query}))
+            first = True
+            while True:
+                frame = json.loads(await websocket.recv())
+                if frame["type"] == "token" and first:
+                    ttft.append(time.perf_counter() - start)
+                    first = False
+                if frame["type"] == "error":
+                    errors.append(frame["code"])
+                    break
+                if frame["type"] == "end":
+                    totals.append(time.perf_counter() - start)
+                    break
+
+
+async def flooder(client, queries, stop: asyncio.Event, results: dict):
+    for query in queries:
+        if stop.is_set():
+            return
+        start = time.perf_counter()
+        response = await client.post("/rag", json={"query": query})
+        if response.status_code == 503:
+            results["rejected"] += 1
+            retry_after = float(response.headers.get("Retry-After", "1"))
+            await asyncio.sleep(min(retry_after, 1.0))
+            continue
+        response.raise_for_status()
+        results["latencies"].append(time.perf_counter() - start)
+
+
+async def run_mode(client, port: int, offset: int, args) -> dict:
+    ttft, totals, errors = [], [], []
+    flood = {"rejected": 0, "latencies": []}
+    stop = asyncio.Event()
+    flooders = [
+        asyncio.create_task(
+            flooder(client, session_queries(offset + number, 1000), stop, flood)
+        )
+        for number in range(args.flood)
+    ]
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(
+            reader(
+                port,
+                session_queries(offset + args.flood + number, args.turns),
+                ttft,
+                totals,
+                errors,
+            )
+            for number in range(args.sessions)
+        )
+    )
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await asyncio.gather(*flooders)
+    return {
+        "ws_ttft": latency_stats(ttft),
+        "ws_total": latency_stats(totals),
+        "ws_errors": len(errors),
+        "rag": latency_stats(flood["latencies"]),
+        "rag_per_s": len(flood["latencies"]) / elapsed,
+        "rag_rejected": flood["rejected"],
+    }
+
+
+async def run(args, port: int, book: str, started: float) -> dict:
+    import httpx
+
+    from GenerationScheduler import GenerationScheduler
+    from RAGChain import services
+
+    results = {}
+    async with httpx.AsyncClient(
+        base_url=f"http://127.0.0.1:{port}", timeout=600
+    ) as client:
+        await wait_ready(client, started)
+        await ingest(client, book, args.pages)
+        for offset, (mode, slots) in enumerate(
+            (("off", 1_000_000), ("on", args.concurrency))
+        ):
+            services.override(
+                "generation_scheduler", GenerationScheduler(max_concurrent=slots)
+            )
+            results[mode] = await run_mode(client, port, offset * 10_000, args)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sessions", type=int, default=8, help="Chat readers")
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--flood", type=int, default=32, help="Parallel /rag calls")
+    parser.add_argument(
+        "--capacity", type=int, default=4, help="Calls the provider runs at once"
+    )
+    parser.add_argument("--concurrency", type=int, default=4, help="Scheduler slots")
+    parser.add_argument("--pages", type=int, default=20)
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix="coreader-scheduler-")
+    os.environ["DATA_DIR"] = data_dir
+    os.environ.setdefault("EMBEDDING_BACKEND", "google")  # Replaced by the fake
+    os.environ.setdefault("LOG_LEVEL", "ERROR")
+    try:
+        book = os.path.join(data_dir, "book.pdf")
+        build_book(book, args.pages, seed=args.pages)
+
+        import main as app_module
+        from RAGChain import services
+
+        install_fakes(
+            services,
+            QuotaChatModel(
+                capacity=args.capacity, first_token_latency=0.2, token_latency=0.005
+            ),
+            FakeEmbeddings(size=768),
+        )
+        started = time.perf_counter()
+        server, thread, port = start_server(app_module.app)
+        try:
+            results = asyncio.run(run(args, port, book, started))
+        finally:
+            server.should_exit = True
+            thread.join()
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    print(
+        f"{'scheduler':<10}{'ttft p50':>9}{'ttft p95':>9}{'ws p95':>8}{'ws err':>7}"
+        f"{'rag/s':>7}{'rag p95':>9}{'503s':>6}"
+    )
+    for mode, row in results.items():
+        print(
+            f"{mode:<10}{row['ws_ttft']['p50_ms']:>9.0f}"
+            f"{row['ws_ttft']['p95_ms']:>9.0f}{row['ws_total']['p95_ms']:>8.0f}"
+            f"{row['ws_errors']:>7}{row['rag_per_s']:>7.1f}"
+            f"{row['rag']['p95_ms'] or 0:>9.0f}{row['rag_rejected']:>6}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Cold start of the API: time to import main.py, to the first answer of
+/healthz (serving) and to /readyz (services warmed up), each in a fresh
+uvicorn process, with and without the startup warm-up.
+
+Runs offline: the Gemini clients are only built, never called. The stores
+start empty, or as a copy of --data-dir (left untouched).
+
+    cd backend && python -m benchmarks.bench_startup --runs 5
+    cd backend && python -m benchmarks.bench_startup --data-dir .
+"""
+
+import argparse
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+import benchmarks.fakes  # noqa: F401 (sets a placeholder GOOGLE_API_KEY)
+
+STORE_FILES = ("chroma_db", "file_registry.db", "keyword_index.db", "embedding_cache.db")
+
+
+def copy_stores(source: str, target: str):
+    for name in STORE_FILES:
+        path = os.path.join(source, name)
+        if os.path.isdir(path):
+            shutil.copytree(path, os.path.join(target, name))
+        elif os.path.exists(path):
+            shutil.copy(path, target)
+
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def status_of(url: str):
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return None
+
+
+def time_import(env: dict) -> float:
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "-c", "import main"],
+        env=env,
+        check=True,
+        stderr=subprocess.DEVNULL,
+    )
+    return time.perf_counter() - start
+
+
+def time_server(env: dict, timeout: float = 120.0):
+    """Seconds from spawning uvicorn to /healthz and to /readyz answering 200."""
+    port = free_port()
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port)],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    live = ready = None
+    try:
+        while time.perf_counter() - start < timeout and ready is None:
+            if process.poll() is not None:
+                raise RuntimeError("The server exited during startup")
+            if live is None and status_of(f"http://127.0.0.1:{port}/healthz") == 200:
+                live = time.perf_counter() - start
+            if live is not None and status_of(f"http://127.0.0.1:{port}/readyz") == 200:
+                ready = time.perf_counter() - start
+            time.sleep(0.02)
+    finally:
+        process.terminate()
+        process.wait()
+    return live, ready
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--data-dir", help="Stores to start from (copied)")
+    args = parser.parse_args()
+
+    print(f"{'warm-up':>8}{'import s':>10}{'healthz s':>11}{'readyz s':>10}")
+    for warm_up in ("1", "0"):
+        imports, lives, readies = [], [], []
+        for _ in range(args.runs):
+            data_dir = tempfile.mkdtemp(prefix="coreader-startup-")
+            try:
+                if args.data_dir:
+                    copy_stores(args.data_dir, data_dir)
+                env = dict(
+                    os.environ, DATA_DIR=data_dir, WARM_UP=warm_up, LOG_LEVEL="WARNING"
+                )
+                imports.append(time_import(env))
+                live, ready = time_server(env)
+                lives.append(live)
+                readies.append(ready)
+            finally:
+                shutil.rmtree(data_dir, ignore_errors=True)
+        print(
+            f"{'on' if warm_up == '1' else 'off':>8}"
+            f"{statistics.median(imports):>10.2f}{statistics.median(lives):>11.2f}"
+            f"{statistics.median(readies):>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""
+/ws/stream protocols compared: the text protocol (v1, one frame per model
+token plus <<CITATIONS>> and <<END>> markers) vs the framed protocol (v2,
+StreamProtocol: JSON frames, tokens batched per time window).
+
+The API is served by a uvicorn process of its own (benchmarks.fake_app) on a
+temporary DATA_DIR, so its CPU time (from /proc, Linux) isn't mixed with the
+clients'. After a small book is ingested, concurrent sessions ask questions
+with each protocol in turn, for --rounds rounds. Reported per answer: frames,
+bytes and server CPU milliseconds, plus time to first token and to the end of
+the answer.
+
+    cd backend && python -m benchmarks.bench_streaming --sessions 32 --turns 3
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.bench_e2e import (
+    build_book,
+    ingest,
+    latency_stats,
+    session_queries,
+    wait_ready,
+)
+from benchmarks.bench_scaleout import free_port, wait_port
+from StreamProtocol import SUBPROTOCOL
+
+
+def cpu_seconds(pid: int) -> float:
+    """User and system CPU time of a process."""
+    with open(f"/proc/{pid}/stat") as stat_file:
+        fields = stat_file.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+async def text_answer(websocket, query: str, counts: dict):
+    await websocket.send(json.dumps({"query": query}))
+    while True:
+        message = await websocket.recv()
+        counts["frames"] += 1
+        counts["bytes"] += len(message.encode())
+        if message == "<<END>>":
+            return
+        if message.startswith("<<E:"):
+            raise RuntimeError(f"Chat error {message}")
+        if counts["first"] is None and not message.startswith("<<CITATIONS>>"):
+            counts["first"] = time.perf_counter()
+
+
+async def framed_answer(websocket, query: str, counts: dict):
+    await websocket.send(json.dumps({"type": "query", "query": query}))
+    while True:
+        message = await websocket.recv()
+        counts["frames"] += 1
+        counts["bytes"] += len(message.encode())
+        frame = json.loads(message)
+        if frame["type"] == "end":
+            return
+        if frame["type"] == "error":
+            raise RuntimeError(f"Chat error {frame}")
+        if counts["first"] is None and frame["type"] == "token":
+            counts["first"] = time.perf_counter()
+
+
+async def session(port: int, protocol: int, queries, answers: list):
+    from websockets.asyncio.client import connect
+
+    framed = protocol == 2
+    async with connect(
+        f"ws://127.0.0.1:{port}/ws/stream",
+        max_size=None,
+        subprotocols=[SUBPROTOCOL] if framed else None,
+    ) as websocket:
+        if framed:
+            await websocket.recv()  # hello
+        for query in queries:
+            counts = {"frames": 0, "bytes": 0, "first": None}
+            start = time.perf_counter()
+            await (framed_answer if framed else text_answer)(
+                websocket, query, counts
+            )
+            counts["ttft"] = counts["first"] - start
+            counts["total"] = time.perf_counter() - start
+            answers.append(counts)
+
+
+async def run_protocol(port: int, pid: int, protocol: int, offset: int, args):
+    answers = []
+    cpu_before = cpu_seconds(pid)
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(
+            session(
+                port, protocol, session_queries(offset + number, args.turns), answers
+            )
+            for number in range(args.sessions)
+        )
+    )
+    return answers, cpu_seconds(pid) - cpu_before, time.perf_counter() - start
+
+
+def protocol_stats(answers, cpu: float, elapsed: float) -> dict:
+    count = len(answers)
+    return {
+        "answers": count,
+        "frames_per_answer": sum(a["frames"] for a in answers) / count,
+        "bytes_per_answer": sum(a["bytes"] for a in answers) / count,
+        "server_cpu_ms_per_answer": cpu * 1000 / count,
+        "answers_per_s": count / elapsed,
+        "ttft": latency_stats([a["ttft"] for a in answers]),
+        "total": latency_stats([a["total"] for a in answers]),
+    }
+
+
+async def run(port: int, pid: int, book: str, args, started: float):
+    import httpx
+
+    async with httpx.AsyncClient(
+        base_url=f"http://127.0.0.1:{port}", timeout=600
+    ) as client:
+        await wait_ready(client, started)
+        await ingest(client, book, args.pages)
+    totals = {protocol: ([], 0.0, 0.0) for protocol in (1, 2)}
+    offset = 0
+    # The server slows down a little as sessions pile up, so the protocols
+    # take turns going first; distinct queries keep the answer cache out
+    for round_number in range(args.rounds):
+        for protocol in (1, 2) if round_number % 2 == 0 else (2, 1):
+            answers, cpu, elapsed = await run_protocol(
+                port, pid, protocol, offset, args
+            )
+            offset += args.sessions
+            all_answers, all_cpu, all_elapsed = totals[protocol]
+            totals[protocol] = (
+                all_answers + answers,
+                all_cpu + cpu,
+                all_elapsed + elapsed,
+            )
+    return {protocol: protocol_stats(*total) for protocol, total in totals.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sessions", type=int, default=32)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--rounds", type=int, default=2)
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--first-token-latency", type=float, default=0.2)
+    parser.add_argument(
+        "--token-latency", type=float, default=0.005, help="Seconds between tokens"
+    )
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix="coreader-streaming-")
+    book = os.path.join(data_dir, "book.pdf")
+    build_book(book, args.pages, seed=args.pages)
+    env = dict(
+        os.environ,
+        DATA_DIR=data_dir,
+        LOG_LEVEL="WARNING",
+        FAKE_FIRST_TOKEN_LATENCY=str(args.first_token_latency),
+        FAKE_TOKEN_LATENCY=str(args.token_latency),
+        FAKE_EMBED_LATENCY="0",
+    )
+    port = free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "benchmarks.fake_app:app",
+            "--port",
+            str(port),
+        ],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_port(port)
+        results = asyncio.run(run(port, server.pid, book, args, started))
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    print(
+        f"{'protocol':<10}{'frames':>8}{'bytes':>8}{'cpu ms':>8}{'answers/s':>11}"
+        f"{'ttft p50':>10}{'ttft p95':>10}{'total p95':>11}"
+    )
+    for protocol, row in results.items():
+        print(
+            f"{f'v{protocol}':<10}{row['frames_per_answer']:>8.1f}"
+            f"{row['bytes_per_answer']:>8.0f}"
+            f"{row['server_cpu_ms_per_answer']:>8.2f}{row['answers_per_s']:>11.1f}"
+            f"{row['ttft']['p50_ms']:>10.0f}{row['ttft']['p95_ms']:>10.0f}"
+            f"{row['total']['p95_ms']:>11.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
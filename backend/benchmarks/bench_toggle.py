@@ -0,0 +1,94 @@
+"""
+Cost of toggling a file's active status: old delete-and-re-embed vs the
+in-place metadata update behind /toggle_file_status.
+
+    cd backend && python -m benchmarks.bench_toggle --chunks 100 1000 3000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from fastapi.testclient import TestClient
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+
+from benchmarks.fakes import FakeEmbeddings
+from FileRegistry import FileRegistry
+import main
+
+
+def legacy_toggle(store, file_id, is_active):
+    """The previous implementation: load everything, delete, re-add."""
+    collection = store.get()
+    ids, documents = [], []
+    for i, metadata in enumerate(collection["metadatas"]):
+        if metadata and metadata.get("file_id") == file_id:
+            ids.append(collection["ids"][i])
+            documents.append(
+                Document(
+                    page_content=collection["documents"][i],
+                    metadata={**metadata, "is_active": is_active},
+                )
+            )
+    store.delete(ids=ids)
+    store.add_documents(documents, ids=ids)
+
+
+def build_store(chunks, embed_latency):
+    embeddings = FakeEmbeddings(size=768, latency=embed_latency)
+    store = Chroma(collection_name=f"bench_toggle_{chunks}", embedding_function=embeddings)
+    ids = store.add_texts(
+        [f"Chunk {i} of a long book. " * 40 for i in range(chunks)],
+        metadatas=[{"file_id": "book", "filename": "book.pdf", "is_active": True}]
+        * chunks,
+    )
+    return store, embeddings, ids
+
+
+def run_benchmark():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--chunks", type=int, nargs="+", default=[100, 1000, 3000])
+    parser.add_argument(
+        "--embed-latency",
+        type=float,
+        default=0.0,
+        help="Simulated seconds per embedding request",
+    )
+    args = parser.parse_args()
+
+    client = TestClient(main.app)
+    registry_dir = tempfile.mkdtemp()
+    print(f"{'chunks':>7}{'legacy s':>10}{'legacy embeds':>15}{'update s':>10}{'update embeds':>15}")
+    for chunks in args.chunks:
+        store, embeddings, ids = build_store(chunks, args.embed_latency)
+        main.vector_store = store
+        main.file_registry = FileRegistry(
+            os.path.join(registry_dir, f"registry_{chunks}.db")
+        )
+        main.file_registry.add_file("book", "book.pdf", ids)
+
+        embeddings.texts_embedded = 0
+        start = time.perf_counter()
+        legacy_toggle(store, "book", False)
+        legacy_time = time.perf_counter() - start
+        legacy_embeds = embeddings.texts_embedded
+
+        embeddings.texts_embedded = 0
+        start = time.perf_counter()
+        response = client.post(
+            "/toggle_file_status", json={"file_id": "book", "is_active": True}
+        )
+        update_time = time.perf_counter() - start
+        assert response.status_code == 200, response.text
+        assert all(m["is_active"] for m in store.get(include=["metadatas"])["metadatas"])
+
+        print(
+            f"{chunks:>7}{legacy_time:>10.3f}{legacy_embeds:>15}"
+            f"{update_time:>10.3f}{embeddings.texts_embedded:>15}"
+        )
+
+
+if __name__ == "__main__":
+    run_benchmark()
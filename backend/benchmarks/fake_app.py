@@ -0,0 +1,24 @@
+"""
+The API (main.app) with the fakes of benchmarks.fakes instead of the Gemini
+clients, for benchmarks that serve it from separate uvicorn processes:
+
+    uvicorn benchmarks.fake_app:app --workers 4
+
+FAKE_FIRST_TOKEN_LATENCY, FAKE_TOKEN_LATENCY and FAKE_EMBED_LATENCY
+(seconds) set the latencies of the fakes.
+"""
+
+import os
+
+from benchmarks.fakes import FakeChatModel, FakeEmbeddings, install_fakes
+from main import app  # noqa: F401
+from RAGChain import services
+
+install_fakes(
+    services,
+    FakeChatModel(
+        first_token_latency=float(os.getenv("FAKE_FIRST_TOKEN_LATENCY", "0.2")),
+        token_latency=float(os.getenv("FAKE_TOKEN_LATENCY", "0.005")),
+    ),
+    FakeEmbeddings(size=768, latency=float(os.getenv("FAKE_EMBED_LATENCY", "0.05"))),
+)
@@ -0,0 +1,109 @@
+"""
+Deterministic local stand-ins for the Gemini chat model and embeddings, so the
+pipeline can be benchmarked without network calls.
+"""
+
+import asyncio
+import math
+import os
+import re
+import time
+from typing import Any, List, Optional
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# The Google clients only check that a key is set when they are built
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark-fake-key")
+
+DEFAULT_ANSWER = (
+    "The narrator arrives at the old house on a rainy evening and meets the "
+    "caretaker, who warns him about the locked room on the second floor. "
+) * 4
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model that returns a fixed answer after a configurable delay."""
+
+    answer: str = DEFAULT_ANSWER
+    first_token_latency: float = 0.2  # Seconds before the first token
+    token_latency: float = 0.005  # Seconds between tokens
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _tokens(self) -> List[str]:
+        return re.findall(r"\S+\s*", self.answer)
+
+    def _total_latency(self) -> float:
+        return self.first_token_latency + self.token_latency * len(self._tokens())
+
+    def _result(self) -> ChatResult:
+        return ChatResult(
+            generations=[ChatGeneration(message=AIMessage(content=self.answer))]
+        )
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs: Any):
+        time.sleep(self._total_latency())
+        return self._result()
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs: Any):
+        await asyncio.sleep(self._total_latency())
+        return self._result()
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs: Any):
+        time.sleep(self.first_token_latency)
+        for token in self._tokens():
+            time.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs: Any):
+        await asyncio.sleep(self.first_token_latency)
+        for token in self._tokens():
+            await asyncio.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+
+class FakeEmbeddings(DeterministicFakeEmbedding):
+    """Deterministic embeddings (same text, same vector) with call counters."""
+
+    latency: float = 0.0  # Seconds per embed call
+    calls: int = 0
+    texts_embedded: int = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        self.texts_embedded += len(texts)
+        if self.latency:
+            time.sleep(self.latency)
+        return super().embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        self.calls += 1
+        self.texts_embedded += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return super().embed_query(text)
+
+
+def install_fakes(services, llm, embeddings):
+    """
+    Have the app services (RAGChain.services) use fakes instead of the Gemini
+    clients. Call it before they are built: the embeddings go behind the
+    embedding cache, so the vector store, the answer cache and ingestion all
+    use them.
+    """
+    services.override("llm", llm)
+    services.override("embedding_backend", (embeddings, "fake/deterministic"))
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile, pct in [0, 100]."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
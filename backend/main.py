@@ -1,22 +1,149 @@
-from fastapi import FastAPI, HTTPException, status, WebSocket, File, UploadFile
-from fastapi.responses import RedirectResponse
+from fastapi import (
+    FastAPI,
+    HTTPException,
+    status,
+    WebSocket,
+    WebSocketDisconnect,
+    File,
+    UploadFile,
+    Request,
+)
+from fastapi.responses import JSONResponse, PlainTextResponse, RedirectResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from RAGChain import vector_store, text_splitter, rag_chain
+from pydantic import BaseModel, ValidationError
+from RAGChain import DATA_DIR, open_store, services, text_splitter
+from BatchEmbedder import BatchEmbedder
+from EmbeddingBackends import embedding_backend
+from IngestionJobs import IngestionWorker, FINISHED_STATUSES
+from GenerationScheduler import BATCH, INTERACTIVE, GenerationScheduler, SchedulerBusy
+from LogRateLimit import RateLimitFilter
+from StoreServer import chroma_batches
+from StreamProtocol import PROTOCOL_VERSION, SUBPROTOCOL, FrameSender, TextSender
+from Metrics import (
+    metrics,
+    ws_answers_cancelled_total,
+    sessions_gauge,
+    answer_cache_entries_gauge,
+    answer_cache_hit_ratio_gauge,
+    keyword_index_chunks_gauge,
+)
+from contextlib import aclosing, asynccontextmanager
 import logging
 import asyncio
+import json
+import os
 import uuid
+from typing import List, Optional
 from DocProcessing import DocProcessing
-from langchain_core.documents import Document
 
 
 logging.basicConfig(
-    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s - %(levelname)s - %(name)s - %(message)s",
 )
+# Repeated messages (e.g. a failing search on every query) are rate limited
+for handler in logging.getLogger().handlers:
+    handler.addFilter(RateLimitFilter(period=10.0, burst=5))
 logger = logging.getLogger(__name__)
 
+# Background ingestion of uploaded files
+services.register("ingestion_job_store", lambda: open_store("ingestion_job_store"))
+services.register(
+    "ingestion_worker",
+    lambda: IngestionWorker(
+        services.ingestion_job_store,
+        services.vector_store,
+        text_splitter,
+        services.file_registry,
+        BatchEmbedder(
+            services.embeddings,
+            batch_size=64,
+            max_in_flight=4,
+            # Provider quota; a local model is only bounded by max_in_flight
+            requests_per_second=5.0 if embedding_backend() == "google" else 1000.0,
+        ),
+        spool_dir=os.path.join(DATA_DIR, "uploads"),
+        keyword_index=services.keyword_index,
+    ),
+)
+_ingestion_worker_lock = asyncio.Lock()
+
+# Conversation history per reader session
+services.register("session_store", lambda: open_store("session_store"))
+
+# Admission control of queries: streaming chat first, then /rag and
+# /vector_search, sessions taking turns
+services.register(
+    "generation_scheduler",
+    lambda: GenerationScheduler(
+        max_concurrent=int(os.getenv("GENERATION_CONCURRENCY", "16"))
+    ),
+)
+
+# Build the clients and stores at startup, in the background, instead of on the
+# first requests. /readyz reports ready once they are up
+WARM_UP = os.getenv("WARM_UP", "1").lower() not in ("0", "false", "no")
+WARM_UP_SERVICES = [
+    "vector_store",
+    "keyword_index",
+    "rag_chain",
+    "ingestion_job_store",
+    "session_store",
+]
+WARM_UP_RETRY_SECONDS = 10.0
+
+
+async def get_ingestion_worker() -> IngestionWorker:
+    """
+    The ingestion worker, built (with the stores it writes to) and started
+    on first use.
+    """
+    async with _ingestion_worker_lock:
+        if not services.is_created("ingestion_worker"):
+            worker = await asyncio.to_thread(services.get, "ingestion_worker")
+            await worker.start()
+    return services.ingestion_worker
+
+
+async def start_services():
+    """
+    Warm the services up and start ingestion (right away if jobs were left
+    over by a restart), retrying until it all works, then mark the app ready.
+    """
+    while True:
+        ready = True
+        if WARM_UP:
+            ready = await asyncio.to_thread(services.warm_up, WARM_UP_SERVICES)
+        if ready and (
+            WARM_UP
+            or await asyncio.to_thread(services.ingestion_job_store.unfinished_jobs)
+        ):
+            try:
+                await get_ingestion_worker()
+            except Exception as e:
+                logger.error("Could not start the ingestion worker: %s", e)
+                ready = False
+        if ready:
+            services.ready.set()
+            logger.info("Services ready")
+            return
+        await asyncio.sleep(WARM_UP_RETRY_SECONDS)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    startup = asyncio.create_task(start_services())
+    yield
+    # Not ready while shutting down, so traffic moves to other instances
+    services.ready.clear()
+    startup.cancel()
+    await asyncio.gather(startup, return_exceptions=True)
+    if services.is_created("ingestion_worker"):
+        await services.ingestion_worker.stop()
+
+
 # Init App
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # CORS Configuration
 origins = [
@@ -43,92 +170,165 @@ def root():
     return RedirectResponse("/docs")
 
 
-@app.post("/upload_file", tags=["VectorDB"])
-async def upload_file(file: UploadFile = File(...)):
+@app.get("/healthz", tags=["General"])
+def healthz():
     """
-    Upload a single file and save it to the vector store with metadata.
+    Liveness: the process is up and serving requests.
     """
-    # Read file bytes
-    content_bytes = await file.read()
+    return {"status": status.HTTP_200_OK}
 
-    # Process file
-    doc_processor = DocProcessing(file.filename, content_bytes)
-    file_str = doc_processor.process_doc()
 
-    # Generate unique file ID
-    file_id = str(uuid.uuid4())
+@app.get("/readyz", tags=["General"])
+def readyz():
+    """
+    Readiness: the services are warmed up and ingestion is running. Answers
+    503 until then and while shutting down, with the state of each service.
+    """
+    ready = services.ready.is_set()
+    code = status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE
+    return JSONResponse(
+        status_code=code,
+        content={"status": code, "ready": ready, "services": services.stats()},
+    )
 
-    # Split text into chunks/documents
-    texts = text_splitter.create_documents([file_str])
 
-    # Add metadata to each document chunk
-    for doc in texts:
-        doc.metadata = {
-            "file_id": file_id,
-            "filename": file.filename,
-            "is_active": True,  # Files are active by default
-        }
+@app.get("/metrics", tags=["General"], response_class=PlainTextResponse)
+def metrics_endpoint():
+    """
+    Prometheus metrics: per-stage latency histograms of queries and
+    ingestion, answer counts and cache/session sizes.
+    """
+    if services.is_created("session_store"):
+        sessions_gauge.set(services.session_store.stats()["sessions"])
+    # Scrapes must not build the services (e.g. before the warm-up is done)
+    if services.is_created("answer_cache"):
+        answer_cache_stats = services.answer_cache.stats()
+        answer_cache_entries_gauge.set(answer_cache_stats["entries"])
+        answer_cache_hit_ratio_gauge.set(answer_cache_stats["hit_rate"])
+    if services.is_created("keyword_index"):
+        keyword_index_chunks_gauge.set(services.keyword_index.stats()["chunks"])
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4"
+    )
+
+
+@app.post(
+    "/upload_file", tags=["VectorDB"], status_code=status.HTTP_202_ACCEPTED
+)
+async def upload_file(file: UploadFile = File(...)):
+    """
+    Upload a single file and queue its ingestion into the vector store.
+    Returns right away with a job id; progress is reported by /jobs/{job_id}.
+    """
+    # Reject unsupported files before queueing them
+    if not file.filename.endswith((".txt", ".pdf")):
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Unsupported file type",
+        )
 
-    # Add to vector store and get generated IDs
-    ids = vector_store.add_documents(texts)
+    # Read file bytes
+    content_bytes = await file.read()
+
+    ingestion_worker = await get_ingestion_worker()
+    job = await ingestion_worker.submit(file.filename, content_bytes)
 
     return {
-        "status": status.HTTP_201_CREATED,
-        "uploaded_ids": ids,
-        "file_id": file_id,
+        "status": status.HTTP_202_ACCEPTED,
+        "job_id": job["job_id"],
+        "file_id": job["file_id"],
         "filename": file.filename,
     }
 
 
+@app.get("/jobs/{job_id}", tags=["Ingestion"])
+def get_job_status(job_id: str):
+    """
+    Get the progress of an ingestion job (pages parsed, chunks embedded, ETA).
+    """
+    job = services.ingestion_job_store.get_job(job_id)
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"No ingestion job found for job_id: {job_id}",
+        )
+    return {"status": status.HTTP_200_OK, "job": _public_job(job)}
+
+
+@app.websocket("/ws/jobs/{job_id}")
+async def job_progress(websocket: WebSocket, job_id: str):
+    """
+    Push ingestion job progress to the client until the job finishes.
+    """
+    await websocket.accept()
+    try:
+        last_sent = None
+        while True:
+            job = await asyncio.to_thread(services.ingestion_job_store.get_job, job_id)
+            if not job:
+                await websocket.send_json({"error": "JOB_NOT_FOUND"})
+                break
+
+            public_job = _public_job(job)
+            if public_job != last_sent:
+                await websocket.send_json(public_job)
+                last_sent = public_job
+
+            if job["status"] in FINISHED_STATUSES:
+                break
+            await asyncio.sleep(0.5)
+
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.error("Error in job progress WebSocket: %s", e)
+
+
+def _public_job(job: dict) -> dict:
+    # Hide server-side paths
+    return {key: value for key, value in job.items() if key != "spool_path"}
+
+
 class ToggleFileStatusRequest(BaseModel):
     file_id: str
     is_active: bool
 
 
 @app.post("/toggle_file_status", tags=["VectorDB"])
-async def toggle_file_status(request: ToggleFileStatusRequest):
+def toggle_file_status(request: ToggleFileStatusRequest):
     """
-    Toggle the active status of a file by updating all its document chunks.
+    Toggle the active status of a file by updating the metadata of its chunks.
+    The stored vectors are reused, nothing is re-embedded.
     """
     try:
-        # Get all documents for this file
-        collection = vector_store.get()
-
-        # Find document IDs that match this file_id
-        doc_ids_to_update = []
-        for i, metadata in enumerate(collection["metadatas"]):
-            if metadata and metadata.get("file_id") == request.file_id:
-                doc_ids_to_update.append(collection["ids"][i])
+        # Look up the file's chunk ids in the registry
+        file_info = services.file_registry.get_file(request.file_id)
 
         # Check if file exists
-        if not doc_ids_to_update:
-            logger.warning(f"No documents found for file_id: {request.file_id}")
+        if not file_info or not file_info["chunk_ids"]:
+            logger.warning("No documents found for file_id: %s", request.file_id)
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"No documents found for file_id: {request.file_id}. The file may have been deleted or corrupted.",
             )
 
-        # Prepare documents for re-adding with updated metadata
-        documents_to_read = []
+        doc_ids_to_update = file_info["chunk_ids"]
 
-        for i, metadata in enumerate(collection["metadatas"]):
-            if metadata and metadata.get("file_id") == request.file_id:
-                # Create updated metadata
-                updated_metadata = metadata.copy()
-                updated_metadata["is_active"] = request.is_active
-
-                # Create document with updated metadata
-                doc = Document(
-                    page_content=collection["documents"][i], metadata=updated_metadata
-                )
-                documents_to_read.append(doc)
-
-        # Delete old documents and re-add with updated metadata
+        # Update metadata in place, keeping the stored embeddings
         logger.info(
-            f"Updating {len(doc_ids_to_update)} document chunks for file {request.file_id} to active={request.is_active}"
+            "Updating %d document chunks for file %s to active=%s",
+            len(doc_ids_to_update),
+            request.file_id,
+            request.is_active,
         )
-        vector_store.delete(ids=doc_ids_to_update)
-        vector_store.add_documents(documents_to_read, ids=doc_ids_to_update)
+        # (Chroma merges the given keys into the existing metadata)
+        for ids in chroma_batches(services.vector_store, doc_ids_to_update):
+            services.vector_store._collection.update(
+                ids=ids, metadatas=[{"is_active": request.is_active}] * len(ids)
+            )
+        services.keyword_index.set_active(request.file_id, request.is_active)
+        services.file_registry.set_active(request.file_id, request.is_active)
 
         return {
             "status": status.HTTP_200_OK,
@@ -139,7 +339,7 @@ async def toggle_file_status(request: ToggleFileStatusRequest):
     except HTTPException:
         raise  # Re-raise HTTP exceptions as-is
     except Exception as e:
-        logger.error(f"Error toggling file status: {str(e)}")
+        logger.error("Error toggling file status: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error toggling file status: {str(e)}",
@@ -147,55 +347,25 @@ async def toggle_file_status(request: ToggleFileStatusRequest):
 
 
 @app.get("/get_uploaded_files", tags=["VectorDB"])
-async def get_uploaded_files():
+def get_uploaded_files():
     """
     Get list of all uploaded files with their active status.
     """
     try:
-        collection = vector_store.get()
-
-        # Group documents by file_id to get unique files and track active status
-        files_dict = {}
-        for metadata in collection["metadatas"]:
-            if metadata and "file_id" in metadata:
-                file_id = metadata["file_id"]
-                is_active = metadata.get("is_active", True)
-
-                if file_id not in files_dict:
-                    files_dict[file_id] = {
-                        "id": file_id,
-                        "name": metadata.get("filename", "Unknown"),
-                        "isActive": is_active,
-                        "chunk_count": 1,
-                        "active_chunks": 1 if is_active else 0,
-                    }
-                else:
-                    files_dict[file_id]["chunk_count"] += 1
-                    if is_active:
-                        files_dict[file_id]["active_chunks"] += 1
-
-                    # File is considered active if ALL chunks are active
-                    files_dict[file_id]["isActive"] = (
-                        files_dict[file_id]["active_chunks"]
-                        == files_dict[file_id]["chunk_count"]
-                    )
-
-        # Clean up the response to only include necessary fields
-        files_list = []
-        for file_data in files_dict.values():
-            files_list.append(
-                {
-                    "id": file_data["id"],
-                    "name": file_data["name"],
-                    "isActive": file_data["isActive"],
-                }
-            )
+        files_list = [
+            {
+                "id": file_info["file_id"],
+                "name": file_info["filename"],
+                "isActive": file_info["is_active"],
+            }
+            for file_info in services.file_registry.list_files()
+        ]
 
-        logger.info(f"Found {len(files_list)} files in vector store")
+        logger.info("Found %d files in vector store", len(files_list))
         return {"status": status.HTTP_200_OK, "files": files_list}
 
     except Exception as e:
-        logger.error(f"Error getting uploaded files: {str(e)}")
+        logger.error("Error getting uploaded files: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error getting uploaded files: {str(e)}",
@@ -203,28 +373,27 @@ async def get_uploaded_files():
 
 
 @app.delete("/delete_file/{file_id}", tags=["VectorDB"])
-async def delete_file(file_id: str):
+def delete_file(file_id: str):
     """
     Delete a file and all its document chunks from the vector store.
     """
     try:
-        # Get all documents for this file
-        collection = vector_store.get()
+        # Look up the file's chunk ids in the registry
+        file_info = services.file_registry.get_file(file_id)
 
-        # Find document IDs that match this file_id
-        doc_ids_to_delete = []
-        for i, metadata in enumerate(collection["metadatas"]):
-            if metadata and metadata.get("file_id") == file_id:
-                doc_ids_to_delete.append(collection["ids"][i])
-
-        if not doc_ids_to_delete:
+        if not file_info:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"No documents found for file_id: {file_id}",
             )
 
-        # Delete all chunks of this file
-        vector_store.delete(ids=doc_ids_to_delete)
+        doc_ids_to_delete = file_info["chunk_ids"]
+
+        # Delete all chunks of this file, then the file itself
+        for ids in chroma_batches(services.vector_store, doc_ids_to_delete):
+            services.vector_store.delete(ids=ids)
+        services.keyword_index.delete_file(file_id)
+        services.file_registry.delete_file(file_id)
 
         return {
             "status": status.HTTP_200_OK,
@@ -232,27 +401,78 @@ async def delete_file(file_id: str):
             "deleted_chunks": len(doc_ids_to_delete),
         }
 
+    except HTTPException:
+        raise  # Re-raise HTTP exceptions as-is
     except Exception as e:
-        logger.error(f"Error deleting file: {str(e)}")
+        logger.error("Error deleting file: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error deleting file: {str(e)}",
         )
 
 
+class ReadingPosition(BaseModel):
+    """How far the reader has read a file, to keep answers spoiler-free."""
+
+    file_id: str
+    page: Optional[int] = None  # Last page read (1-based)
+    chapter: Optional[int] = None  # Last chapter read
+    char_offset: Optional[int] = None  # Offset in the formatted text
+
+
+def _read_up_to(positions: Optional[list]) -> Optional[list]:
+    if not positions:
+        return None
+    return [
+        ReadingPosition.model_validate(position).model_dump()
+        for position in positions
+    ]
+
+
+def _format_citation(doc) -> dict:
+    return {
+        "content": doc.page_content,
+        "filename": doc.metadata.get("filename", "Unknown"),
+        "file_id": doc.metadata.get("file_id", ""),
+        "page": doc.metadata.get("page"),
+        "chapter": doc.metadata.get("chapter"),
+    }
+
+
 class SearchRequest(BaseModel):
     search_str: str  # String to search
     n: int = 3  # Number of similarity chunks to return
+    read_up_to: Optional[List[ReadingPosition]] = None
+
+
+def _client_key(http_request: Request) -> str:
+    """Queue key of requests without a session: the client address."""
+    return f"client:{http_request.client.host if http_request.client else ''}"
+
+
+def _busy(e: SchedulerBusy) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=str(e),
+        headers={"Retry-After": str(e.retry_after)},
+    )
 
 
 @app.post("/vector_search", tags=["VectorDB"])
-def similarity_search(request: SearchRequest):
+async def similarity_search(request: SearchRequest, http_request: Request):
     try:
-        docs = rag_chain.get_retrieved_documents(query=request.search_str)
+        async with services.generation_scheduler.slot(
+            _client_key(http_request), BATCH
+        ):
+            docs = await services.rag_chain.aget_retrieved_documents(
+                query=request.search_str, read_up_to=_read_up_to(request.read_up_to)
+            )
 
         return {"status": status.HTTP_200_OK, "results": docs}
+    except SchedulerBusy as e:
+        raise _busy(e)
     except Exception as e:
-        logger.error(f"Error in /vector_search: {str(e)}")
+        logger.error("Error in /vector_search: %s", e)
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Error in request: {str(e)}",
@@ -261,10 +481,28 @@ def similarity_search(request: SearchRequest):
 
 class RAGRequest(BaseModel):
     query: str
+    session_id: Optional[str] = None  # Without it the query has no history
+    read_up_to: Optional[List[ReadingPosition]] = None
+
+
+async def _session_turn_kwargs(session_id: Optional[str], query: str) -> dict:
+    """
+    History and answer callback of a session, for RAGChain turns. The
+    session store may be a proxy to the store server: it is called off the
+    event loop (RAGChain runs on_answer in a worker thread).
+    """
+    if not session_id:
+        return {}
+    return {
+        "history": await asyncio.to_thread(services.session_store.history, session_id),
+        "on_answer": lambda answer: services.session_store.save_turn(
+            session_id, query, answer
+        ),
+    }
 
 
 @app.post("/rag", tags=["RAG"])
-async def rag_chain_invoke(request: RAGRequest):
+async def rag_chain_invoke(request: RAGRequest, http_request: Request):
 
     # Get Query
     query = request.query
@@ -274,18 +512,22 @@ async def rag_chain_invoke(request: RAGRequest):
             detail="Empty or None String Value in Query...",
         )
 
-    # Query the RAG Chain
-    response, citations = rag_chain.process_query(query=query, stream_response=False)
+    # Query the RAG Chain, once the scheduler lets it through
+    try:
+        async with services.generation_scheduler.slot(
+            request.session_id or _client_key(http_request), BATCH
+        ):
+            response, citations = await services.rag_chain.aprocess_query(
+                query=query,
+                stream_response=False,
+                read_up_to=_read_up_to(request.read_up_to),
+                **await _session_turn_kwargs(request.session_id, query),
+            )
+    except SchedulerBusy as e:
+        raise _busy(e)
 
     # Format citations
-    formatted_citations = []
-    for doc in citations:
-        citation = {
-            "content": doc.page_content,
-            "filename": doc.metadata.get("filename", "Unknown"),
-            "file_id": doc.metadata.get("file_id", ""),
-        }
-        formatted_citations.append(citation)
+    formatted_citations = [_format_citation(doc) for doc in citations]
 
     # Return Success
     return {
@@ -295,77 +537,217 @@ async def rag_chain_invoke(request: RAGRequest):
     }
 
 
+class ClearMemoryRequest(BaseModel):
+    session_id: Optional[str] = None  # Optional only for older clients
+
+
 @app.post("/clear_memory", tags=["RAG"])
-async def clear_memory():
-    """Clear the RAG chain memory to reset conversation history."""
+def clear_memory(request: Optional[ClearMemoryRequest] = None):
+    """
+    Clear the memory of a session to reset its conversation history.
+
+    Deprecated without a session_id: history is kept per session, so there is
+    no shared memory left to clear. Such calls still succeed but clear
+    nothing, with a Deprecation header. Send the session_id used with /rag
+    and /ws/stream.
+    """
+    session_id = request.session_id if request is not None else None
+    if not session_id:
+        logger.warning("/clear_memory called without a session_id, nothing cleared")
+        return JSONResponse(
+            {
+                "status": status.HTTP_200_OK,
+                "message": "Nothing cleared: pass the session_id to clear",
+            },
+            headers={"Deprecation": "true"},
+        )
     try:
-        rag_chain.clear_memory()
+        services.session_store.clear(session_id)
         return {"status": status.HTTP_200_OK, "message": "Memory cleared successfully"}
     except Exception as e:
-        logger.error(f"Error clearing memory: {str(e)}")
+        logger.error("Error clearing memory: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error clearing memory: {str(e)}",
         )
 
 
-@app.websocket("/ws/stream")
-async def chat(websocket: WebSocket):
-    await websocket.accept()
-    try:
-        response = ""
-        while True:
-            # Get frontend data
-            data = await websocket.receive_json()
-
-            # Check if data has "query" attribute (needed)
-            if "query" not in data:
-                await websocket.send_text("<<E:NO_QUERY>>")
-                break
-
-            # Else get query
-            query = data["query"]
-
-            # Get citations first (but don't send them yet)
-            retrieved_docs = rag_chain.get_citations_for_query(query)
+def _error_frame(code: str, message: str, turn: Optional[int] = None) -> dict:
+    frame = {"type": "error", "code": code, "message": message}
+    if turn is not None:
+        frame["turn"] = turn
+    return frame
 
-            # Generate response in real time
-            for token in rag_chain.process_query(query=query, stream_response=True):
-                await websocket.send_text(token.content)
-                await asyncio.sleep(0)
-                response += token.content
 
-            # Send citations after the response is complete
-            if retrieved_docs:
-                citations = []
-                for doc in retrieved_docs:
-                    citation = {
-                        "content": doc.page_content,
-                        "filename": doc.metadata.get("filename", "Unknown"),
-                        "file_id": doc.metadata.get("file_id", ""),
-                    }
-                    citations.append(citation)
-
-                import json
+async def _answer(
+    sender,
+    turn_number: int,
+    query: str,
+    session_id: str,
+    read_up_to,
+    previous: Optional[asyncio.Task] = None,
+):
+    """
+    Answer one query on /ws/stream. Runs as a task of its own so the
+    connection keeps listening: cancelling it aborts the rewrite, the
+    retrieval or the model stream, whichever is running. With previous (the
+    text protocol answers one query at a time) it starts once that answer is
+    done; cancelling it cancels that answer too.
+    """
+    try:
+        if previous is not None:
+            await previous
+        async with services.generation_scheduler.slot(session_id, INTERACTIVE):
+            turn = await services.rag_chain.astart_turn(
+                query,
+                read_up_to=read_up_to,
+                **await _session_turn_kwargs(session_id, query),
+            )
+            async with aclosing(turn.astream()) as tokens:
+                async for token in tokens:
+                    await sender.token(token.content)
 
-                await websocket.send_text(f"<<CITATIONS>>{json.dumps(citations)}")
+        if turn.docs:
+            await sender.send(
+                {
+                    "type": "citations",
+                    "turn": turn_number,
+                    "citations": [_format_citation(doc) for doc in turn.docs],
+                }
+            )
+        await sender.send({"type": "end", "turn": turn_number})
+    except WebSocketDisconnect:
+        pass  # The connection handler sees it too
+    except SchedulerBusy as e:
+        frame = _error_frame("BUSY", "Too many queries, retry later", turn_number)
+        frame["retry_after"] = e.retry_after
+        try:
+            await sender.send(frame)
+        except WebSocketDisconnect:
+            pass
+    except Exception as e:
+        logger.error("Error answering on /ws/stream: %s", e)
+        try:
+            await sender.send(
+                _error_frame("INTERNAL", "Could not answer the query", turn_number)
+            )
+        except WebSocketDisconnect:
+            pass
+
+
+async def _cancel_answer(
+    answer: Optional[asyncio.Task], sender, turn_number: int, reason: str
+):
+    """Cancel the answer in progress, if any, and wait until it has stopped."""
+    if answer is None or answer.done():
+        return
+    answer.cancel()
+    await asyncio.wait({answer})
+    ws_answers_cancelled_total.inc(reason=reason)
+    logger.debug("Answer %s cancelled (%s)", turn_number, reason)
+    if reason != "disconnect":
+        await sender.send(
+            {"type": "cancelled", "turn": turn_number, "reason": reason}
+        )
 
-            # End of response
-            await websocket.send_text("<<END>>")
 
+@app.websocket("/ws/stream")
+async def chat(websocket: WebSocket):
+    # Framed protocol if the client asks for it, else the text protocol (v1)
+    framed = SUBPROTOCOL in websocket.scope.get("subprotocols", [])
+    await websocket.accept(subprotocol=SUBPROTOCOL if framed else None)
+    framed = framed or websocket.query_params.get("protocol") == str(
+        PROTOCOL_VERSION
+    )
+    # Session from the URL (?session_id=) or each message, else one per connection
+    connection_session_id = websocket.query_params.get("session_id") or str(
+        uuid.uuid4()
+    )
+    sender = (
+        FrameSender(websocket.send_text) if framed else TextSender(websocket.send_text)
+    )
+    sender.start()
+    turn_number = 0
+    answer = None
+    try:
+        if framed:
+            await sender.send(
+                {
+                    "type": "hello",
+                    "v": PROTOCOL_VERSION,
+                    "session_id": connection_session_id,
+                }
+            )
+        # Keep listening while answering: a disconnect, a newer query or a
+        # cancel message stops the answer in progress
+        while True:
+            try:
+                data = json.loads(await websocket.receive_text())
+            except json.JSONDecodeError:
+                data = None
+            kind = data.get("type", "query") if isinstance(data, dict) else None
+            if kind == "cancel":
+                await _cancel_answer(answer, sender, turn_number, "client")
+                continue
+
+            error = None
+            if kind != "query":
+                error = _error_frame("BAD_MESSAGE", "Expected a query message")
+            elif not data.get("query"):
+                error = _error_frame("NO_QUERY", "The message has no query")
+            else:
+                # Optional reading position, answers won't go past it
+                try:
+                    read_up_to = _read_up_to(data.get("read_up_to"))
+                except ValidationError:
+                    error = _error_frame("BAD_READ_UP_TO", "Invalid reading position")
+            if error is not None:
+                await sender.send(error)
+                if not framed:
+                    break  # Version 1 closes the connection on errors
+                continue
+
+            if framed:
+                await _cancel_answer(answer, sender, turn_number, "superseded")
+            turn_number += 1
+            start = {"type": "start", "turn": turn_number}
+            if "id" in data:
+                start["id"] = data["id"]
+            await sender.send(start)
+            answer = asyncio.create_task(
+                _answer(
+                    sender,
+                    turn_number,
+                    data["query"],
+                    data.get("session_id") or connection_session_id,
+                    read_up_to,
+                    # Version 1 queues the query after the answer in progress
+                    None if framed or answer is None or answer.done() else answer,
+                )
+            )
+    except WebSocketDisconnect:
+        pass
     except Exception as e:
-        print(f"Error in WebSocket Connection: {e}")
+        logger.error("Error in WebSocket Connection: %s", e)
+    finally:
+        await _cancel_answer(answer, sender, turn_number, "disconnect")
+        await sender.aclose()
 
 
 @app.get("/debug_documents", tags=["VectorDB"])
-async def debug_documents():
+def debug_documents(limit: int = 100, offset: int = 0):
     """
-    Debug endpoint to inspect all documents and their metadata.
+    Debug endpoint to inspect documents and their metadata, one page at a time.
     """
     try:
-        collection = vector_store.get()
+        collection = services.vector_store.get(limit=limit, offset=offset)
 
-        debug_info = {"total_documents": len(collection["ids"]), "documents": []}
+        debug_info = {
+            "total_documents": services.file_registry.total_chunks(),
+            "limit": limit,
+            "offset": offset,
+            "documents": [],
+        }
 
         for i, doc_id in enumerate(collection["ids"]):
             doc_info = {
@@ -384,7 +766,7 @@ async def debug_documents():
         return debug_info
 
     except Exception as e:
-        logger.error(f"Error in debug_documents: {str(e)}")
+        logger.error("Error in debug_documents: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error getting debug info: {str(e)}",
@@ -392,16 +774,28 @@ async def debug_documents():
 
 
 @app.get("/debug_file_status/{file_id}", tags=["VectorDB"])
-async def debug_file_status(file_id: str):
+def debug_file_status(file_id: str):
     """
     Debug endpoint to inspect a specific file's status and chunks.
     """
     try:
-        collection = vector_store.get()
+        file_info = services.file_registry.get_file(file_id)
+        if not file_info:
+            return {
+                "file_id": file_id,
+                "found": False,
+                "message": "No chunks found for this file_id",
+            }
+
+        collection = {"ids": [], "metadatas": [], "documents": []}
+        for ids in chroma_batches(services.vector_store, file_info["chunk_ids"]):
+            batch = services.vector_store.get(ids=ids)
+            for key in collection:
+                collection[key].extend(batch[key])
 
         file_chunks = []
         for i, metadata in enumerate(collection["metadatas"]):
-            if metadata and metadata.get("file_id") == file_id:
+            if metadata:
                 chunk_info = {
                     "chunk_id": collection["ids"][i],
                     "is_active": metadata.get("is_active", "NOT_SET"),
@@ -433,17 +827,63 @@ async def debug_file_status(file_id: str):
             "active_chunks": active_count,
             "inactive_chunks": inactive_count,
             "file_should_be_active": active_count == len(file_chunks),
+            "registry": {
+                "is_active": file_info["is_active"],
+                "chunk_count": file_info["chunk_count"],
+                "size_bytes": file_info["size_bytes"],
+                "uploaded_at": file_info["uploaded_at"],
+            },
             "chunks": file_chunks,
         }
 
     except Exception as e:
-        logger.error(f"Error in debug_file_status: {str(e)}")
+        logger.error("Error in debug_file_status: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error getting file debug info: {str(e)}",
         )
 
 
+@app.get("/debug/stats", tags=["Debug"])
+def debug_stats():
+    """
+    Debug endpoint to inspect the counters and sizes of the services: caches,
+    context packing, retrieval latencies and reranker, cancellations, the
+    generation queue, the keyword index and the sessions. Services not built
+    yet are reported as null (this doesn't build them). Totals and latency
+    histograms for dashboards are on /metrics.
+    """
+
+    def built(name: str, stats):
+        return stats(services.get(name)) if services.is_created(name) else None
+
+    def retrieval(rag_chain):
+        reranker = rag_chain.reranker
+        return {
+            "initial_k": rag_chain.initial_k,
+            "timings": rag_chain.timings.stats(),
+            "reranker": reranker.stats() if reranker is not None else None,
+        }
+
+    return {
+        "status": status.HTTP_200_OK,
+        "embedding_cache": built("embeddings", lambda cache: cache.stats()),
+        "answer_cache": built("answer_cache", lambda cache: cache.stats()),
+        "context": built(
+            "rag_chain", lambda rag_chain: rag_chain.context_assembler.stats()
+        ),
+        "retrieval": built("rag_chain", retrieval),
+        "cancellations": built(
+            "rag_chain", lambda rag_chain: rag_chain.cancellation_stats()
+        ),
+        "scheduler": built(
+            "generation_scheduler", lambda scheduler: scheduler.stats()
+        ),
+        "keyword_index": built("keyword_index", lambda index: index.stats()),
+        "sessions": built("session_store", lambda store: store.stats()),
+    }
+
+
 @app.post("/debug_chunking", tags=["Debug"])
 async def debug_chunking(text: str):
     """
@@ -485,7 +925,7 @@ async def debug_chunking(text: str):
         }
 
     except Exception as e:
-        logger.error(f"Error in debug_chunking: {str(e)}")
+        logger.error("Error in debug_chunking: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error testing chunking: {str(e)}",
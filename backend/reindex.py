@@ -0,0 +1,123 @@
+"""
+Re-embed an existing Chroma collection with the configured embedding backend
+(EMBEDDING_BACKEND / EMBEDDING_MODEL) into a new collection, streaming the
+chunks in batches. Ids, texts and metadata are copied as they are, so the file
+registry and the keyword index stay valid. Already migrated chunks are
+skipped, so an interrupted run can simply be started again.
+
+    cd backend
+    EMBEDDING_BACKEND=onnx EMBEDDING_MODEL=/models/all-MiniLM-L6-v2 \\
+        python reindex.py --target minilm_collection
+
+Stop the server first, then start it with the same embedding settings and
+CHROMA_COLLECTION=minilm_collection.
+"""
+
+import argparse
+import os
+import time
+
+from dotenv import load_dotenv
+
+from BatchEmbedder import BatchEmbedder
+from EmbeddingBackends import embedding_backend, load_embeddings
+from EmbeddingCache import CachedEmbeddings
+from StoreServer import open_vector_store
+
+
+def iter_batches(source, target, page_size: int, batch_size: int, progress: dict):
+    """Stream (ids, metadatas) keyed batches of the chunks not in target yet."""
+    offset = 0
+    while True:
+        page = source.get(
+            include=["documents", "metadatas"], limit=page_size, offset=offset
+        )
+        if not page["ids"]:
+            return
+        offset += len(page["ids"])
+        progress["read"] = offset
+
+        migrated = set(target.get(ids=page["ids"], include=[])["ids"])
+        progress["skipped"] += len(migrated)
+        rows = [
+            row
+            for row in zip(page["ids"], page["documents"], page["metadatas"])
+            if row[0] not in migrated
+        ]
+        for start in range(0, len(rows), batch_size):
+            ids, texts, metadatas = zip(*rows[start : start + batch_size])
+            yield (list(ids), list(metadatas)), list(texts)
+
+
+def main():
+    data_dir = os.getenv("DATA_DIR", os.path.dirname(__file__))
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--source", default=os.getenv("CHROMA_COLLECTION", "test_collection")
+    )
+    parser.add_argument("--target", required=True)
+    parser.add_argument(
+        "--persist-directory",
+        default=os.path.join(data_dir, "chroma_db"),
+    )
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--max-in-flight", type=int, default=4)
+    args = parser.parse_args()
+    if args.source == args.target:
+        parser.error("--target must be a different collection than --source")
+
+    base_embeddings, model_name = load_embeddings()
+    embeddings = CachedEmbeddings(
+        base_embeddings,
+        model_name=model_name,
+        db_path=os.path.join(data_dir, "embedding_cache.db"),
+    )
+    # On the Chroma server if CHROMA_HOST is set
+    source = open_vector_store(args.source, args.persist_directory)._collection
+    target = open_vector_store(
+        args.target, args.persist_directory, embedding_function=embeddings
+    )._collection
+    embedder = BatchEmbedder(
+        embeddings,
+        batch_size=args.batch_size,
+        max_in_flight=args.max_in_flight,
+        requests_per_second=5.0 if embedding_backend() == "google" else 1000.0,
+    )
+
+    total = source.count()
+    print(f"Reindexing {total} chunks of '{args.source}' into '{args.target}'")
+    print(f"Embedding model: {model_name}")
+    progress = {"read": 0, "skipped": 0}
+    embedded = 0
+    started = time.monotonic()
+    last_report = started
+    for (ids, metadatas), texts, vectors in embedder.embed_batches(
+        iter_batches(source, target, args.page_size, args.batch_size, progress)
+    ):
+        target.upsert(
+            ids=ids, embeddings=vectors, metadatas=metadatas, documents=texts
+        )
+        embedded += len(ids)
+        now = time.monotonic()
+        if now - last_report >= 5.0:
+            last_report = now
+            print(
+                f"  {progress['read']}/{total} read, {embedded} embedded "
+                f"({embedded / (now - started):.1f} chunks/s), "
+                f"{progress['skipped']} already migrated"
+            )
+
+    elapsed = max(time.monotonic() - started, 1e-6)
+    print(
+        f"Done: {embedded} chunks embedded in {elapsed:.1f}s "
+        f"({embedded / elapsed:.1f} chunks/s), {progress['skipped']} skipped. "
+        f"'{args.target}' holds {target.count()} chunks."
+    )
+    print(f"Start the server with CHROMA_COLLECTION={args.target}")
+
+
+if __name__ == "__main__":
+    # Same environment as the server (.env)
+    load_dotenv()
+    main()
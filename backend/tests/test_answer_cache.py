@@ -0,0 +1,79 @@
+"""
+Semantic answer cache: hits, reading-position scopes and invalidation when
+the active corpus changes.
+
+    cd backend && python -m pytest tests
+"""
+
+import pytest
+
+from AnswerCache import AnswerCache
+from benchmarks.fakes import FakeEmbeddings
+
+
+@pytest.fixture
+def corpus():
+    return {"fingerprint": "v1"}
+
+
+@pytest.fixture
+def cache(corpus):
+    return AnswerCache(FakeEmbeddings(size=32), lambda: corpus["fingerprint"])
+
+
+def answer(cache, query, text, read_up_to=None):
+    probe = cache.lookup(query, read_up_to)
+    assert probe.hit is None
+    cache.store(probe, query, text, docs=[])
+
+
+def test_same_query_hits(cache):
+    answer(cache, "Who is Marta?", "A baker.")
+
+    hit = cache.lookup("Who is Marta?").hit
+
+    assert hit is not None and hit.answer == "A baker."
+    assert cache.lookup("What is the bakery called?").hit is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_answers_are_scoped_by_reading_position(cache):
+    chapter_2 = [{"file_id": "book", "chapter": 2}]
+    chapter_9 = [{"file_id": "book", "chapter": 9}]
+    answer(cache, "Who is Marta?", "A baker.", read_up_to=chapter_2)
+
+    assert cache.lookup("Who is Marta?", chapter_2).hit is not None
+    assert cache.lookup("Who is Marta?", chapter_9).hit is None
+    assert cache.lookup("Who is Marta?").hit is None
+
+
+def test_corpus_change_invalidates_everything(cache, corpus):
+    answer(cache, "Who is Marta?", "A baker.")
+
+    corpus["fingerprint"] = "v2"  # A file was uploaded, toggled or deleted
+
+    assert cache.lookup("Who is Marta?").hit is None
+    assert cache.stats()["entries"] == 0
+    assert cache.invalidations == 1
+
+
+def test_answer_generated_across_a_corpus_change_is_not_stored(cache, corpus):
+    probe = cache.lookup("Who is Marta?")
+    corpus["fingerprint"] = "v2"
+    cache.store(probe, "Who is Marta?", "A baker.", docs=[])
+
+    assert cache.lookup("Who is Marta?").hit is None
+
+
+def test_least_recently_used_answer_is_dropped(corpus):
+    cache = AnswerCache(
+        FakeEmbeddings(size=32), lambda: corpus["fingerprint"], max_entries=2
+    )
+    answer(cache, "first", "1")
+    answer(cache, "second", "2")
+    cache.lookup("first")  # "second" is now the least recently used
+    answer(cache, "third", "3")
+
+    assert cache.lookup("first").hit is not None
+    assert cache.lookup("second").hit is None
+    assert cache.stats()["entries"] == 2
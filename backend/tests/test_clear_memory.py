@@ -0,0 +1,45 @@
+"""
+/clear_memory clears one session; without a session_id (older clients) it
+succeeds but clears nothing and is flagged as deprecated.
+
+    cd backend && python -m pytest tests
+"""
+
+import pytest
+from fastapi.testclient import TestClient
+
+from SessionStore import SessionStore
+
+
+@pytest.fixture
+def client_and_store():
+    import main
+    from RAGChain import services
+
+    store = SessionStore()
+    store.save_turn("reader", "Who is Marta?", "A baker.")
+    store.save_turn("other", "Who is Zebedee?", "A rider.")
+    with services.overridden(session_store=store):
+        yield TestClient(main.app), store
+
+
+def test_clear_memory_clears_only_that_session(client_and_store):
+    client, store = client_and_store
+
+    response = client.post("/clear_memory", json={"session_id": "reader"})
+
+    assert response.status_code == 200
+    assert "Deprecation" not in response.headers
+    assert store.history("reader") == ""
+    assert store.history("other") != ""
+
+
+@pytest.mark.parametrize("body", [None, {}])
+def test_clear_memory_without_session_id_is_deprecated(client_and_store, body):
+    client, store = client_and_store
+
+    response = client.post("/clear_memory", json=body)
+
+    assert response.status_code == 200
+    assert response.headers["Deprecation"] == "true"
+    assert store.stats()["sessions"] == 2
@@ -0,0 +1,61 @@
+"""
+Prompt context packing: overlapping chunks merged into spans, then packed
+best-ranked first into the token budget.
+
+    cd backend && python -m pytest tests
+"""
+
+from langchain_core.documents import Document
+
+from ContextAssembler import ContextAssembler
+
+TEXT = "The rain had not stopped for three days. Marta counted the loaves again."
+
+
+def chunk(start, end, file_id="book", text=None):
+    return Document(
+        page_content=TEXT[start:end] if text is None else text,
+        metadata={"file_id": file_id, "char_offset": start, "char_end": end},
+    )
+
+
+def test_overlapping_chunks_merge_into_one_span():
+    spans = ContextAssembler().merge([chunk(30, 73), chunk(0, 45)])
+
+    assert spans == [(0, TEXT)]
+
+
+def test_adjacent_chunks_are_joined_and_distant_ones_kept_apart():
+    assembler = ContextAssembler(max_gap=2)
+    # The splitter strips the space at 40 between the two sentences
+    spans = assembler.merge([chunk(41, 73), chunk(0, 40), chunk(60, 73, "other")])
+
+    assert spans == [(0, TEXT), (2, TEXT[60:73])]
+    assert assembler.merge([chunk(0, 20), chunk(41, 73)]) == [
+        (0, TEXT[0:20]),
+        (1, TEXT[41:73]),
+    ]
+
+
+def test_span_ranks_as_its_best_chunk():
+    spans = ContextAssembler().merge([chunk(50, 60), chunk(20, 30), chunk(5, 25)])
+
+    assert spans == [(0, TEXT[50:60]), (1, TEXT[5:30])]
+
+
+def test_duplicates_without_offsets_are_dropped():
+    docs = [Document(page_content="same"), Document(page_content="same")]
+
+    assert ContextAssembler().merge(docs) == [(0, "same")]
+
+
+def test_spans_that_do_not_fit_the_budget_are_skipped():
+    assembler = ContextAssembler(token_budget=11, chars_per_token=1.0)
+    docs = [
+        chunk(0, 8, text="best one"),
+        chunk(100, 130, text="x" * 30),
+        chunk(200, 201, text="y"),
+    ]
+
+    assert assembler.assemble(docs) == "best one\n\ny"
+    assert assembler.stats()["spans_dropped"] == 1
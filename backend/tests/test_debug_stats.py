@@ -0,0 +1,25 @@
+"""
+/debug/stats reports the services already built and never builds the others.
+
+    cd backend && python -m pytest tests
+"""
+
+from fastapi.testclient import TestClient
+
+from SessionStore import SessionStore
+
+
+def test_debug_stats_does_not_build_services():
+    import main
+    from RAGChain import services
+
+    names = ["embeddings", "answer_cache", "rag_chain", "keyword_index"]
+    built_before = {name: services.is_created(name) for name in names}
+
+    with services.overridden(session_store=SessionStore()):
+        stats = TestClient(main.app).get("/debug/stats").json()
+
+    assert stats["sessions"]["sessions"] == 0
+    assert {name: services.is_created(name) for name in names} == built_before
+    if not built_before["rag_chain"]:
+        assert stats["retrieval"] is None
@@ -0,0 +1,63 @@
+"""
+File management endpoints against an embedded Chroma on a temporary
+directory, with more chunks than Chroma accepts in one call.
+
+    cd backend && python -m pytest tests
+"""
+
+import pytest
+from fastapi.testclient import TestClient
+
+from FileRegistry import FileRegistry
+from KeywordIndex import KeywordIndex
+from StoreServer import chroma_batches, open_vector_store
+
+
+@pytest.fixture
+def large_file(tmp_path, monkeypatch):
+    monkeypatch.delenv("CHROMA_HOST", raising=False)
+    import main
+    from RAGChain import services
+
+    vector_store = open_vector_store("test_collection", str(tmp_path / "chroma_db"))
+    chunk_count = vector_store._client.get_max_batch_size() + 10
+    ids = [f"book:{i}" for i in range(chunk_count)]
+    for batch in chroma_batches(vector_store, ids):
+        vector_store._collection.upsert(
+            ids=batch,
+            embeddings=[[1.0, float(i % 7), 0.5] for i in range(len(batch))],
+            metadatas=[{"file_id": "book", "is_active": True}] * len(batch),
+            documents=[f"Chunk {chunk_id}" for chunk_id in batch],
+        )
+    file_registry = FileRegistry(str(tmp_path / "file_registry.db"))
+    file_registry.add_file("book", "book.pdf", ids)
+    with services.overridden(
+        vector_store=vector_store,
+        file_registry=file_registry,
+        keyword_index=KeywordIndex(str(tmp_path / "keyword.db")),
+    ):
+        yield TestClient(main.app), vector_store, ids
+
+
+def test_toggle_file_above_chroma_max_batch_size(large_file):
+    client, vector_store, ids = large_file
+
+    response = client.post(
+        "/toggle_file_status", json={"file_id": "book", "is_active": False}
+    )
+
+    assert response.status_code == 200
+    assert response.json()["updated_chunks"] == len(ids)
+    for batch in chroma_batches(vector_store, ids):
+        metadatas = vector_store.get(ids=batch, include=["metadatas"])["metadatas"]
+        assert all(metadata["is_active"] is False for metadata in metadatas)
+
+
+def test_delete_file_above_chroma_max_batch_size(large_file):
+    client, vector_store, ids = large_file
+
+    response = client.delete("/delete_file/book")
+
+    assert response.status_code == 200
+    assert response.json()["deleted_chunks"] == len(ids)
+    assert vector_store._collection.count() == 0
@@ -0,0 +1,118 @@
+"""
+Generation admission control: lane priority, round robin between sessions
+and fail-fast deadlines.
+
+    cd backend && python -m pytest tests
+"""
+
+import asyncio
+
+import pytest
+
+from GenerationScheduler import BATCH, INTERACTIVE, GenerationScheduler, SchedulerBusy
+
+
+async def grant_order(scheduler, requests):
+    """
+    Queue (name, session, lane) requests behind a held slot, then release
+    slots one at a time. Returns the names in the order they got a slot.
+    """
+    await scheduler.acquire("holder")
+    order = []
+
+    async def request(name, session_id, lane):
+        await scheduler.acquire(session_id, lane)
+        order.append(name)
+
+    tasks = [asyncio.create_task(request(*r)) for r in requests]
+    await asyncio.sleep(0)  # Let every request queue
+    for _ in requests:
+        scheduler.release()
+        await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+    return order
+
+
+def test_sessions_take_turns_within_a_lane():
+    scheduler = GenerationScheduler(max_concurrent=1)
+    requests = [
+        ("a1", "a", INTERACTIVE),
+        ("a2", "a", INTERACTIVE),
+        ("a3", "a", INTERACTIVE),
+        ("b1", "b", INTERACTIVE),
+    ]
+
+    assert asyncio.run(grant_order(scheduler, requests)) == ["a1", "b1", "a2", "a3"]
+
+
+def test_batch_gets_a_slot_every_batch_every_plus_one():
+    scheduler = GenerationScheduler(max_concurrent=1, batch_every=2)
+    requests = [(f"i{n}", f"reader{n}", INTERACTIVE) for n in range(4)]
+    requests += [(f"b{n}", f"script{n}", BATCH) for n in range(2)]
+
+    assert asyncio.run(grant_order(scheduler, requests)) == [
+        "i0",
+        "i1",
+        "b0",
+        "i2",
+        "i3",
+        "b1",
+    ]
+
+
+def test_request_past_its_lane_deadline_fails_fast():
+    scheduler = GenerationScheduler(
+        max_concurrent=1, deadlines={INTERACTIVE: 20.0, BATCH: 0.05}
+    )
+
+    async def run():
+        await scheduler.acquire("holder")
+        with pytest.raises(SchedulerBusy) as busy:
+            await scheduler.acquire("script", BATCH)
+        return busy.value
+
+    busy = asyncio.run(run())
+
+    assert (busy.lane, busy.reason) == (BATCH, "deadline")
+    assert busy.retry_after >= 1
+    lane = scheduler.stats()["lanes"][BATCH]
+    assert (lane["deadline"], lane["waiting"]) == (1, 0)
+    assert scheduler.active == 1
+
+
+def test_full_queue_rejects_at_once():
+    scheduler = GenerationScheduler(
+        max_concurrent=1, max_queue={INTERACTIVE: 256, BATCH: 1}
+    )
+
+    async def run():
+        await scheduler.acquire("holder")
+        waiting = asyncio.create_task(scheduler.acquire("script1", BATCH))
+        await asyncio.sleep(0)
+        with pytest.raises(SchedulerBusy) as busy:
+            await scheduler.acquire("script2", BATCH)
+        scheduler.release()
+        await waiting
+        return busy.value
+
+    assert asyncio.run(run()).reason == "queue_full"
+    assert scheduler.active == 1
+
+
+def test_cancelled_waiter_does_not_take_a_slot():
+    scheduler = GenerationScheduler(max_concurrent=1)
+
+    async def run():
+        await scheduler.acquire("holder")
+        cancelled = asyncio.create_task(scheduler.acquire("a"))
+        waiting = asyncio.create_task(scheduler.acquire("b"))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.sleep(0)
+        scheduler.release()
+        await waiting
+
+    asyncio.run(run())
+
+    assert scheduler.active == 1
+    assert scheduler.stats()["lanes"][INTERACTIVE]["waiting"] == 0
@@ -0,0 +1,49 @@
+"""
+Hybrid retrieval: vector and BM25 candidates merged by reciprocal rank
+fusion, against an embedded Chroma on a temporary directory.
+
+    cd backend && python -m pytest tests
+"""
+
+from KeywordIndex import KeywordIndex
+from RAGChain import RAGChain
+from StoreServer import open_vector_store
+from benchmarks.fakes import FakeChatModel, FakeEmbeddings
+
+TEXTS = [
+    "Zebedee rode north through the pass.",
+    "Zebedee slept.",
+    "Rain fell on a bakery.",
+    "Loaves cooled by a window.",
+    "A cat watched from a roof.",
+    "Bread sold out by noon.",
+]
+
+
+def test_keyword_only_match_is_fused_with_vector_results(tmp_path, monkeypatch):
+    monkeypatch.delenv("CHROMA_HOST", raising=False)
+    vector_store = open_vector_store(
+        "test_collection", str(tmp_path / "chroma_db"), FakeEmbeddings(size=16)
+    )
+    ids = [f"book:{i}" for i in range(len(TEXTS))]
+    metadatas = [{"file_id": "book", "is_active": True} for _ in TEXTS]
+    vector_store.add_texts(TEXTS, metadatas=metadatas, ids=ids)
+    keyword_index = KeywordIndex(str(tmp_path / "keyword.db"))
+    keyword_index.add_chunks("book", ids, TEXTS, metadatas)
+    chain = RAGChain(
+        FakeChatModel(),
+        vector_store.as_retriever(),
+        prompt=None,
+        keyword_index=keyword_index,
+        initial_k=3,
+    )
+
+    # Same text as the first chunk: vector rank 0 (distance 0) and BM25 rank 0
+    results = chain._hybrid_search(TEXTS[0])
+
+    result_ids = [doc.id for doc, _ in results]
+    assert len(results) == 3
+    assert result_ids[0] == "book:0"
+    # Found by its name only, with a vector distance fetched for ranking
+    assert "book:1" in result_ids
+    assert all(isinstance(distance, float) for _, distance in results)
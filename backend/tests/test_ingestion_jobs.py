@@ -0,0 +1,85 @@
+"""
+Ingestion jobs against an embedded Chroma on a temporary directory: a failed
+job leaves nothing listed or stored.
+
+    cd backend && python -m pytest tests
+"""
+
+import pytest
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from BatchEmbedder import BatchEmbedder
+from FileRegistry import FileRegistry
+from IngestionJobs import FAILED, IngestionJobStore, IngestionWorker
+from KeywordIndex import KeywordIndex
+from StoreServer import open_vector_store
+from benchmarks.fakes import FakeEmbeddings
+
+
+class FailingEmbeddings(FakeEmbeddings):
+    """Fails (not retryably) once fail_after batches were embedded."""
+
+    fail_after: int = 1
+
+    def embed_documents(self, texts):
+        if self.calls >= self.fail_after:
+            raise ValueError("embedding model rejected the batch")
+        return super().embed_documents(texts)
+
+
+@pytest.fixture
+def make_worker(tmp_path, monkeypatch):
+    monkeypatch.delenv("CHROMA_HOST", raising=False)
+
+    def make(embeddings):
+        return IngestionWorker(
+            job_store=IngestionJobStore(str(tmp_path / "ingestion_jobs.db")),
+            vector_store=open_vector_store(
+                "test_collection", str(tmp_path / "chroma_db")
+            ),
+            text_splitter=RecursiveCharacterTextSplitter(
+                chunk_size=200, chunk_overlap=0
+            ),
+            file_registry=FileRegistry(str(tmp_path / "file_registry.db")),
+            embedder=BatchEmbedder(embeddings, batch_size=4, max_in_flight=1),
+            spool_dir=str(tmp_path / "spool"),
+            keyword_index=KeywordIndex(str(tmp_path / "keyword.db")),
+        )
+
+    return make
+
+
+def run_upload(worker, tmp_path, filename, content):
+    spool_path = str(tmp_path / "spool" / filename)
+    worker._write_spool(spool_path, content)
+    job = worker.job_store.create_job("book", filename, spool_path, len(content))
+    assert worker._run_job(job["job_id"])
+    return worker.job_store.get_job(job["job_id"])
+
+
+def assert_nothing_stored(worker):
+    assert worker.file_registry.list_files() == []
+    assert worker.vector_store._collection.count() == 0
+    assert worker.keyword_index.stats()["chunks"] == 0
+
+
+@pytest.mark.parametrize("content", [b"", b"%PDF-1.7 not really a PDF"])
+def test_broken_pdf_is_not_listed(make_worker, tmp_path, content):
+    worker = make_worker(FakeEmbeddings(size=8))
+
+    job = run_upload(worker, tmp_path, "broken.pdf", content)
+
+    assert job["status"] == FAILED
+    assert "Could not process PDF file" in job["error"]
+    assert_nothing_stored(worker)
+
+
+def test_failure_after_stored_batches_removes_them(make_worker, tmp_path):
+    worker = make_worker(FailingEmbeddings(size=8, fail_after=2))
+    content = "\n\n".join(f"Paragraph {i}. " + "word " * 30 for i in range(40))
+
+    job = run_upload(worker, tmp_path, "book.txt", content.encode())
+
+    assert job["status"] == FAILED
+    assert job["chunks_embedded"] > 0  # Some batches were stored first
+    assert_nothing_stored(worker)
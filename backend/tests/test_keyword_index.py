@@ -0,0 +1,61 @@
+"""
+BM25 keyword index on a temporary SQLite database.
+
+    cd backend && python -m pytest tests
+"""
+
+from KeywordIndex import KeywordIndex
+
+
+def test_name_in_most_chunks_is_still_retrieved(tmp_path):
+    index = KeywordIndex(str(tmp_path / "keyword.db"))
+    texts = [
+        f"Elizabeth walked to the village on day {i}." if i % 10 else f"Rain {i}."
+        for i in range(50)
+    ]
+    index.add_chunks("book", [f"book:{i}" for i in range(50)], texts)
+
+    results = index.search("Elizabeth", k=5)
+
+    mentions = {f"book:{i}" for i, text in enumerate(texts) if "Elizabeth" in text}
+    assert len(results) == 5
+    assert {chunk_id for chunk_id, _ in results} <= mentions
+
+
+def test_rarer_and_denser_matches_score_higher(tmp_path):
+    index = KeywordIndex(str(tmp_path / "keyword.db"))
+    texts = [
+        "Marta baked bread in the village.",
+        "Marta and Zebedee argued about bread.",
+        "Zebedee. Zebedee! Zebedee?",
+        "The village slept.",
+    ]
+    index.add_chunks("book", [f"book:{i}" for i in range(4)], texts)
+
+    ranked = [chunk_id for chunk_id, _ in index.search("Zebedee bread")]
+
+    assert ranked == ["book:1", "book:2", "book:0"]
+
+
+def test_inactive_files_and_chunks_past_the_reading_position_are_skipped(tmp_path):
+    index = KeywordIndex(str(tmp_path / "keyword.db"))
+    index.add_chunks(
+        "book",
+        ["book:0", "book:1"],
+        ["Zebedee arrives.", "Zebedee leaves."],
+        [{"chapter_end": 1}, {"chapter_end": 5}],
+    )
+    index.add_chunks("notes", ["notes:0"], ["Zebedee notes."])
+
+    def found(**kwargs):
+        return {chunk_id for chunk_id, _ in index.search("Zebedee", **kwargs)}
+
+    assert found() == {"book:0", "book:1", "notes:0"}
+    assert found(read_up_to=[{"file_id": "book", "chapter": 2}]) == {
+        "book:0",
+        "notes:0",
+    }
+    index.set_active("notes", False)
+    assert found() == {"book:0", "book:1"}
+    index.delete_file("book")
+    assert found() == set()
@@ -0,0 +1,27 @@
+"""
+Keyword relevance used by RAGChain.rank_documents: whole words only.
+
+    cd backend && python -m pytest tests
+"""
+
+from DocProcessing import keyword_matches, keyword_tokens
+
+
+def test_keyword_matches_counts_whole_words_only():
+    tokens = keyword_tokens("Where did the storm hit Marta's mill?")
+
+    assert keyword_matches("Marta ran to the mill; the storm hit.", tokens) == 5
+    assert keyword_matches("There, the stormy millers hid.", tokens) == 1
+    assert keyword_matches("", tokens) == 0
+
+
+def test_keyword_matches_agrees_with_tokenizing_the_text():
+    tokens = keyword_tokens("why did marta count the sacks before the storm")
+    texts = [
+        "Marta counted the sacks. The storm came before dawn.",
+        "the_sacks and (storm) — why? Did MARTA? théstorm",
+        "Before, before, BEFORE",
+    ]
+
+    for text in texts:
+        assert keyword_matches(text, tokens) == len(keyword_tokens(text) & tokens)
@@ -0,0 +1,21 @@
+"""
+Service container: lazy builds and overrides restored after a test.
+
+    cd backend && python -m pytest tests
+"""
+
+from Services import ServiceContainer
+
+
+def test_overridden_restores_previous_instances():
+    services = ServiceContainer()
+    services.register("store", lambda: "built store")
+    services.register("client", lambda: "built client")
+    assert services.store == "built store"
+
+    with services.overridden(store="fake store", client="fake client"):
+        assert (services.store, services.client) == ("fake store", "fake client")
+
+    assert services.store == "built store"
+    assert not services.is_created("client")
+    assert services.client == "built client"
@@ -0,0 +1,63 @@
+"""
+Per-reader conversation memory: window, LRU eviction and expiry.
+
+    cd backend && python -m pytest tests
+"""
+
+import time
+
+from SessionStore import SessionStore
+
+
+def test_history_keeps_the_last_k_turns():
+    store = SessionStore(memory_window_k=2)
+    for i in range(3):
+        store.save_turn("reader", f"question {i}", f"answer {i}")
+
+    assert store.history("reader") == (
+        "Human: question 1\nAI: answer 1\nHuman: question 2\nAI: answer 2"
+    )
+    assert store.history("other") == ""
+
+
+def test_least_recently_used_session_is_evicted_past_max_sessions():
+    store = SessionStore(max_sessions=2)
+    store.save_turn("a", "q", "a")
+    store.save_turn("b", "q", "b")
+    store.history("a")  # "b" is now the least recently used
+    store.save_turn("c", "q", "c")
+
+    assert store.history("a") != ""
+    assert store.history("b") == ""
+    assert store.stats()["evictions"] >= 1
+
+
+def test_sessions_are_evicted_past_max_bytes_but_not_the_current_one():
+    store = SessionStore(max_bytes=100)
+    store.save_turn("a", "q" * 40, "a" * 40)
+    store.save_turn("b", "q" * 40, "b" * 40)
+
+    assert store.history("a") == ""
+    assert store.stats()["size_bytes"] == 80
+
+    store.save_turn("b", "q" * 200, "b" * 200)  # Alone over the limit: kept
+    assert store.stats()["sessions"] == 1
+
+
+def test_idle_sessions_expire():
+    store = SessionStore(ttl_seconds=0.05)
+    store.save_turn("reader", "q", "a")
+    time.sleep(0.1)
+
+    assert store.stats()["sessions"] == 0
+    assert store.stats()["expirations"] == 1
+    assert store.history("reader") == ""
+
+
+def test_clear_forgets_a_session():
+    store = SessionStore()
+    store.save_turn("reader", "q", "a")
+
+    assert store.clear("reader")
+    assert not store.clear("reader")
+    assert store.history("reader") == ""
@@ -0,0 +1,43 @@
+"""
+Text normalizer against the golden corpus (the output of the original regex
+formatter), whole and streamed in arbitrary pieces.
+
+    cd backend && python -m pytest tests
+"""
+
+import json
+import random
+
+import pytest
+
+from DocProcessing import text_normalizer
+from benchmarks.bench_normalizer import GOLDEN_PATH
+
+with open(GOLDEN_PATH, encoding="utf-8") as golden_file:
+    GOLDEN_CASES = json.load(golden_file)
+
+
+def random_pieces(text: str, rng: random.Random) -> list:
+    """text split at random positions, empty pieces included."""
+    cuts = sorted(rng.randint(0, len(text)) for _ in range(rng.randint(0, 8)))
+    bounds = [0, *cuts, len(text)]
+    return [text[start:end] for start, end in zip(bounds, bounds[1:])]
+
+
+@pytest.mark.parametrize("case", GOLDEN_CASES, ids=lambda case: case["name"])
+def test_normalize_matches_golden(case):
+    assert text_normalizer.normalize(case["input"]) == case["expected"]
+
+
+@pytest.mark.parametrize("case", GOLDEN_CASES, ids=lambda case: case["name"])
+def test_iter_normalize_matches_golden_in_pieces(case):
+    text, expected = case["input"], case["expected"]
+    # Pieces of every size, so each boundary position is hit
+    for size in range(1, len(text) + 1):
+        pieces = [text[i : i + size] for i in range(0, len(text), size)]
+        assert "".join(text_normalizer.iter_normalize(pieces)) == expected, size
+
+    rng = random.Random(case["name"])
+    for _ in range(50):
+        pieces = random_pieces(text, rng)
+        assert "".join(text_normalizer.iter_normalize(pieces)) == expected, pieces
@@ -1,6 +1,6 @@
 import './App.css'
 import { useState, useEffect, useRef } from 'react'
-import type { ChatMessage, UploadedFile, Citation } from './types'
+import type { ChatMessage, UploadedFile, Citation, IngestionJob, StreamFrame } from './types'
 import { ThemeProvider } from './context/ThemeContext'
 import Sidebar from './components/Sidebar/Sidebar'
 import ChatContainer from './components/Chat/ChatContainer'
@@ -17,6 +17,8 @@ function App() {
   const [isSidebarOpen, setIsSidebarOpen] = useState<boolean>(true);
 
   const chatEndRef = useRef<HTMLDivElement>(null);
+  // Conversation memory on the backend is kept per session
+  const sessionIdRef = useRef<string>(crypto.randomUUID());
 
   const backendUrl = 'http://localhost:8000';
 
@@ -57,6 +59,20 @@ function App() {
     setQuery(event.target.value);
   };
 
+  const waitForIngestionJob = async (jobId: string): Promise<IngestionJob> => {
+    while (true) {
+      const response = await fetch(`${backendUrl}/jobs/${jobId}`);
+      if (!response.ok) {
+        throw new Error(`Could not get ingestion job status: ${response.statusText}`);
+      }
+      const { job } = await response.json();
+      if (['completed', 'failed', 'cancelled'].includes(job.status)) {
+        return job;
+      }
+      await new Promise(resolve => setTimeout(resolve, 1000));
+    }
+  };
+
   const handleFileChange = async (event: React.ChangeEvent<HTMLInputElement>) => {
     if (event.target.files && event.target.files[0]) {
       const file = event.target.files[0];
@@ -74,6 +90,15 @@ function App() {
 
         if (res.ok) {
           const result = await res.json();
+
+          // Ingestion runs in the background, wait for the job to finish
+          const job = await waitForIngestionJob(result.job_id);
+          if (job.status !== 'completed') {
+            setToastMessage(`Upload failed: ${job.error || job.status}`);
+            setIsToastVisible(true);
+            return;
+          }
+
           setToastMessage("✅ File uploaded successfully!");
           setIsToastVisible(true);
 
@@ -169,6 +194,7 @@ function App() {
         headers: {
           'Content-Type': 'application/json',
         },
+        body: JSON.stringify({ session_id: sessionIdRef.current }),
       });
 
       if (response.ok) {
@@ -236,7 +262,7 @@ function App() {
       return;
     }
 
-    const websocket = new WebSocket(`${backendUrl}/ws/stream`);
+    const websocket = new WebSocket(`${backendUrl}/ws/stream`, 'coreader.v2');
     setIsStreaming(true);
 
     let aiMessageId = 'ai-' + Date.now();
@@ -252,49 +278,53 @@ function App() {
     setChatMessages(prevMessages => [...prevMessages, initialAiMessage]);
 
     websocket.onopen = () => {
-      websocket.send(JSON.stringify({ query }));
+      websocket.send(JSON.stringify({ type: 'query', query, session_id: sessionIdRef.current }));
       setQuery('');
     };
 
     websocket.onmessage = (event) => {
-      const data = event.data;
-      if (data === '<<END>>') {
-        setIsStreaming(false);
-        websocket.close();
-        return;
-      }
-      if (data === '<<E:NO_QUERY>>') {
-        currentAiContent = 'Error: No query provided.';
-        setChatMessages(prevMessages =>
-          prevMessages.map(msg =>
-            msg.id === aiMessageId ? { ...msg, content: currentAiContent } : msg
-          )
-        );
-        setIsStreaming(false);
-        websocket.close();
+      let frame: StreamFrame;
+      try {
+        frame = JSON.parse(event.data);
+      } catch (error) {
+        console.error('Error parsing stream frame:', error);
         return;
       }
-      if (data.startsWith('<<CITATIONS>>')) {
-        try {
-          const citationsJson = data.replace('<<CITATIONS>>', '');
-          citations = JSON.parse(citationsJson);
+      switch (frame.type) {
+        case 'token':
+          currentAiContent += frame.text;
+          setChatMessages(prevMessages =>
+            prevMessages.map(msg =>
+              msg.id === aiMessageId ? { ...msg, content: currentAiContent } : msg
+            )
+          );
+          return;
+        case 'citations':
+          citations = frame.citations;
           setChatMessages(prevMessages =>
             prevMessages.map(msg =>
               msg.id === aiMessageId ? { ...msg, citations } : msg
             )
           );
-        } catch (error) {
-          console.error('Error parsing citations:', error);
-        }
-        return;
+          return;
+        case 'end':
+        case 'cancelled':
+          setIsStreaming(false);
+          websocket.close();
+          return;
+        case 'error':
+          currentAiContent = frame.code === 'NO_QUERY'
+            ? 'Error: No query provided.'
+            : `Error: ${frame.message}`;
+          setChatMessages(prevMessages =>
+            prevMessages.map(msg =>
+              msg.id === aiMessageId ? { ...msg, content: currentAiContent } : msg
+            )
+          );
+          setIsStreaming(false);
+          websocket.close();
+          return;
       }
-      
-      currentAiContent += data;
-      setChatMessages(prevMessages =>
-        prevMessages.map(msg =>
-          msg.id === aiMessageId ? { ...msg, content: currentAiContent } : msg
-        )
-      );
     };
 
     websocket.onerror = (error) => {
@@ -26,7 +26,10 @@ const Citations: React.FC<CitationsProps> = ({ citations }) => {
           {citations.map((citation, index) => (
             <div key={index} className="citation-item">
               <div className="citation-header">
-                <span className="citation-filename">📄 {citation.filename}</span>
+                <span className="citation-filename">
+                  📄 {citation.filename}
+                  {citation.page != null && ` · p. ${citation.page}`}
+                </span>
               </div>
               <div className="citation-content">
                 {citation.content}
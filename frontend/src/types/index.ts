@@ -8,8 +8,34 @@ export interface Citation {
   content: string;
   filename: string;
   file_id: string;
+  page?: number | null;
+  chapter?: number | null;
 }
 
+export interface IngestionJob {
+  job_id: string;
+  file_id: string;
+  filename: string;
+  status: 'queued' | 'running' | 'completed' | 'failed' | 'cancelled';
+  stage: string | null;
+  pages_parsed: number;
+  pages_total: number | null;
+  chunks_embedded: number;
+  chunks_total: number | null;
+  eta_seconds: number | null;
+  error: string | null;
+}
+
+// Frames of the /ws/stream protocol v2 (subprotocol "coreader.v2")
+export type StreamFrame =
+  | { type: 'hello'; v: number; session_id: string }
+  | { type: 'start'; turn: number; id?: string }
+  | { type: 'token'; text: string }
+  | { type: 'citations'; turn: number; citations: Citation[] }
+  | { type: 'end'; turn: number }
+  | { type: 'cancelled'; turn: number; reason: 'superseded' | 'client' }
+  | { type: 'error'; code: string; message: string; turn?: number };
+
 export interface ChatMessage {
   id: string;
   type: 'user' | 'ai';